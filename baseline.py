@@ -0,0 +1,505 @@
+"""
+The module baseline for web-app ArDi (ArDI (Advanced spectRa Deconvolution Instrument)) contains the helpers for baseline
+construction used by FittingMap and finder modules.
+
+"""
+__author__ = "Roman Shendrik"
+__copyright__ = "Copyright © 2023R"
+__license__ = "GNU GPL 3.0"
+__version__ = "0.4.0"
+
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from scipy.linalg import cholesky_banded, cho_solve_banded
+import nativelib as nl
+
+# Available ALS engines: the prebuilt convolution.so/convolution.dll library and the banded solver below
+BACKENDS = ('native', 'numpy')
+default_backend = 'native'
+# Available baseline methods: asymmetric least squares, asymmetrically reweighted and adaptive iteratively reweighted
+# penalized least squares
+METHODS = ('als', 'arpls', 'airpls')
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+IterInfo = namedtuple('IterInfo', ['calls', 'iterations', 'max_iterations'])
+
+
+class BaselineCache(object):
+    """
+    Bounded LRU cache of the constructed baselines.
+    The least_squares solver evaluates the bg_ component with the same t, lam and p many times (every column of the
+    finite-difference Jacobian of the peak parameters), so the baselines are stored with the key
+    (spectrum fingerprint, lam, p, niter, backend, tol) and served from memory on the repeated calls.
+    Attributes:
+        maxsize(int): maximal number of the stored baselines
+        hits(int): number of the calls served from the cache
+        misses(int): number of the calls which required the baseline calculation
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__data__ = OrderedDict()
+        self.__lock__ = threading.Lock()
+
+    @staticmethod
+    def fingerprint(t):
+        """
+        Return the digest of the y-values of the spectrum
+        Args:
+            t(floats): array-like y-values of the spectrum
+        Returns:
+            digest(bytes): blake2b digest of the float64 array
+        """
+        t = np.ascontiguousarray(t, dtype=np.float64)
+        return hashlib.blake2b(t.tobytes(), digest_size=16).digest()
+
+    def key(self, t, lam, p, niter, backend='native', tol=0.0):
+        """
+        Return the cache key of the baseline
+        Args:
+            t(floats): input y array for baseline construction
+            lam(double): 2nd derivative constraint
+            p(double): Weighting of positive residuals
+            niter(int): Maximum number of iterations
+            backend(str): ALS engine or baseline method which constructs the baseline
+            tol(double): tolerance of the early stopping
+        """
+        return self.fingerprint(t), len(t), float(lam), float(p), int(niter), backend, float(tol)
+
+    def get(self, key):
+        """
+        Return the copy of the stored baseline or None if the key is absent
+        """
+        with self.__lock__:
+            value = self.__data__.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.__data__.move_to_end(key)
+            self.hits += 1
+        return value.copy()
+
+    def put(self, key, value):
+        """
+        Store the baseline. The least recently used baseline is dropped if the cache is full
+        """
+        if self.maxsize <= 0:
+            return
+        with self.__lock__:
+            self.__data__[key] = np.array(value, dtype=np.float64)
+            self.__data__.move_to_end(key)
+            while len(self.__data__) > self.maxsize:
+                self.__data__.popitem(last=False)
+
+    def cache_info(self):
+        """
+        Return the statistics of the cache as CacheInfo(hits, misses, maxsize, currsize)
+        """
+        with self.__lock__:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self.__data__))
+
+    def cache_clear(self):
+        """
+        Remove all stored baselines and reset the counters
+        """
+        with self.__lock__:
+            self.__data__.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class IterationStats(object):
+    """
+    Counters of the ALS reweighting iterations. The iterations actually used by the baseline constructions are compared
+    with the maximal number of iterations (niter) to see the saving of the early stopping.
+    Attributes:
+        calls(int): number of the baseline constructions
+        iterations(int): total number of the used iterations
+        max_iterations(int): total number of the allowed iterations (sum of niter)
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.iterations = 0
+        self.max_iterations = 0
+        self.__lock__ = threading.Lock()
+
+    def record(self, n_iter, niter):
+        """
+        Add the baseline construction which used n_iter iterations of niter allowed
+        """
+        with self.__lock__:
+            self.calls += 1
+            self.iterations += int(n_iter)
+            self.max_iterations += int(niter)
+
+    def info(self):
+        """
+        Return the counters as IterInfo(calls, iterations, max_iterations)
+        """
+        with self.__lock__:
+            return IterInfo(self.calls, self.iterations, self.max_iterations)
+
+    def clear(self):
+        """
+        Reset the counters
+        """
+        with self.__lock__:
+            self.calls = 0
+            self.iterations = 0
+            self.max_iterations = 0
+
+
+# The cache and the counters are shared by all FittingMap instances of the process
+als_cache = BaselineCache(maxsize=128)
+als_stats = IterationStats()
+# Default tolerance of the weight vector change: the reweighting stops when the weights are not changed
+default_tol = 0.0
+
+
+def check_backend(backend):
+    """
+    Return the name of ALS engine. None means default_backend. The numpy backend is returned if the native library is
+    not loaded
+    """
+    if backend is None:
+        backend = default_backend
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown ALS backend {backend}. Available backends: {", ".join(BACKENDS)}')
+    if backend == 'native' and not nl.available:
+        backend = 'numpy'
+    return backend
+
+
+@functools.lru_cache(maxsize=16)
+def __penalty_band__(n):
+    """
+    Return the upper banded form (3, n) of the pentadiagonal matrix D'D, where D is the (n-2, n) matrix of the second
+    differences. The array is shared between all calls with the same length of the spectrum and must not be changed.
+    """
+    if n < 3:
+        raise ValueError('ALS baseline requires at least 3 points')
+    coef = np.array([1.0, -2.0, 1.0])
+    band = np.zeros((3, n))
+    for a in range(3):
+        band[2, a:n - 2 + a] += coef[a] ** 2
+    for a in range(2):
+        band[1, a + 1:n - 1 + a] += coef[a] * coef[a + 1]
+    band[0, 2:] = coef[0] * coef[2]
+    band.setflags(write=False)
+    return band
+
+
+def __whittaker__(band, w, y):
+    """
+    Solve the pentadiagonal system (W + lam*D'D)z = Wy by the banded Cholesky factorization.
+        Args:
+            band: (3, n) upper banded form of lam*D'D
+            w: weights of the points
+            y: input y array
+        Returns:
+            z: the solution
+    """
+    ab = np.empty_like(band)
+    ab[:2] = band[:2]
+    ab[2] = band[2] + w
+    cb = cholesky_banded(ab, overwrite_ab=True, lower=False, check_finite=False)
+    return cho_solve_banded((cb, False), w * y, overwrite_b=True, check_finite=False)
+
+
+def als_numpy(y, lam, p, niter=10, tol=0.0, full_output=False):
+    """Baseline reconstruct using ALS algorithm with the banded Cholesky solver of scipy
+        https://zanran_storage.s3.amazonaws.com/www.science.uva.nl/ContentPages/443199618.pdf
+        Asymmetric Least Squares Smoothing
+        The system (W + lam*D'D)z = Wy is pentadiagonal. The off-diagonal bands lam*D'D are built once and only the
+        main diagonal is replaced on every reweighting step, so each iteration costs one O(n) factorization.
+        The reweighting stops when the fraction of points whose weight is changed is not larger than tol. With tol=0
+        the iterations stop when the weights are not changed, so the result is the same as after niter iterations.
+        Args:
+            y: input y array for baseline construction
+            lam: 2nd derivative constraint
+            p: Weighting of positive residuals
+            niter: Maximum number of iterations
+            tol: tolerance of the weight vector change
+            full_output: return the number of the used iterations too
+        Returns:
+            z: array with constructed baseline with length of input y array
+            n_iter: number of the used iterations (if full_output is True)
+    """
+    y = np.asarray(y, dtype=np.float64)
+    band = lam * __penalty_band__(len(y))
+    w = np.ones(len(y))
+    z = y.copy()
+    n_iter = 0
+    while n_iter < niter:
+        z = __whittaker__(band, w, y)
+        n_iter += 1
+        w_new = p * (y > z) + (1 - p) * (y < z)
+        changed = np.count_nonzero(w_new != w)
+        w = w_new
+        if changed <= tol * len(y):
+            break
+    if full_output:
+        return z, n_iter
+    return z
+
+
+def arpls_numpy(y, lam, niter=50, tol=1e-3, full_output=False):
+    """Baseline reconstruct using arPLS algorithm (asymmetrically reweighted penalized least squares)
+        S.-J. Baek, A. Park, Y.-J. Ahn, J. Choo, Analyst 140 (2015) 250-257
+        The weights are the logistic function of the residuals normalized by the mean and standard deviation of the
+        negative residuals (noise estimation), so the asymmetry parameter p is not required.
+        Args:
+            y: input y array for baseline construction
+            lam: 2nd derivative constraint
+            niter: Maximum number of iterations
+            tol: the iterations stop when the relative change of the weight vector is less than tol
+            full_output: return the number of the used iterations too
+        Returns:
+            z: array with constructed baseline with length of input y array
+            n_iter: number of the used iterations (if full_output is True)
+    """
+    y = np.asarray(y, dtype=np.float64)
+    band = lam * __penalty_band__(len(y))
+    w = np.ones(len(y))
+    z = y.copy()
+    n_iter = 0
+    while n_iter < niter:
+        z = __whittaker__(band, w, y)
+        n_iter += 1
+        d = y - z
+        dn = d[d < 0]
+        if len(dn) < 2:
+            break
+        m = dn.mean()
+        s = dn.std()
+        if s == 0:
+            break
+        w_new = 1.0 / (1.0 + np.exp(np.clip(2.0 * (d - (2.0 * s - m)) / s, -700.0, 700.0)))
+        change = np.linalg.norm(w_new - w) / np.linalg.norm(w)
+        w = w_new
+        if change < tol:
+            break
+    if full_output:
+        return z, n_iter
+    return z
+
+
+def airpls_numpy(y, lam, niter=50, tol=1e-3, full_output=False):
+    """Baseline reconstruct using airPLS algorithm (adaptive iteratively reweighted penalized least squares)
+        Z.-M. Zhang, S. Chen, Y.-Z. Liang, Analyst 135 (2010) 1138-1146
+        The points above the baseline get zero weights, the weights of the points below the baseline grow exponentially
+        with the iteration number. The 2nd derivative penalty is used as in ALS.
+        Args:
+            y: input y array for baseline construction
+            lam: 2nd derivative constraint
+            niter: Maximum number of iterations
+            tol: the iterations stop when the sum of the negative residuals is less than tol*sum(|y|)
+            full_output: return the number of the used iterations too
+        Returns:
+            z: array with constructed baseline with length of input y array
+            n_iter: number of the used iterations (if full_output is True)
+    """
+    y = np.asarray(y, dtype=np.float64)
+    band = lam * __penalty_band__(len(y))
+    w = np.ones(len(y))
+    z = y.copy()
+    y_norm = np.abs(y).sum()
+    n_iter = 0
+    while n_iter < niter:
+        z = __whittaker__(band, w, y)
+        n_iter += 1
+        d = y - z
+        neg = d < 0
+        dssn = -d[neg].sum()
+        if dssn <= tol * y_norm:
+            break
+        w = np.where(neg, np.exp(n_iter * np.abs(d) / dssn), 0.0)
+        w[0] = w[-1] = np.exp(n_iter * np.abs(d[neg]).max() / dssn)
+    if full_output:
+        return z, n_iter
+    return z
+
+
+def make_baseline(y, lam, p=0.01, method='als', niter=None, tol=None, backend=None, full_output=False):
+    """Common interface of the baseline methods
+        Args:
+            y: input y array for baseline construction
+            lam: 2nd derivative constraint
+            p: Weighting of positive residuals (als only)
+            method: 'als', 'arpls' or 'airpls'
+            niter: Maximum number of iterations. By default 10 for als and 50 for arpls and airpls
+            tol: tolerance of the early stopping (see als_numpy, arpls_numpy, airpls_numpy). By default default_tol
+                for als and 1e-3 for arpls and airpls
+            backend: ALS engine 'native' or 'numpy' (als only)
+            full_output: return the number of the used iterations too
+        Returns:
+            z: array with constructed baseline with length of input y array
+            n_iter: number of the used iterations (if full_output is True)
+    """
+    if method not in METHODS:
+        raise ValueError(f'Unknown baseline method {method}. Available methods: {", ".join(METHODS)}')
+    if method == 'als':
+        niter = 10 if niter is None else niter
+        tol = default_tol if tol is None else tol
+        if check_backend(backend) == 'numpy':
+            return als_numpy(y, lam, p, niter, tol, full_output)
+        z = nl.als(y, lam, p, niter)
+        return (z, niter) if full_output else z
+    niter = 50 if niter is None else niter
+    tol = 1e-3 if tol is None else tol
+    if method == 'arpls':
+        return arpls_numpy(y, lam, niter, tol, full_output)
+    return airpls_numpy(y, lam, niter, tol, full_output)
+
+
+def als_jacobian(y, z, lam, p):
+    """Derivatives of the ALS baseline by lam and p.
+        The baseline z is the solution of (W + lam*D'D)z = Wy with the weights w = p (y > z), 1 - p (y < z). The weights
+        are constant near the converged solution, so the implicit differentiation of the linear system gives
+            dz/dlam = -(W + lam*D'D)^-1 D'D z
+            dz/dp = (W + lam*D'D)^-1 S (y - z), S = diag(+1 (y > z), -1 (y < z))
+        Both columns are obtained with one banded Cholesky factorization.
+        Args:
+            y: input y array of the baseline construction
+            z: constructed baseline
+            lam: 2nd derivative constraint
+            p: Weighting of positive residuals
+        Returns:
+            jac: (n, 2) array with dz/dlam and dz/dp columns
+    """
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+    sign = (y > z).astype(np.float64) - (y < z)
+    w = p * (y > z) + (1 - p) * (y < z)
+    ab = lam * __penalty_band__(len(y))
+    ab[2] += w
+    rhs = np.empty((len(y), 2))
+    rhs[:, 0] = -np.convolve(np.diff(z, 2), [1.0, -2.0, 1.0])
+    rhs[:, 1] = sign * (y - z)
+    cb = cholesky_banded(ab, overwrite_ab=True, lower=False, check_finite=False)
+    return cho_solve_banded((cb, False), rhs, overwrite_b=True, check_finite=False)
+
+
+def __als_batch_chunk__(Y, lam, p, niter, tol=0.0):
+    """
+    Vectorized ALS for the chunk of spectra of the same length.
+    The pentadiagonal systems (W_k + lam*D'D)z_k = W_k y_k differ only by the main diagonal, so the LDL' factorization
+    is performed for all spectra at once: the loop runs over the points and numpy operations run over the spectra.
+    The iterations stop when the weights of all spectra of the chunk are converged (see als_numpy).
+        Args:
+            Y: (m, n) array of the spectra
+        Returns:
+            Z: (m, n) array of the baselines
+            n_iter: (m,) array of the numbers of iterations after which the weights of the spectra are converged
+    """
+    m, n = Y.shape
+    band = lam * __penalty_band__(n)
+    a = band[2]
+    e = band[1, 1:]
+    f = band[0, 2:]
+    y = np.ascontiguousarray(Y.T, dtype=np.float64)
+    w = np.ones((n, m))
+    delta = np.empty((n, m))
+    l1 = np.zeros((n, m))
+    l2 = np.zeros((n, m))
+    u = np.zeros(m)
+    z = np.empty((n, m))
+    n_iter = np.zeros(m, dtype=int)
+    active = np.ones(m, dtype=bool)
+    for _ in range(niter):
+        # factorization (W + lam*D'D) = L*diag(delta)*L', u = l1*delta
+        for i in range(n):
+            d = a[i] + w[i]
+            if i >= 1:
+                d -= u * l1[i - 1]
+            if i >= 2:
+                d -= f[i - 2] * l2[i - 2]
+            delta[i] = d
+            if i < n - 1:
+                if i >= 1:
+                    u = e[i] - u * l2[i - 1]
+                else:
+                    u = np.full(m, e[0])
+                np.divide(u, d, out=l1[i])
+            if i < n - 2:
+                np.divide(f[i], d, out=l2[i])
+        # forward and backward substitution
+        r = w * y
+        for i in range(1, n):
+            r[i] -= l1[i - 1] * r[i - 1]
+            if i >= 2:
+                r[i] -= l2[i - 2] * r[i - 2]
+        r /= delta
+        for i in range(n - 2, -1, -1):
+            r[i] -= l1[i] * r[i + 1]
+            if i <= n - 3:
+                r[i] -= l2[i] * r[i + 2]
+        z = r
+        n_iter[active] += 1
+        w_new = p * (y > z) + (1 - p) * (y < z)
+        active &= np.count_nonzero(w_new != w, axis=0) > tol * n
+        w = w_new
+        if not active.any():
+            break
+    return z.T.copy(), n_iter
+
+
+def baseline_als_batch(Y, lam, p, niter=10, backend=None, workers=None, tol=0.0, full_output=False):
+    """Baseline reconstruct using ALS algorithm for the set of spectra of the same length (e.g. hyperspectral map)
+        Args:
+            Y: (n_pixels, n_points) array of the spectra
+            lam: 2nd derivative constraint
+            p: Weighting of positive residuals
+            niter: Maximum number of iterations
+            backend: ALS engine. 'numpy' solves the chunks of spectra by vectorized LDL' factorization with the shared
+                difference matrix; 'native' calls the library for every spectrum and writes the baseline directly
+                into the output array. By default baseline.default_backend is used.
+            workers: number of threads of the native engine (the library releases GIL). By default the number of
+                CPUs. The numpy engine runs in the calling thread: its loop over the points is bound by the interpreter,
+                so the threads do not spread it over the CPUs
+            tol: tolerance of the weight vector change (see als_numpy). The native engine always makes niter iterations
+            full_output: return the numbers of the used iterations too
+        Returns:
+            Z: (n_pixels, n_points) array of the baselines
+            n_iter: (n_pixels,) array of the numbers of the used iterations (if full_output is True)
+    """
+    Y = np.ascontiguousarray(Y, dtype=np.float64)
+    if Y.ndim != 2:
+        raise ValueError('Y should be (n_pixels, n_points) array')
+    backend = check_backend(backend)
+    if backend != 'native':
+        workers = 1
+    elif workers is None:
+        workers = os.cpu_count() or 1
+    m, n = Y.shape
+    Z = np.empty_like(Y)
+    n_iter = np.full(m, niter, dtype=int)
+    if m == 0:
+        return (Z, n_iter) if full_output else Z
+    if backend == 'native':
+        def solve(rows):
+            for i in range(rows.start, rows.stop):
+                nl.als(Y[i], lam, p, niter, out=Z[i])
+    else:
+        def solve(rows):
+            Z[rows], n_iter[rows] = __als_batch_chunk__(Y[rows], lam, p, niter, tol)
+    # about 8 Mb per work array of the chunk
+    size = max(1, min(2 ** 20 // max(n, 1), -(-m // workers)))
+    chunks = [slice(start, min(start + size, m)) for start in range(0, m, size)]
+    if workers == 1 or len(chunks) == 1:
+        for rows in chunks:
+            solve(rows)
+    else:
+        with ThreadPool(processes=min(workers, len(chunks))) as pool:
+            pool.map(solve, chunks)
+    if full_output:
+        return Z, n_iter
+    return Z
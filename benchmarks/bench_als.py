@@ -0,0 +1,40 @@
+"""
+Benchmark of the ALS baseline engines: native convolution.so/convolution.dll against the numpy banded solver.
+The numpy engine stops the reweighting when the weights are converged; the mean number of the used iterations is
+printed in the last column (the native engine always makes niter iterations).
+Usage: python benchmarks/bench_als.py
+"""
+import os, sys
+import time as tm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+import fittingmap as fm
+import nativelib as nl
+import baseline as bsl
+
+repeat = 20
+lam = 1e7
+p = 0.01
+rng = np.random.default_rng(0)
+print('points\tnative, ms\tnumpy, ms\tmax|diff|\tnumpy iterations')
+for n in (1000, 2000, 5000, 10000, 20000):
+    x = np.linspace(0, 1, n)
+    y = np.exp(-(x - 0.4) ** 2 / 1e-4) + 0.5 * np.exp(-(x - 0.7) ** 2 / 1e-3) + x ** 2 + 0.01 * rng.standard_normal(n)
+    times = {}
+    result = {}
+    for backend in bsl.BACKENDS:
+        if backend == 'native' and not nl.available:
+            continue
+        bsl.als_stats.clear()
+        time0 = tm.perf_counter()
+        for _ in range(repeat):
+            bsl.als_cache.cache_clear()
+            result[backend] = fm.FittingMap.__baseline_als__(y, lam, p, backend)
+        times[backend] = (tm.perf_counter() - time0) / repeat * 1e3
+    stats = bsl.als_stats.info()
+    iterations = f'{stats.iterations / stats.calls:.1f}/{stats.max_iterations // stats.calls}'
+    if 'native' in times:
+        diff = np.abs(result['native'] - result['numpy']).max()
+        print(f"{n}\t{times['native']:.2f}\t\t{times['numpy']:.2f}\t\t{diff:.2e}\t{iterations}")
+    else:
+        print(f"{n}\t-\t\t{times['numpy']:.2f}\t\t-\t\t{iterations}")
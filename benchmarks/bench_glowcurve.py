@@ -0,0 +1,48 @@
+"""
+Benchmark of the glow curves: throughput in ns per (peak x point) of the native TSLCalc/TDCalc called peak by peak (as
+the TSL_ and TD_ models of fittingmap before glowcurve) and of glowcurve.glow_peaks evaluated for all peaks at once. The
+error column is the maximal deviation of the normalized numpy curves from the native ones.
+Usage: python benchmarks/bench_glowcurve.py [number of peaks] [number of points]
+"""
+import os, sys
+import time as tm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+import nativelib as nl
+import glowcurve as gc
+
+number_of_peaks = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+points = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+repeat = 10
+rng = np.random.default_rng(0)
+x = np.linspace(300, 700, points)
+amplitude = rng.uniform(1, 5, number_of_peaks)
+energy = np.linspace(0.7, 1.4, number_of_peaks)
+factor = 10 ** rng.uniform(10, 12, number_of_peaks)
+
+
+def timing(func):
+    func()
+    time0 = tm.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (tm.perf_counter() - time0) / repeat / (number_of_peaks * points) * 1e9
+
+
+def native(func, order):
+    out = []
+    for args in zip(factor, energy, amplitude):
+        curve = func(len(x), x.min(), x.max(), args[0], args[1], order)
+        out.append(curve * args[2] / curve.max())
+    return np.array(out)
+
+
+print(f'{number_of_peaks} peaks x {points} points')
+print('method\tnative\tnumpy\terror')
+for method, func, order, decay in (('TSL1', nl.tsl, 1, False), ('TSL2', nl.tsl, 2, False),
+                                   ('TD1', nl.td, 1, True), ('TD2', nl.td, 2, True)):
+    error = np.abs(gc.glow_peaks(x, amplitude, factor, energy, order, decay) - native(func, order)).max()
+    print(f'{method}\t{timing(lambda: native(func, order)):.1f}\t'
+          f'{timing(lambda: gc.glow_peaks(x, amplitude, factor, energy, order, decay)):.1f}\t{error:.1e}')
+order = rng.uniform(1, 2, number_of_peaks)
+print(f'TSLGO\t\t{timing(lambda: gc.glow_peaks(x, amplitude, factor, energy, order)):.1f}')
@@ -0,0 +1,42 @@
+"""
+Benchmark of the Jacobians of least square fitting: finite differences of the whole model by least_squares ('2-point'),
+finite differences of the single components ('numeric') and closed-form derivatives of the lineshapes with implicit
+differentiation of ALS baseline ('analytic'). The synthetic FTIR-like spectra contain Gaussian, Lorentzian, Voigt and
+PseudoVoigt bands on the curved background.
+Usage: python benchmarks/bench_jacobian.py [number of peaks ...]
+"""
+import os, sys
+import time as tm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+import lmfit
+import fittingmap as fm
+
+methods = ['Gaussian', 'Lorentzian', 'Voigt', 'PseudoVoigt']
+peaks = [int(arg) for arg in sys.argv[1:]] or [10, 20, 40]
+print('peaks\tjac\t\tnfev\tnjev\ttime, s\tR2')
+for number_of_peaks in peaks:
+    rng = np.random.default_rng(number_of_peaks)
+    x = np.linspace(400, 4000, 3600)
+    center = np.sort(rng.uniform(450, 3950, number_of_peaks))
+    width = rng.uniform(4, 12, number_of_peaks)
+    amplitude = rng.uniform(5, 50, number_of_peaks)
+    method = [methods[num % len(methods)] for num in range(number_of_peaks)]
+    y = 0.3 + 1e-4 * x + 0.05 * np.sin(x / 500) + 0.01 * rng.standard_normal(len(x))
+    for num in range(number_of_peaks):
+        y += getattr(lmfit.lineshapes, method[num].lower() if method[num] != 'PseudoVoigt' else 'pvoigt')(
+            x, amplitude[num], center[num], width[num])
+    for jac in ('2-point', 'numeric', 'analytic'):
+        params = {'method': method, 'center': center + rng.uniform(-2, 2, number_of_peaks), 'amplitude': amplitude,
+                  'width': width, 'baseline_auto': [1e8, 0.01, 10], 'jac': jac,
+                  'kws': {'ftol': 1e-8, 'xtol': 1e-8, 'gtol': 1e-8}}
+        limits = {'center': [[5, 5]] * number_of_peaks, 'amplitude': [[0.1, 10]] * number_of_peaks,
+                  'width': [[0.2, 5]] * number_of_peaks, 'baseline_auto': [[1e6, 1e10], [0.001, 0.1]]}
+        fit = fm.FittingMap()
+        time0 = tm.perf_counter()
+        mod = fit.__make_peaks_model__(number_of_peaks, params, limits) + fit.__make_baseline_model__(params, limits)
+        out = mod.fit(y, x=x, t=y, method='least_squares', fit_kws=fit.__fit_kws__(params, mod), max_nfev=1000,
+                      calc_covar=False)
+        elapsed = tm.perf_counter() - time0
+        print(f'{number_of_peaks}\t{jac}\t{"" if len(jac) > 7 else chr(9)}{out.nfev}\t{getattr(out, "njev", 0)}\t'
+              f'{elapsed:.2f}\t{out.rsquared:.5f}')
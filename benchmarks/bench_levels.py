@@ -0,0 +1,50 @@
+"""
+Benchmark of the coarse-to-fine schedule of fitting (params['levels']): the spectrum binned by the factor of the level
+is fitted with loose tolerance first and the fit at full resolution starts from the coarse solution. The synthetic
+spectra contain PseudoVoigt, Voigt and Lorentzian bands on the curved background, the tolerance is the default one of
+finder.fitcurve. The dR2 column is the difference of R-square of the schedule and of the direct fit (levels None), the
+schedule should not be worse than the direct fit; lam is the fitted bg_lam (the limits are 1e5..1e9).
+Usage: python benchmarks/bench_levels.py [number of points] [number of peaks]
+"""
+import os, sys
+import time as tm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+import lmfit
+import fittingmap as fm
+
+number_of_points = int(sys.argv[1]) if len(sys.argv) > 1 else 14400
+number_of_peaks = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+rng = np.random.default_rng(5)
+x = np.linspace(400, 4000, number_of_points)
+center = np.sort(rng.uniform(450, 3950, number_of_peaks))
+width = rng.uniform(5, 12, number_of_peaks)
+amplitude = rng.uniform(20, 80, number_of_peaks)
+noise = 0.01 * rng.standard_normal(len(x))
+start = {'center': center + rng.uniform(-3, 3, number_of_peaks),
+         'amplitude': amplitude * rng.uniform(0.5, 2, number_of_peaks),
+         'width': width * rng.uniform(0.7, 1.4, number_of_peaks)}
+print(f'{number_of_points} points, {number_of_peaks} peaks')
+shapes = {'PseudoVoigt': lambda *args: lmfit.lineshapes.pvoigt(x, *args, 0.5),
+          'Voigt': lambda *args: lmfit.lineshapes.voigt(x, *args),
+          'Lorentzian': lambda *args: lmfit.lineshapes.lorentzian(x, *args)}
+print('method\t\tlevels\t\t\t\tnfev\tnjev\ttime, s\tR2\t\tdR2\t\tlam')
+for method, func in shapes.items():
+    y = 0.2 + 2e-5 * x + 0.05 * np.sin(x / 600) + noise
+    for num in range(number_of_peaks):
+        y += func(amplitude[num], center[num], width[num])
+    direct = None
+    for levels in (None, [[8, 1e-6]], [[8, 1e-6], [2, 1e-8]]):
+        params = dict(start, method=[method] * number_of_peaks, baseline_auto=[1e7, 0.01, 5],
+                      kws={'ftol': 1e-15, 'xtol': 1e-15, 'gtol': 1e-15})
+        if levels is not None:
+            params['levels'] = levels
+        limits = {'center': [[8, 8]] * number_of_peaks, 'amplitude': [[0.1, 10]] * number_of_peaks,
+                  'width': [[0.3, 4]] * number_of_peaks, 'baseline_auto': [[1e5, 1e9], [1e-4, 0.1]]}
+        fit = fm.FittingMap()
+        time0 = tm.perf_counter()
+        out = fit.__fit__(y, number_of_peaks, params, limits, True, x=x, t=y, max_nfev=1000)
+        elapsed = tm.perf_counter() - time0
+        direct = out.rsquared if direct is None else direct
+        print(f'{method:<12}\t{str(levels):<24}\t{out.nfev}\t{getattr(out, "njev", 0)}\t{elapsed:.2f}\t'
+              f'{out.rsquared:.6f}\t{out.rsquared - direct:+.1e}\t{out.params["bg_lam"].value:.2e}')
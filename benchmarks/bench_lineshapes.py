@@ -0,0 +1,56 @@
+"""
+Benchmark of the peak functions: throughput in ns per (peak x point) of the lmfit built-in lineshapes evaluated peak by
+peak (as in the CompositeModel of lmfit peak models) and of the lineshapes functions evaluated for all peaks at once
+(multipeak.MultiPeakModel). The error column is the maximal deviation of the Voigt approximations from the Voigt
+profile of scipy wofz in units of the peak height.
+Usage: python benchmarks/bench_lineshapes.py [number of peaks] [number of points]
+"""
+import os, sys
+import time as tm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+import lmfit
+import lineshapes as ls
+
+number_of_peaks = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+points = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+repeat = 10
+rng = np.random.default_rng(0)
+x = np.linspace(400, 4000, points)
+amplitude = rng.uniform(5, 50, number_of_peaks)
+center = np.sort(rng.uniform(450, 3950, number_of_peaks))
+sigma = rng.uniform(4, 12, number_of_peaks)
+fraction = np.full(number_of_peaks, 0.5)
+
+
+def timing(func):
+    func()
+    time0 = tm.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (tm.perf_counter() - time0) / repeat / (number_of_peaks * points) * 1e9
+
+
+reference = ls.voigt(x, amplitude, center, sigma)
+cases = [
+    ('lmfit', 'Gaussian', lambda: [lmfit.lineshapes.gaussian(x, *args) for args in zip(amplitude, center, sigma)], None),
+    ('lmfit', 'Lorentzian', lambda: [lmfit.lineshapes.lorentzian(x, *args) for args in zip(amplitude, center, sigma)],
+     None),
+    ('lmfit', 'PseudoVoigt', lambda: [lmfit.lineshapes.pvoigt(x, *args)
+                                      for args in zip(amplitude, center, sigma, fraction)], None),
+    ('lmfit', 'Voigt', lambda: [lmfit.lineshapes.voigt(x, *args) for args in zip(amplitude, center, sigma)], None),
+    ('lineshapes', 'Gaussian', lambda: ls.gaussian(x, amplitude, center, sigma), None),
+    ('lineshapes', 'Lorentzian', lambda: ls.lorentzian(x, amplitude, center, sigma), None),
+    ('lineshapes', 'PseudoVoigt', lambda: ls.pvoigt(x, amplitude, center, sigma, fraction), None),
+    ('lineshapes', 'Voigt', lambda: ls.voigt(x, amplitude, center, sigma), None),
+    ('lineshapes', 'VoigtHumlicek', lambda: ls.voigt_humlicek(x, amplitude, center, sigma), ls.voigt_humlicek),
+    ('lineshapes', 'VoigtTCH', lambda: ls.voigt_tch(x, amplitude, center, sigma), ls.voigt_tch),
+]
+print(f'{number_of_peaks} peaks x {points} points')
+print('module\t\tmethod\t\tns/(peak*point)\terror')
+for module, method, func, approximation in cases:
+    error = ''
+    if approximation is not None:
+        deviation = np.abs(approximation(x, amplitude, center, sigma) - reference).max(axis=1)
+        error = f'{(deviation / reference.max(axis=1)).max():.1e}'
+    print(f'{module:<12}\t{method:<14}\t{timing(func):.1f}\t\t{error}')
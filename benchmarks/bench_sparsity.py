@@ -0,0 +1,49 @@
+"""
+Benchmark of the sparse Jacobian structure of the many-peak fits of long spectra: dense Jacobians against the peak
+derivatives in the windows center +/- jac_window*sigma ('analytic') and the jac_sparsity structure of the
+finite-difference scheme ('2-point'). The synthetic spectra contain Gaussian, Lorentzian, Voigt and PseudoVoigt bands on
+the curved background.
+Usage: python benchmarks/bench_sparsity.py [number of points] [number of peaks] [jac_window]
+"""
+import os, sys
+import time as tm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+import lmfit
+import fittingmap as fm
+
+methods = ['Gaussian', 'Lorentzian', 'Voigt', 'PseudoVoigt']
+number_of_points = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+number_of_peaks = int(sys.argv[2]) if len(sys.argv) > 2 else 80
+window = float(sys.argv[3]) if len(sys.argv) > 3 else 30.0
+rng = np.random.default_rng(number_of_peaks)
+x = np.linspace(400, 4000, number_of_points)
+center = np.linspace(450, 3950, number_of_peaks) + rng.uniform(-10, 10, number_of_peaks)
+width = rng.uniform(4, 12, number_of_peaks)
+amplitude = rng.uniform(5, 50, number_of_peaks)
+method = [methods[num % len(methods)] for num in range(number_of_peaks)]
+y = 0.3 + 1e-4 * x + 0.05 * np.sin(x / 500) + 0.01 * rng.standard_normal(len(x))
+for num in range(number_of_peaks):
+    y += getattr(lmfit.lineshapes, method[num].lower() if method[num] != 'PseudoVoigt' else 'pvoigt')(
+        x, amplitude[num], center[num], width[num])
+start = center + rng.uniform(-2, 2, number_of_peaks)
+print(f'{number_of_points} points, {number_of_peaks} peaks, jac_window {window}')
+print('jac\t\twindow\tnfev\tnjev\ttime, s\tR2\t\tmax |center - dense|')
+dense = {}
+for jac, jac_window in (('analytic', None), ('analytic', window), ('2-point', None), ('2-point', window)):
+    params = {'method': method, 'center': start, 'amplitude': amplitude, 'width': width,
+              'baseline_auto': [1e8, 0.01, 10], 'jac': jac, 'jac_window': jac_window,
+              'kws': {'ftol': 1e-8, 'xtol': 1e-8, 'gtol': 1e-8}}
+    limits = {'center': [[5, 5]] * number_of_peaks, 'amplitude': [[0.1, 10]] * number_of_peaks,
+              'width': [[0.2, 5]] * number_of_peaks, 'baseline_auto': [[1e6, 1e10], [0.001, 0.1]]}
+    fit = fm.FittingMap()
+    time0 = tm.perf_counter()
+    mod, pars, fit_kws = fit.__fit_model__(number_of_peaks, params, limits, True)
+    out = mod.fit(y, params=pars, x=x, t=y, method='least_squares', fit_kws=fit_kws, max_nfev=1000,
+                  calc_covar=False)
+    elapsed = tm.perf_counter() - time0
+    fitted = np.array([out.params['f' + repr(num) + '_center'].value for num in range(number_of_peaks)])
+    if jac_window is None:
+        dense[jac] = fitted
+    print(f'{jac}\t{"" if len(jac) > 7 else chr(9)}{jac_window}\t{out.nfev}\t{getattr(out, "njev", 0)}\t'
+          f'{elapsed:.2f}\t{out.rsquared:.6f}\t{np.abs(fitted - dense[jac]).max():.2e}')
@@ -0,0 +1,43 @@
+"""
+Benchmark of the variable projection fitting mode (params['fit_mode'] = 'varpro') against the joint fitting of all
+parameters. The synthetic FTIR-like spectra contain Gaussian, Lorentzian, Voigt and PseudoVoigt bands on the curved
+background. The initial amplitudes are either perturbed true amplitudes or ones (the default of finder.fitcurve).
+The nfev and njev columns are the counters of the joint least squares (the final one in 'varpro' mode).
+Usage: python benchmarks/bench_varpro.py [number of peaks ...]
+"""
+import os, sys
+import time as tm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+import lmfit
+import fittingmap as fm
+
+methods = ['Gaussian', 'Lorentzian', 'Voigt', 'PseudoVoigt']
+peaks = [int(arg) for arg in sys.argv[1:]] or [20, 40, 60]
+print('peaks\tstart\tmode\tnfev\tnjev\ttime, s\tR2\t\tVarPro nfev, njev')
+for number_of_peaks in peaks:
+    rng = np.random.default_rng(number_of_peaks)
+    x = np.linspace(400, 4000, 3600)
+    center = np.sort(rng.uniform(450, 3950, number_of_peaks))
+    width = rng.uniform(4, 12, number_of_peaks)
+    amplitude = rng.uniform(5, 50, number_of_peaks)
+    method = [methods[num % len(methods)] for num in range(number_of_peaks)]
+    y = 0.3 + 1e-4 * x + 0.05 * np.sin(x / 500) + 0.01 * rng.standard_normal(len(x))
+    for num in range(number_of_peaks):
+        y += getattr(lmfit.lineshapes, method[num].lower() if method[num] != 'PseudoVoigt' else 'pvoigt')(
+            x, amplitude[num], center[num], width[num])
+    start_center = center + rng.uniform(-2, 2, number_of_peaks)
+    starts = {'perturbed': amplitude * rng.uniform(0.3, 3, number_of_peaks), 'ones': np.ones(number_of_peaks)}
+    for start, start_amplitude in starts.items():
+        for mode in ('joint', 'varpro'):
+            params = {'method': method, 'center': start_center, 'amplitude': start_amplitude, 'width': width,
+                      'baseline_auto': [1e8, 0.01, 10], 'fit_mode': mode,
+                      'kws': {'ftol': 1e-8, 'xtol': 1e-8, 'gtol': 1e-8}}
+            limits = {'center': [[5, 5]] * number_of_peaks, 'amplitude': [[0, 1000]] * number_of_peaks,
+                      'width': [[0.2, 5]] * number_of_peaks, 'baseline_auto': [[1e6, 1e10], [0.001, 0.1]]}
+            fit = fm.FittingMap()
+            time0 = tm.perf_counter()
+            out = fit.__fit__(y, number_of_peaks, params, limits, True, x=x, t=y, max_nfev=1000)
+            elapsed = tm.perf_counter() - time0
+            print(f'{number_of_peaks}\t{start[:5]}\t{mode}\t{out.nfev}\t{getattr(out, "njev", 0)}\t{elapsed:.2f}\t'
+                  f'{out.rsquared:.6f}\t{getattr(out, "varpro_nfev", "")} {getattr(out, "varpro_njev", "")}')
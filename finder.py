@@ -15,13 +15,36 @@ import numpy as np
 #import os,sys,math
 import fittingmap as mm
 import readwriteir5 as rm
+import baseline as bsl
+import glowcurve as gc
 import time
+import hashlib
+from multiprocessing import Pool, TimeoutError
 
-def smooth_als(y, lam, p):
+# the keys of the parameters and limits of fitting, which are given for each peak
+PEAK_KEYS = ('amplitude', 'center', 'width', 'method', 'fixed')
+# the keys of the parameters of fitting, which are not passed to the worker processes (see __run_tasks__)
+LOCAL_KEYS = ('cancel', 'progress')
+# the period of the checks of the cancellation token while the worker processes are running (seconds)
+POLL = 0.1
+
+def smooth_als(y, lam, p, backend=None):
     fit_ = mm.FittingMap()
-    yy = fit_.__baseline_als__(y, lam, p)
+    yy = fit_.__baseline_als__(y, lam, p, backend)
     return yy
 
+def remove_baseline(y, lam=1e6, method='arpls', p=0.01, backend=None):
+    """Subtract the baseline constructed by baseline.make_baseline ('als', 'arpls' or 'airpls' method).
+        The arpls and airpls weights are tuned by the residuals, so the baseline is found without the least square fit
+        of lam and p.
+        Returns:
+            y_corr: spectrum without baseline
+            b_line: the baseline
+    """
+    y = np.asarray(y, dtype=np.float64)
+    b_line = bsl.make_baseline(y, lam, p, method=method, backend=backend)
+    return y - b_line, b_line
+
 def smooth(y, box_pts):
     box = np.ones(box_pts)/box_pts
     y_smooth = np.convolve(y, box, mode='same')
@@ -66,7 +89,288 @@ def peakdetect(xx, yy, lookahead = 1, delta = 0.011):
         spectra['ampl'] = ampl
         return spectra
  
-def fitcurve(xx,yy,peaks_str,parameters = None, parameter_als=None, tolerance = 1e-15, max_nfev=1000):
+def split_peaks(center, width, gap):
+    """Split the peaks into the groups (segments) of the spectrum, which are fitted independently. The neighbouring
+        peaks belong to different segments if the distance between their centers is more than gap widths of the wider
+        peak.
+        Args:
+            center: centers of the peaks
+            width: widths of the peaks
+            gap: minimal distance between the segments in units of the peak width
+        Returns:
+            segments: list of the arrays of the peak numbers, the segments are sorted by the centers
+    """
+    center = np.asarray(center, dtype=np.float64)
+    width = np.abs(np.asarray(width, dtype=np.float64))
+    order = np.argsort(center, kind='stable')
+    split = np.diff(center[order]) > gap * np.maximum(width[order][:-1], width[order][1:])
+    return np.split(order, np.flatnonzero(split) + 1)
+
+def __indexed__(args):
+    """Run func(task) in the worker process and return (num, result)"""
+    func, num, task = args
+    return num, func(task)
+
+def __run_tasks__(func, tasks, workers, cancel=None):
+    """Run func(task) for the tasks on the process pool of workers processes or in the calling process if workers is 1
+        or there is one task. The tasks are (x, y, params, limits) of fit_array, the LOCAL_KEYS params are not passed
+        to the worker processes. The pool is terminated when the cancellation token is set.
+        Args:
+            func: the module function of the task
+            tasks: list of the tasks
+            workers: number of processes
+            cancel: cancellation token with is_set() method or None
+        Returns:
+            results: the list of the results in the order of the tasks, None for the tasks which are not completed
+    """
+    results = [None] * len(tasks)
+    if workers > 1 and len(tasks) > 1:
+        tasks = [(x, y, {key: value for key, value in params.items() if key not in LOCAL_KEYS}, limits)
+                 for x, y, params, limits in tasks]
+        pool = Pool(processes=min(workers, len(tasks)))
+        try:
+            pending = pool.imap_unordered(__indexed__, [(func, num, task) for num, task in enumerate(tasks)])
+            done = 0
+            while done < len(tasks) and not (cancel is not None and cancel.is_set()):
+                try:
+                    num, result = pending.next(timeout=POLL)
+                except TimeoutError:
+                    continue
+                results[num] = result
+                done += 1
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for num, task in enumerate(tasks):
+            if cancel is not None and cancel.is_set():
+                break
+            results[num] = func(task)
+    return results
+
+def __fit_segment__(args):
+    """Fit one segment of the spectrum by FittingMap.fit_array in the worker process.
+        Args:
+            args: (x, y, params, limits) of the segment
+        Returns:
+            result: the result of fit_array with float lam and p
+            y_fit: the best fit of the segment
+            components: the evaluated components of the segment
+    """
+    x, y, params, limits = args
+    fit = mm.FittingMap()
+    result = fit.fit_array(x, y, params, limits, 'segment')
+    result['lam'] = float(result['lam'])
+    result['p'] = float(result['p'])
+    return result, fit.map_baseline['segment'][1], fit.components
+
+def __segment_start__(start, peaks):
+    """Return the start values of the segment: the parameters of the peaks of the segment are renamed to the numbers of
+        the peaks in the segment, the bg_ parameters are the same and the parameters of the other peaks are skipped.
+    """
+    local = {'f' + repr(num) + '_': 'f' + repr(i) + '_' for i, num in enumerate(peaks.tolist())}
+    out = {}
+    for name, value in start.items():
+        pref = name[:name.find('_') + 1]
+        if pref == 'bg_':
+            out[name] = value
+        elif pref in local:
+            out[local[pref] + name[len(pref):]] = value
+    return out
+
+def fit_segments(xx, yy, params, limits, gap, workers=None):
+    """Fit the independent regions of the spectrum in parallel. The peaks are split into the segments by split_peaks.
+        The spectrum is cut between the segments at the midpoints between the last peak of the segment and the first
+        peak of the next one. Each region is fitted with its peaks and its own bg_ baseline on the process pool, then
+        the results are stitched in the order of the peaks of params.
+        Args:
+            xx, yy: the spectrum
+            params, limits: the parameters and limits of FittingMap.fit_array. 'amplitude', 'center', 'width' and
+                'method' params and 'amplitude', 'center' and 'width' limits are given for each peak
+            gap: minimal distance between the segments in units of the peak width
+            workers: number of processes, fittingmap.num_proc by default. The segments are fitted in the calling
+                process if workers is 1 or there is one segment
+        Returns:
+            result: the dictionary of fit_array. The 'lam' and 'p' values of the baseline of the segment are given for
+                each peak of the segment. The r-square is calculated for the stitched fit. The 'values' contain the
+                parameters of the peaks only (the bg_ baselines of the segments are different). If the fit is cancelled
+                (params['cancel']), the segments which are not fitted keep their start values and 'stopped' is 'cancel'
+            y_fit: the best fit of the whole spectrum
+            components: the components f0_, f1_, ... (zero outside the region of the segment) and bg_ of the stitched
+                fit
+    """
+    xx = np.asarray(xx, dtype=np.float64)
+    yy = np.asarray(yy, dtype=np.float64)
+    center = np.asarray(params['center'], dtype=np.float64)
+    segments = split_peaks(center, params['width'], gap)
+    bounds = [-np.inf] + [(center[prev[-1]] + center[nxt[0]]) / 2 for prev, nxt in zip(segments[:-1], segments[1:])] + \
+        [np.inf]
+    masks = [(xx >= low) & (xx < high) for low, high in zip(bounds[:-1], bounds[1:])]
+    tasks = []
+    for peaks, mask in zip(segments, masks):
+        seg_params = {key: value for key, value in params.items() if key not in PEAK_KEYS}
+        seg_params.update({key: [params[key][num] for num in peaks] for key in PEAK_KEYS if key in params})
+        if 'start' in params:
+            seg_params['start'] = __segment_start__(params['start'], peaks)
+        seg_limits = {key: value for key, value in limits.items() if key not in PEAK_KEYS}
+        seg_limits.update({key: [limits[key][num] for num in peaks] for key in PEAK_KEYS if key in limits})
+        tasks.append((xx[mask], yy[mask], seg_params, seg_limits))
+    workers = mm.num_proc if workers is None else workers
+    fitted = __run_tasks__(__fit_segment__, tasks, workers, params.get('cancel'))
+    cancelled = any(item is None for item in fitted)
+    for num, item in enumerate(fitted):
+        if item is None:
+            # the token is set, so the fit stops at the first evaluation and keeps the start values of the segment
+            fitted[num] = __fit_segment__(tasks[num])
+    number_of_peaks = len(center)
+    result = {key: np.zeros(number_of_peaks) for key in ('amplitude', 'FWHM', 'center', 'height', 'sigma', 'p', 'lam')}
+    y_fit = np.zeros(len(yy))
+    components = {'f' + repr(num) + '_': np.zeros(len(yy)) for num in range(number_of_peaks)}
+    components['bg_'] = np.zeros(len(yy))
+    result['values'] = {}
+    nvarys = 0
+    for peaks, mask, (res, seg_fit, seg_components) in zip(segments, masks, fitted):
+        y_fit[mask] = seg_fit
+        for local, num in enumerate(peaks.tolist()):
+            for key in ('amplitude', 'FWHM', 'center', 'height', 'sigma'):
+                result[key][num] = res[key][local]
+            result['p'][num] = res['p']
+            result['lam'][num] = res['lam']
+            components['f' + repr(num) + '_'][mask] = seg_components['f' + repr(local) + '_']
+            pref = 'f' + repr(local) + '_'
+            result['values'].update({'f' + repr(num) + '_' + name[len(pref):]: value
+                                     for name, value in res['values'].items() if name.startswith(pref)})
+        components['bg_'][mask] = seg_components['bg_']
+        nvarys += res['nvarys']
+    redchi = np.sum((yy - y_fit) ** 2) / max(len(yy) - nvarys, 1)
+    result['r-square'] = 1 - redchi / np.var(yy, ddof=0)
+    result['stopped'] = 'cancel' if cancelled else \
+        next((res['stopped'] for res, _, _ in fitted if res['stopped'] is not None), None)
+    return result, y_fit, components
+
+def perturb_starts(params, limits, starts, seed=None, scale=10):
+    """Generate the random initial values of the peaks within the limits of fitting for the multi-start fit.
+        The centers are uniform within the limits, the widths are log-uniform within the limits and the amplitudes are
+        log-uniform within scale times the initial amplitude (clipped by the limits). The fixed peaks (params['fixed'])
+        are not perturbed.
+        Args:
+            params, limits: the parameters and limits of FittingMap.fit_array
+            starts: number of the start values
+            seed: seed of the random generator
+            scale: maximal ratio of the perturbed and initial amplitudes
+        Returns:
+            starts: list of the dictionaries {param_name: value} ('start' of FittingMap.fit_array)
+    """
+    rng = np.random.default_rng(seed)
+    fixed = params.get('fixed', [False] * len(params['center']))
+    bounds = {}
+    for num in range(len(params['center'])):
+        if params['method'][num] not in gc.GLOWS and not fixed[num]:
+            bounds.update(mm.FittingMap.__peak_bounds__(num, params, limits))
+    out = []
+    for _ in range(starts):
+        start = {}
+        for name, bound in bounds.items():
+            low, high, value = bound['min'], bound['max'], bound['value']
+            if name.endswith('_amplitude') and value > 0:
+                low, high = max(low, value / scale), min(high, value * scale)
+            if name.endswith('_center') or low <= 0:
+                start[name] = rng.uniform(low, high)
+            else:
+                start[name] = np.exp(rng.uniform(np.log(low), np.log(high)))
+        out.append(start)
+    return out
+
+def __fit_start__(args):
+    """Fit the spectrum from one start of the multi-start fit in the worker process. The start is skipped if the
+        deadline of the params is passed.
+        Args:
+            args: (x, y, params, limits) of fit_array
+        Returns:
+            the result of __fit_segment__ or None
+    """
+    deadline = args[2].get('deadline')
+    if deadline is not None and time.time() > deadline:
+        return None
+    return __fit_segment__(args)
+
+def fit_multistart(xx, yy, params, limits, starts, budget=None, workers=None, seed=None):
+    """Multi-start fit of the spectrum. The spectrum is fitted from the initial values of params and from starts - 1
+        random initial values of perturb_starts on the process pool, the best fit (the highest r-square) is returned.
+        Args:
+            xx, yy: the spectrum
+            params, limits: the parameters and limits of FittingMap.fit_array. 'amplitude', 'center', 'width' and
+                'method' params and 'amplitude', 'center' and 'width' limits are given for each peak
+            starts: number of the fits
+            budget: time budget of all fits in seconds. The fits are not started after the budget is spent and the
+                running fits are stopped at the best point (see 'deadline' of FittingMap.fit_array), the fit from the
+                initial values is started first. If no fit is returned within the budget, the fit from the initial
+                values is run again without the deadline and completed. No budget by default (params['deadline'] is
+                used if it is given). The fits are cancelled by params['cancel'] token (the fit from the initial values
+                is stopped at the start values then)
+            workers: number of processes, fittingmap.num_proc by default. The fits are run in the calling process if
+                workers is 1
+            seed: seed of the random generator of perturb_starts
+        Returns:
+            result: the dictionary of fit_array of the best fit
+            y_fit: the best fit of the spectrum
+            components: the components of the best fit
+            spread: the statistics of the completed fits (the fits which are not stopped by the budget or the
+                cancel token): 'completed'(int) number of the completed fits, 'stopped'(int) number of the returned
+                fits stopped at the best point, 'r-square'(floats) r-square values of the completed fits in descending
+                order, 'amplitude', 'center', 'sigma'(floats) standard deviations of the fitted values of each peak
+                over the completed fits (NaN if there are no completed fits)
+    """
+    xx = np.asarray(xx, dtype=np.float64)
+    yy = np.asarray(yy, dtype=np.float64)
+    base = params.get('start', {})
+    if budget is not None:
+        deadline = params.get('deadline')
+        params = dict(params, deadline=time.time() + budget if deadline is None else min(deadline, time.time() + budget))
+    tasks = []
+    for start in [{}] + perturb_starts(params, limits, starts - 1, seed):
+        tasks.append((xx, yy, dict(params, start=dict(base, **start)), limits))
+    workers = mm.num_proc if workers is None else workers
+    fitted = __run_tasks__(__fit_start__, tasks, workers, params.get('cancel'))
+    fitted = [item for item in fitted if item is not None]
+    if not fitted:
+        # the budget is less than one fit: the fit from the initial values is run without the deadline, so it is
+        # completed unless the fit is cancelled
+        x, y, task_params, task_limits = tasks[0]
+        fitted = [__fit_segment__((x, y, dict(task_params, deadline=None, budget=None), task_limits))]
+    fitted.sort(key=lambda item: item[0]['r-square'], reverse=True)
+    completed = [res for res, _, _ in fitted if res['stopped'] is None]
+    spread = {'completed': len(completed), 'stopped': len(fitted) - len(completed),
+              'r-square': np.array([res['r-square'] for res in completed])}
+    for key in ('amplitude', 'center', 'sigma'):
+        spread[key] = np.std([res[key] for res in completed], axis=0) if completed else \
+            np.full(len(params['center']), np.nan)
+    result, y_fit, components = fitted[0]
+    return result, y_fit, components, spread
+
+def fitcurve(xx,yy,peaks_str,parameters = None, parameter_als=None, tolerance = 1e-15, max_nfev=1000, backend=None,
+             segment_gap=None, workers=None, levels=None, start=None, starts=None, budget=None, seed=None,
+             cancel=None, progress=None):
+        """Fit of the spectrum by the peaks of peaks_str or parameters table and bg_ baseline.
+            If segment_gap is given, the peaks separated by more than segment_gap widths are fitted in the independent
+            regions of the spectrum on the process pool of workers processes (see fit_segments). The result has the
+            same structure.
+            If levels [[factor, tolerance], ...] are given, the spectrum binned by the factors is fitted first with the
+            tolerances of the levels, then the fit at full resolution with the tolerance starts from the coarse
+            solution (see 'levels' of FittingMap.fit_array).
+            If start {param_name: value} is given, the fit starts from these values instead of the values of the tables
+            (see warm_start), the limits are calculated from the tables. The peaks of the rows with the 'lock' flag of
+            parameters table are not varied.
+            If starts is given, the spectrum is fitted from starts initial values (the values of the tables and the
+            random values within the limits) on the process pool of workers processes and the best fit is returned (see
+            fit_multistart). The result contains the 'spread' of the fits then. The multi-start fit is the fit of the
+            whole spectrum (segment_gap is not used). If no fit is returned within the budget, the fit from the values
+            of the tables is completed without the budget.
+            The fits are stopped at the best point when the wall-clock budget in seconds is spent or the cancel token
+            (threading.Event or multiprocessing.Event) is set, progress(nfev, chisqr, elapsed) is called after every
+            evaluation of the model of the fit in the calling process (see 'budget', 'cancel' and 'progress' of
+            FittingMap.fit_array). The 'stopped' of the result is None, 'budget' or 'cancel'.
+        """
         start_time=time.time()
         limits = {}
         ma = {}
@@ -89,6 +393,15 @@ def fitcurve(xx,yy,peaks_str,parameters = None, parameter_als=None, tolerance =
             limits['baseline_auto'] = [[float(parameter_als[0]["l_lam_min"]),float(parameter_als[0]["l_lam_max"])], [float(parameter_als[0]["l_p_min"]),float(parameter_als[0]["l_p_max"])]]
         params['kws'] = {'ftol': tolerance, 'xtol': tolerance, 'gtol': tolerance}
         params['max_nfev'] = max_nfev
+        params['backend'] = backend
+        if levels is not None:
+            params['levels'] = levels
+        if start is not None:
+            params['start'] = start
+        if budget is not None:
+            params['deadline'] = start_time + budget
+        params['cancel'] = cancel
+        params['progress'] = progress
 
         if parameters is None:
             params['amplitude'] = np.full(len(x),1)
@@ -107,6 +420,7 @@ def fitcurve(xx,yy,peaks_str,parameters = None, parameter_als=None, tolerance =
             l_center = []
             l_amplitude = []
             l_width = []
+            fixed = []
             
             for item in parameters:
                 p_center.append(float(item['p_center']))
@@ -116,6 +430,7 @@ def fitcurve(xx,yy,peaks_str,parameters = None, parameter_als=None, tolerance =
                 l_center.append([float(item['l_center_min']),float(item['l_center_max'])])
                 l_amplitude.append([float(item['l_amplitude_min']),float(item['l_amplitude_max'])])
                 l_width.append([float(item['l_width_min']),float(item['l_width_max'])])
+                fixed.append(str(item.get('lock', '')).lower() in ('yes', 'true', '1'))
             params['center'] = np.array(p_center)
             params['amplitude'] = np.array(p_amplitude)
             params['width'] = np.array(p_width)
@@ -123,9 +438,21 @@ def fitcurve(xx,yy,peaks_str,parameters = None, parameter_als=None, tolerance =
             limits['amplitude'] = np.array(l_amplitude)
             limits['width'] = np.array(l_width)
             limits['center'] = np.array(l_center)
+            params['fixed'] = fixed
         # print(params)
         # print(limits)        
-        result = fit.fit_array(xx,yy,params,limits,fname)
+        spread = None
+        if starts is not None:
+            result, y1, components, spread = fit_multistart(xx, yy, params, limits, starts, None, workers, seed)
+            x1 = xx
+        elif segment_gap is None:
+            result = fit.fit_array(xx,yy,params,limits,fname)
+            x1 = fit.map_baseline[fname][0]
+            y1 = fit.map_baseline[fname][1]
+            components = fit.components
+        else:
+            result, y1, components = fit_segments(xx, yy, params, limits, segment_gap, workers)
+            x1 = xx
 
         A = result['amplitude']
         FWHM = result['FWHM']
@@ -154,14 +481,56 @@ def fitcurve(xx,yy,peaks_str,parameters = None, parameter_als=None, tolerance =
                       H[idx[0]].astype('str')
                       )
         fit_param = {'Center':np.array(C_), 'Amplitude': np.array(A_),'Sigma': np.array(S_), 'FWHM': np.array(F_), 'Height': np.array(H_),'Method': params['method'], 'R-Square': Rsq, 'p': result['p'], 'lam': result['lam']}
-        x1 = fit.map_baseline[fname][0]
-        y1 = fit.map_baseline[fname][1]
         #ddd = xx
         length_ = len(xx)
         length_2 = len(x1)
         print('Time: ', time.time()-start_time)
         #Рисуем и сохраняем кривые
-        return {'input': [xx,yy], 'output': [x1, y1], 'components': fit.components, 'length_in': length_, 'length_out':  length_2, 'params': fit_param}
+        return {'input': [xx,yy], 'output': [x1, y1], 'components': components, 'length_in': length_, 'length_out':  length_2, 'params': fit_param, 'values': result['values'], 'spread': spread, 'stopped': result['stopped']}
+
+def __spectrum_key__(yy):
+    """Return the hash of the y-values of the spectrum"""
+    return hashlib.sha1(np.ascontiguousarray(yy, dtype=np.float64).tobytes()).hexdigest()
+
+def fit_state(yy, parameters, parameter_als, result):
+    """Return the state of the fit of fitcurve for the warm start of the next fit of the spectrum (see warm_start).
+        The state contains the lists and numbers only, so it is kept in dcc.Store of the web-app.
+        Args:
+            yy: y-values of the fitted spectrum
+            parameters, parameter_als: the tables of fitcurve
+            result: the result of fitcurve
+        Returns:
+            state: {'spectrum': hash of yy, 'parameters': parameters, 'parameter_als': parameter_als, 'values': the
+                fitted values of the parameters}
+    """
+    return {'spectrum': __spectrum_key__(yy), 'parameters': parameters, 'parameter_als': parameter_als,
+            'values': {name: float(value) for name, value in result['values'].items()}}
+
+def warm_start(yy, parameters, parameter_als, state):
+    """Return the start values of fitcurve from the state of the previous fit (see fit_state). The fitted values of
+        the peak are used if its row of parameters table is the same as in the previous fit (the 'lock' flag is not
+        compared), the fitted bg_ values are used if ALS table is the same. The values of the changed rows are taken
+        from the tables, so the edited peaks start from the new values and the other peaks start from the solution.
+        Args:
+            yy: y-values of the spectrum
+            parameters, parameter_als: the tables of fitcurve
+            state: the state of the previous fit or None
+        Returns:
+            start: {param_name: value} the start values of fitcurve (empty if the spectrum is changed)
+    """
+    if not state or state.get('spectrum') != __spectrum_key__(yy):
+        return {}
+    start = {}
+    values = state['values']
+    if parameters is not None and state['parameters'] is not None:
+        for num, (row, old) in enumerate(zip(parameters, state['parameters'])):
+            if {key: value for key, value in row.items() if key != 'lock'} == \
+                    {key: value for key, value in old.items() if key != 'lock'}:
+                pref = 'f' + repr(num) + '_'
+                start.update({name: value for name, value in values.items() if name.startswith(pref)})
+    if parameter_als == state['parameter_als']:
+        start.update({name: value for name, value in values.items() if name.startswith('bg_')})
+    return start
 
 # def find_phase(xx, yy, dbname = None, print_number = 10, sim = 0.8):
     # if dbname is not None:
@@ -9,40 +9,57 @@ __license__ = "GNU GPL 3.0"
 __version__ = "0.4.0"
 
 import time as tm
-from ctypes import *
-from multiprocessing import Pool, Value, Manager
+import copy
+import functools
+import itertools
+import collections
+from multiprocessing import Pool, Value
 import lmfit
 import numpy as np
 # import scipy.sparse as sparse
 from lmfit.model import Model
 # from scipy.sparse.linalg import spsolve
-#from termcolor import colored
+from termcolor import colored
 import progressbar as pb
 import os, sys
-import platform
 import pathlib
 pth_=pathlib.Path(__file__).parent.resolve()
-if platform.uname()[0] == "Windows":
-    path = os.path.abspath(pth_)
-    os.add_dll_directory(pth_)
-else:
-    path = os.path.abspath(pth_)
-    os.environ["LD_LIBRARY_PATH"] = "pth_"
+path = os.path.abspath(pth_)
 
 if path not in sys.path:
     sys.path.append(path)
 
+# Library contains ALS and TSL curve fitting algorithms
+import nativelib as nl
+import baseline as bsl
+import jacobian as jc
+import multipeak as mp
+import glowcurve as gc
+import response as rs
+import mapresult as mr
+import sharedcube as sc
+import modelcache as mc
+import varpro as vp
+import monitor as mn
+
 os.system('color')
-# selection of OS platform
-if platform.uname()[0] == "Windows":
-    name_dll = "convolution.dll"
-else:
-    name_dll = "convolution.so"
-# Load library contains ALS and TSL curve fitting algorithms
-myclib = cdll.LoadLibrary(name_dll)
 
-# Multithreading
-num_proc = 4
+
+
+def available_cpus():
+    """
+    Return the number of CPUs available to the process (the affinity mask of the process if it is supported)
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Multithreading: the default number of the worker processes
+num_proc = available_cpus()
+# The layout of the per-pixel records of map_intensity: the values of the pixel and the values of each peak
+RECORD_VALUES = ('r-square', 'lam', 'p', 'nfev', 'status')
+RECORD_PEAKS = mr.PARAMS
 
 
 class FittingMap(object):
@@ -70,6 +87,9 @@ class FittingMap(object):
 
         components(dict): The dictionary contains evaluated components out.eval_components
 
+        map_curves(floats): (n_points, n_peaks + 2, length) array of the best fits, baselines and components of the points
+        of the hyperspectral map of find_intensity (the rows referred by map_baseline and map_bline)
+
         lam(double): 2nd derivative constraint in case of manual als baseline fitting
 
         p(double): Weighting of positive residuals in case of manual als baseline fitting
@@ -83,7 +103,7 @@ class FittingMap(object):
         param(dict): Dictionary contains parameters of fitting
 
             'range': range of fitting on absciss axis. This is array contains xmin and xmax values [xmin,xmax]. By default the input spectrum is fitted in all range.
-            'method': the array of names of the fitting method. The length of array is the number of fitting curve that will be used. There are Gaussian/Voigt/Lorenzian,PseudoVoigt for peak detection. For thermally stimullated processes the TSL glow curve of 1 order TSL_1, second order TSL_2 and thermally stimulated decay curve  TD_1 and TD_2 is available.
+            'method': the array of names of the fitting method. The length of array is the number of fitting curve that will be used. There are Gaussian/Voigt/Lorenzian,PseudoVoigt for peak detection (VoigtHumlicek and VoigtTCH are the fast approximations of Voigt, see lineshapes). For thermally stimullated processes the TSL glow curve of 1 order TSL_1, second order TSL_2 and thermally stimulated decay curve  TD_1 and TD_2 is available. TSLGO and TDGO are the curves of general-order kinetics with the fitted order (see glowcurve).
             'amplitude': the array of values of initial amplitudes of peaks in peak fitting procedure. The length of array is the number of fitting curve that will be used.
             'center': the array of values of initial centers (x-coordinate) of peaks in peak fitting procedure. The length of array is the number of fitting curve that will be used.
             'width': the array of values of initial widths of peaks in peak fitting procedure. The length of array is the number of fitting curve that will be used.
@@ -99,6 +119,23 @@ class FittingMap(object):
             'max_nfev' (int): number of least square fit iterations.
             'energy'[]: Activation energy for each peak in TSL_ and TD_ fits
             'factor'[]: Frequency factor in TSL_ and TD_ fits
+            'order'[]: Initial kinetic order of TSLGO and TDGO peaks (1.5 by default)
+            'backend'(str): ALS engine of the baseline: 'native' (convolution.so/convolution.dll) or 'numpy' (banded solver of scipy)
+            'als_tol'(double): tolerance of the als weight vector change for the early stopping of the numpy engine. By default baseline.default_tol
+            'baseline_method'(str): method of the bg_ baseline in baseline_auto fits: 'als' (default), 'arpls' or 'airpls'. The arpls and airpls methods fit lam only
+            'peak_model'(str): 'multipeak' (default, Gaussian/Lorentzian/Voigt/PseudoVoigt peaks are evaluated at once by multipeak.MultiPeakModel) or 'composite' (sum of lmfit models)
+            'calc_covar'(bool): estimate the uncertainties of the fitted parameters (stderr). False by default
+            'jac'(str): Jacobian of least square fitting: 'analytic' (default, closed-form derivatives of the peaks and implicit differentiation of ALS baseline), 'numeric' (finite differences of the single components) or '2-point'/'3-point' of scipy
+            'jac_window'(double): half width of the peak support in units of the peak width (sigma). If it is given, the Jacobian columns of the peak parameters are calculated within center +/- jac_window*sigma only ('analytic'/'numeric') or the finite differences of the peaks with disjoint windows are calculated together ('2-point'/'3-point'). The Gaussian peaks are exact for jac_window >= 10, the Lorentzian tails need wider windows. None by default (dense Jacobian)
+            'fit_mode'(str): 'joint' (default, all parameters are fitted by least_squares) or 'varpro' (variable projection: the amplitudes of Gaussian/Lorentzian/Voigt/PseudoVoigt peaks of 'multipeak' peak model are found by bounded linear least squares for each trial set of the other parameters, see varpro.VarPro)
+            'levels'[[factor, tolerance], ...]: coarse-to-fine schedule. The spectrum binned by each factor is fitted with the tolerance (ftol, xtol and gtol) of the level in the given order, the next level starts from the solution of the previous one (bg_p starts from its initial value, bg_lam is kept inside its limits) and the last fit is the fit at full resolution with 'kws' tolerances. E.g. [[8, 1e-6], [2, 1e-8]]. No coarse levels by default
+            'start'(dict): {param_name: value} the initial values of the lmfit parameters (e.g. 'values' of the previous fit result) replacing the initial values of the other params. The values are clipped by the limits, the absent names and NaN values are ignored
+            'fixed'[]: the array of flags of the peaks. The parameters of the flagged peaks are not varied (they are fixed at the initial or 'start' values). No fixed peaks by default
+            'budget'(double): wall-clock budget of the fit of the spectrum in seconds. The fit is stopped when the budget is spent and the best evaluated point is returned. No budget by default
+            'deadline'(double): time.time() value when the fit is stopped (the same as 'budget', but shared by the fits of many spectra or processes)
+            'cancel'(object): cancellation token with is_set() method (e.g. threading.Event). The fit is stopped when the token is set
+            'progress'(function): progress(nfev, chisqr, elapsed) is called after every evaluation of the model (iter_cb of lmfit) with the number of the evaluations, the chi-square and the time from the start of the fit
+            'irf': instrument response (slit function) of the spectrometer: [offsets, values] array (the response at the offsets from the line position in x units) or 1d array of the samples of the response on the step of x with the line at the middle sample (see response.make_response). The peaks are convolved with the response by FFT (response.ConvolvedModel), so the fitted widths are the widths of the lines without the instrumental broadening. The baseline is not convolved. The 'varpro' fit mode is not used with the response
 
         limit(dict): Dictionary contains limits of parameter fitting
             'amplitude'[][]: the array contains pairs minimum and maximum values of amplitude.
@@ -118,6 +155,7 @@ class FittingMap(object):
                 The limits of Weighting of positive residuals (p) are p_min<p<p_max
             'energy'[E_min, E_max][]: Limits of activation energy E_min<E<E_max in TSL_ and TD_ fits
             'factor'[f_min, f_max][]: Limits of frequency factor in TSL_ and TD_ fits
+            'order'[b_min, b_max][]: Limits of kinetic order of TSLGO and TDGO peaks ([1, 2] by default)
 
     """
 
@@ -141,33 +179,148 @@ class FittingMap(object):
         self.limit = {}
 
     @staticmethod
-    def __baseline_als__(t: np.ndarray, lam: np.double, p: np.double):
+    def __baseline_als__(t: np.ndarray, lam: np.double, p: np.double, backend=None, niter=10, tol=bsl.default_tol):
         """Baseline reconstruct using ALS algorithm using dll
             https://zanran_storage.s3.amazonaws.com/www.science.uva.nl/ContentPages/443199618.pdf
             Asymmetric Least Squares Smoothing
             Args:
                 t: input y array for baseline construction
-                niter: Maximum number of iterations
                 lam: 2nd derivative constraint
                 p: Weighting of positive residuals
+                backend: ALS engine 'native' (convolution.so/convolution.dll) or 'numpy' (banded solver of scipy).
+                    By default baseline.default_backend is used. The numpy backend is used if the library is not loaded.
+                niter: Maximum number of iterations
+                tol: tolerance of the weight vector change. The numpy engine stops the reweighting when the fraction of
+                    the changed weights is not larger than tol. The native engine always makes niter iterations.
             Returns:
                 outputarray: array with constructed baseline with length of input t array
-
+            Note:
+                The baselines are memoized in baseline.als_cache, so the repeated calls with the same t, lam and p
+                inside the least square fit are served from memory. The used iterations are counted in
+                baseline.als_stats.
         
         """
+        backend = bsl.check_backend(backend)
+        key = bsl.als_cache.key(t, lam, p, niter, backend, tol)
+        b_line = bsl.als_cache.get(key)
+        if b_line is not None:
+            return b_line
+        if backend == 'numpy':
+            b_line, n_iter = bsl.als_numpy(t, lam, p, niter, tol, full_output=True)
+        else:
+            b_line, n_iter = nl.als(t, lam, p, niter), niter
+        bsl.als_stats.record(n_iter, niter)
+        bsl.als_cache.put(key, b_line)
+        return b_line
 
-        py_ALS = myclib.ALS
-        py_ALS.argtypes = [POINTER(c_double), POINTER(c_double), c_int, c_double, c_double, c_int]
-        py_ALS.restype = None
-        inputarray = (c_double * len(t))(*t)
-        outputarray = (c_double * len(t))()
-        N = c_int(len(t))
-        lam_dll = c_double(lam)
-        p_dll = c_double(p)
-        # n_iter = c_int(niter)
-        py_ALS(inputarray, outputarray, N, lam_dll, p_dll, 10)
+    @staticmethod
+    def __baseline_pls__(t: np.ndarray, lam: np.double, p: np.double, method='arpls', niter=50, tol=1e-3):
+        """Baseline reconstruct using arPLS or airPLS algorithm (see baseline.arpls_numpy, baseline.airpls_numpy)
+            Args:
+                t: input y array for baseline construction
+                lam: 2nd derivative constraint
+                p: is not used. The argument keeps the bg_ parameters the same as in __baseline_als__
+                method: 'arpls' or 'airpls'
+                niter: Maximum number of iterations
+                tol: tolerance of the early stopping
+            Returns:
+                outputarray: array with constructed baseline with length of input t array
+        """
+        key = bsl.als_cache.key(t, lam, 0, niter, method, tol)
+        b_line = bsl.als_cache.get(key)
+        if b_line is not None:
+            return b_line
+        b_line, n_iter = bsl.make_baseline(t, lam, method=method, niter=niter, tol=tol, full_output=True)
+        bsl.als_stats.record(n_iter, niter)
+        bsl.als_cache.put(key, b_line)
+        return b_line
 
-        return np.array(outputarray)
+    @staticmethod
+    def __baseline_als_jac__(t: np.ndarray, lam: np.double, p: np.double, backend=None, niter=10,
+                             tol=bsl.default_tol):
+        """Derivatives of the ALS baseline by lam and p (see baseline.als_jacobian). The arguments are the same as in
+            __baseline_als__. The baseline is taken from baseline.als_cache, so the derivatives cost one factorization.
+            Returns:
+                {'lam': dz/dlam, 'p': dz/dp}
+        """
+        b_line = FittingMap.__baseline_als__(t, lam, p, backend, niter, tol)
+        jac = bsl.als_jacobian(t, b_line, lam, p)
+        return {'lam': jac[:, 0], 'p': jac[:, 1]}
+
+    @staticmethod
+    def __amplitude_derivative__(func):
+        """
+        Return the derivative function of the component, which is linear in amplitude (TSL_ and TD_ curves).
+        The other parameters of the component are differentiated numerically by jacobian.ModelJacobian
+        """
+        def derivative(**args):
+            args['amplitude'] = 1.0
+            return {'amplitude': func(**args)}
+        return derivative
+
+    def __derivatives__(self, components, jac, window):
+        """
+        Private method returns {component: function} the derivatives of the peak components for jacobian.ModelJacobian
+        (see __fit_kws__). The derivatives of the peaks of response.ConvolvedModel are the convolved derivatives of its
+        components
+        """
+        derivatives = {}
+        for comp in components:
+            if isinstance(comp, mp.MultiPeakModel):
+                derivatives[comp] = functools.partial(
+                    comp.derivatives if jac == 'analytic' else comp.numeric_derivatives, window=window)
+            elif isinstance(comp, gc.GlowModel):
+                derivatives[comp] = comp.derivatives
+            elif isinstance(comp, rs.ConvolvedModel):
+                derivatives[comp] = functools.partial(
+                    comp.derivatives, functions=self.__derivatives__(comp.model.components, jac, window))
+            elif jac == 'analytic' and comp.func in (self.__TSL1__, self.__TSL2__, self.__TSLGO__, self.__TD1__,
+                                                     self.__TD2__, self.__TDGO__):
+                derivatives[comp] = self.__amplitude_derivative__(comp.func)
+        return derivatives
+
+    def __fit_kws__(self, params, mod, jacobians=None):
+        """
+        Private method returns the fit_kws of least square fitting of the model mod. The params['kws'] dictionary is not
+        changed. The assembled Jacobians are stored in the jacobians dictionary {(jac, window): object} if it is given
+        (see modelcache.ModelTemplate) and are reused by the next fits of the same model. The values of params['jac']:
+            'analytic' (default): the Jacobian is assembled by jacobian.ModelJacobian. The columns of the peaks of
+                multipeak.MultiPeakModel are calculated by the closed-form derivatives of the lineshapes, the bg_ columns
+                of ALS baseline by the implicit differentiation of ALS system, the amplitude columns of TSL_ and TD_
+                curves by linearity and the other columns by finite differences of the single component.
+            'numeric': the Jacobian is assembled by jacobian.ModelJacobian with finite differences of the single
+                components only.
+            '2-point', '3-point': finite differences of the whole model by least_squares.
+        If params['jac_window'] is given, the peak parameters change the model within center +/- jac_window*sigma only:
+        the derivatives of the peaks of multipeak.MultiPeakModel are calculated in these windows ('analytic' and
+        'numeric') and the finite differences of the peaks with disjoint windows are calculated together ('2-point' and
+        '3-point', see jacobian.SparseDifference).
+        """
+        fit_kws = dict(params['kws'])
+        if 'jac' not in fit_kws:
+            jac = params.get('jac', 'analytic')
+            window = params.get('jac_window')
+            if jac not in ('analytic', 'numeric'):
+                fit_kws['jac'] = jac if window is None else jc.SparseDifference(mod, window, jac)
+            elif jacobians is not None and (jac, window) in jacobians:
+                fit_kws['jac'] = jacobians[(jac, window)]
+            elif jc.is_additive(mod):
+                derivatives = self.__derivatives__(mod.components, jac, window)
+                if jac == 'analytic' and params.get('baseline_method', 'als') == 'als':
+                    derivatives['bg_'] = self.__baseline_als_jac__
+                fit_kws['jac'] = jc.ModelJacobian(mod, derivatives)
+                if jacobians is not None:
+                    jacobians[(jac, window)] = fit_kws['jac']
+        return fit_kws
+
+    def __als_options__(self, params, name='baseline'):
+        """
+        Private method returns the number of iterations and the tolerance of the als baseline.
+        The number of iterations is params[name][2] if it is given, else self.niter. The tolerance is params['als_tol']
+        if it is given, else baseline.default_tol.
+        """
+        niter = int(params[name][2]) if len(params.get(name, [])) > 2 else self.niter
+        return niter, params.get('als_tol', bsl.default_tol)
 
     @staticmethod
     def __TSL1__(x: np.ndarray, factor: np.double, energy: np.double, amplitude: np.double):
@@ -183,20 +336,7 @@ class FittingMap(object):
 
         """
 
-        py_TSL = myclib.TSLCalc
-        # int TSLCalc(int iSize, double Tmin, double Tmax, double *vCalc, double iFactor, double iEnergy, int kOrder)
-        py_TSL.argtypes = [c_int, c_double, c_double, POINTER(c_double), c_double, c_double, c_int]
-        py_TSL.restype = None
-        Tmin = c_double(x.min())
-        Tmax = c_double(x.max())
-        Npoints = c_int(len(x))
-        outputarray = (c_double * len(x))()
-        factor_dll = c_double(factor)
-        energy_dll = c_double(energy)
-        py_TSL(Npoints, Tmin, Tmax, outputarray, factor_dll, energy_dll, 1)
-        output = np.array(outputarray)
-        output = output / output.max()
-        return amplitude * output
+        return gc.glow_peaks(x, amplitude, factor, energy, 1)[0]
 
     @staticmethod
     def __TSL2__(x: np.ndarray, factor: np.double, energy: np.double, amplitude: np.double):
@@ -212,21 +352,24 @@ class FittingMap(object):
 
         """
 
-        py_TSL = myclib.TSLCalc
-        # int TSLCalc(int iSize, double Tmin, double Tmax, double *vCalc, double iFactor, double iEnergy, int kOrder)
-        py_TSL.argtypes = [c_int, c_double, c_double, POINTER(c_double), c_double, c_double, c_int]
-        py_TSL.restype = None
-        Tmin = c_double(x.min())
-        Tmax = c_double(x.max())
+        return gc.glow_peaks(x, amplitude, factor, energy, 2)[0]
+
+    @staticmethod
+    def __TSLGO__(x: np.ndarray, factor: np.double, energy: np.double, amplitude: np.double, order: np.double):
+        """TSL of general order fit
+
+        Args:
+            x (np.ndarray): array of temperature values
+            factor (np.double): frequency factor (1e8-1e14 typically)
+            energy (np.double): activation energy
+            amplitude (np.double): amplitude of a glow peak
+            order (np.double): kinetic order
+        Returns:
+            output*amplitude (np.double): array of y-values of calculated TSL
+
+        """
 
-        Npoints = c_int(len(x))
-        outputarray = (c_double * len(x))()
-        factor_dll = c_double(factor)
-        energy_dll = c_double(energy)
-        py_TSL(Npoints, Tmin, Tmax, outputarray, factor_dll, energy_dll, 2)
-        output = np.array(outputarray)
-        output = output / output.max()
-        return amplitude * output
+        return gc.glow_peaks(x, amplitude, factor, energy, order)[0]
 
     @staticmethod
     def __TD1__(x: np.ndarray, factor: np.double, energy: np.double, amplitude: np.double):
@@ -242,20 +385,7 @@ class FittingMap(object):
 
         """
 
-        py_TSL = myclib.TDCalc
-        # int TSLCalc(int iSize, double Tmin, double Tmax, double *vCalc, double iFactor, double iEnergy, int kOrder)
-        py_TSL.argtypes = [c_int, c_double, c_double, POINTER(c_double), c_double, c_double, c_int]
-        py_TSL.restype = None
-        Tmin = c_double(x.min())
-        Tmax = c_double(x.max())
-        Npoints = c_int(len(x))
-        outputarray = (c_double * len(x))()
-        factor_dll = c_double(factor)
-        energy_dll = c_double(energy)
-        py_TSL(Npoints, Tmin, Tmax, outputarray, factor_dll, energy_dll, 1)
-        output = np.array(outputarray)
-        output = output / output.max()
-        return amplitude * output
+        return gc.glow_peaks(x, amplitude, factor, energy, 1, decay=True)[0]
 
     @staticmethod
     def __TD2__(x: np.ndarray, factor: np.double, energy: np.double, amplitude: np.double):
@@ -271,20 +401,24 @@ class FittingMap(object):
 
         """
 
-        py_TSL = myclib.TDCalc
-        # int TSLCalc(int iSize, double Tmin, double Tmax, double *vCalc, double iFactor, double iEnergy, int kOrder)
-        py_TSL.argtypes = [c_int, c_double, c_double, POINTER(c_double), c_double, c_double, c_int]
-        py_TSL.restype = None
-        Tmin = c_double(x.min())
-        Tmax = c_double(x.max())
-        Npoints = c_int(len(x))
-        outputarray = (c_double * len(x))()
-        factor_dll = c_double(factor)
-        energy_dll = c_double(energy)
-        py_TSL(Npoints, Tmin, Tmax, outputarray, factor_dll, energy_dll, 1)
-        output = np.array(outputarray)
-        output = output / output.max()
-        return amplitude * output
+        return gc.glow_peaks(x, amplitude, factor, energy, 2, decay=True)[0]
+
+    @staticmethod
+    def __TDGO__(x: np.ndarray, factor: np.double, energy: np.double, amplitude: np.double, order: np.double):
+        """Temperature decay of general order
+
+        Args:
+            x (np.ndarray): array of temperature values
+            factor (np.double): frequency factor (1e8-1e14 typically)
+            energy (np.double): activation energy
+            amplitude (np.double): amplitude of a glow peak
+            order (np.double): kinetic order
+        Returns:
+            output*amplitude (np.double): array of y-values of calculated TSL
+
+        """
+
+        return gc.glow_peaks(x, amplitude, factor, energy, order, decay=True)[0]
 
     @staticmethod
     def __get_numarray(item, wavenumber):
@@ -300,7 +434,7 @@ class FittingMap(object):
                 num(int): number of fitting curve in case of multipeaks or multifunction fitting
                 params{}(dict): Dictionary contains parameters of fitting
                     'range': range of fitting on absciss axis. This is array contains xmin and xmax values [xmin,xmax]. By default the input spectrum is fitted in all range.
-                    'method': the array of names of the fitting method. The length of array is the number of fitting curve that will be used. There are Gaussian/Voigt/Lorenzian,PseudoVoigt for peak detection. For thermally stimullated processes the TSL glow curve of 1 order TSL_1, second order TSL_2 and thermally stimulated decay curve  TD_1 and TD_2 is available.
+                    'method': the array of names of the fitting method. The length of array is the number of fitting curve that will be used. There are Gaussian/Voigt/Lorenzian,PseudoVoigt for peak detection (VoigtHumlicek and VoigtTCH are the fast approximations of Voigt, see lineshapes). For thermally stimullated processes the TSL glow curve of 1 order TSL_1, second order TSL_2 and thermally stimulated decay curve  TD_1 and TD_2 is available. TSLGO and TDGO are the curves of general-order kinetics with the fitted order (see glowcurve).
                     'amplitude': the array of values of initial amplitudes of peaks in peak fitting procedure. The length of array is the number of fitting curve that will be used.
                     'center': the array of values of initial centers (x-coordinate) of peaks in peak fitting procedure. The length of array is the number of fitting curve that will be used.
                     'width': the array of values of initial widths of peaks in peak fitting procedure. The length of array is the number of fitting curve that will be used.
@@ -316,6 +450,23 @@ class FittingMap(object):
                     'max_nfev' (int): number of least square fit iterations.
                     'energy'[]: Activation energy for each peak in TSL_ and TD_ fits
                     'factor'[]: Frequency factor in TSL_ and TD_ fits
+                    'order'[]: Initial kinetic order of TSLGO and TDGO peaks (1.5 by default)
+                    'backend'(str): ALS engine of the baseline: 'native' (convolution.so/convolution.dll) or 'numpy' (banded solver of scipy)
+                    'als_tol'(double): tolerance of the als weight vector change for the early stopping of the numpy engine. By default baseline.default_tol
+                    'baseline_method'(str): method of the bg_ baseline in baseline_auto fits: 'als' (default), 'arpls' or 'airpls'. The arpls and airpls methods fit lam only
+                    'peak_model'(str): 'multipeak' (default, Gaussian/Lorentzian/Voigt/PseudoVoigt peaks are evaluated at once by multipeak.MultiPeakModel) or 'composite' (sum of lmfit models)
+                    'calc_covar'(bool): estimate the uncertainties of the fitted parameters (stderr). False by default
+                    'jac'(str): Jacobian of least square fitting: 'analytic' (default, closed-form derivatives of the peaks and implicit differentiation of ALS baseline), 'numeric' (finite differences of the single components) or '2-point'/'3-point' of scipy
+                    'jac_window'(double): half width of the peak support in units of the peak width (sigma). If it is given, the Jacobian columns of the peak parameters are calculated within center +/- jac_window*sigma only ('analytic'/'numeric') or the finite differences of the peaks with disjoint windows are calculated together ('2-point'/'3-point'). The Gaussian peaks are exact for jac_window >= 10, the Lorentzian tails need wider windows. None by default (dense Jacobian)
+                    'fit_mode'(str): 'joint' (default, all parameters are fitted by least_squares) or 'varpro' (variable projection: the amplitudes of Gaussian/Lorentzian/Voigt/PseudoVoigt peaks of 'multipeak' peak model are found by bounded linear least squares for each trial set of the other parameters, see varpro.VarPro)
+                    'levels'[[factor, tolerance], ...]: coarse-to-fine schedule. The spectrum binned by each factor is fitted with the tolerance (ftol, xtol and gtol) of the level in the given order, the next level starts from the solution of the previous one (bg_p starts from its initial value, bg_lam is kept inside its limits) and the last fit is the fit at full resolution with 'kws' tolerances. E.g. [[8, 1e-6], [2, 1e-8]]. No coarse levels by default
+                    'start'(dict): {param_name: value} the initial values of the lmfit parameters (e.g. 'values' of the previous fit result) replacing the initial values of the other params. The values are clipped by the limits, the absent names and NaN values are ignored
+                    'fixed'[]: the array of flags of the peaks. The parameters of the flagged peaks are not varied (they are fixed at the initial or 'start' values). No fixed peaks by default
+                    'budget'(double): wall-clock budget of the fit of the spectrum in seconds. The fit is stopped when the budget is spent and the best evaluated point is returned. No budget by default
+                    'deadline'(double): time.time() value when the fit is stopped (the same as 'budget', but shared by the fits of many spectra or processes)
+                    'cancel'(object): cancellation token with is_set() method (e.g. threading.Event). The fit is stopped when the token is set
+                    'progress'(function): progress(nfev, chisqr, elapsed) is called after every evaluation of the model (iter_cb of lmfit) with the number of the evaluations, the chi-square and the time from the start of the fit
+                    'irf': instrument response (slit function) of the spectrometer: [offsets, values] array (the response at the offsets from the line position in x units) or 1d array of the samples of the response on the step of x with the line at the middle sample (see response.make_response). The peaks are convolved with the response by FFT (response.ConvolvedModel), so the fitted widths are the widths of the lines without the instrumental broadening. The baseline is not convolved. The 'varpro' fit mode is not used with the response
 
                 limits(dict): Dictionary contains limits of parameter fitting {'amplitude':[],'center':[],'width':[],'baseline_auto':[]}
                     'amplitude'[][]: the array contains pairs minimum and maximum values of amplitude.
@@ -335,56 +486,366 @@ class FittingMap(object):
                         The limits of Weighting of positive residuals (p) are p_min<p<p_max
                     'energy'[E_min, E_max][]: Limits of activation energy E_min<E<E_max in TSL_ and TD_ fits
                     'factor'[f_min, f_max][]: Limits of frequency factor in TSL_ and TD_ fits
+                    'order'[b_min, b_max][]: Limits of kinetic order of TSLGO and TDGO peaks ([1, 2] by default)
         """
         pref = 'f' + repr(num) + '_'
         method = params['method'][num]
-        if (method == 'TSL1') or (method == 'TSL2') or (method == 'TD1') or (method == 'TD2'):
-            if method == 'TSL1':
-                model = Model(self.__TSL1__, prefix=pref)
-            if method == 'TSL2':
-                model = Model(self.__TSL2__, prefix=pref)
-            if method == 'TD1':
-                model = Model(self.__TD1__, prefix=pref)
-            if method == 'TD2':
-                model = Model(self.__TD2__, prefix=pref)
-            if 'energy' not in limits:
-                limits['energy'][num] = [0, 2]
-            if 'factor' not in limits:
-                limits['factor'][num] = [1e7, 1e14]
-            if 'amplitude' not in limits:
-                limits['amplitude'][num] = [0, 1000]
-
-            model.set_param_hint(pref + 'amplitude', value=params['amplitude'][num],
-                                 min=limits['amplitude'][num][0] * params['amplitude'][num],
-                                 max=limits['amplitude'][num][1] * params['amplitude'][num])
-            model.set_param_hint(pref + 'energy', value=params['energy'][num],
-                                 min=limits['energy'][num][0],
-                                 max=limits['energy'][num][1])
-            model.set_param_hint(pref + 'factor', value=params['factor'][num],
-                                 min=limits['factor'][num][0],
-                                 max=limits['factor'][num][1])
+        if method in gc.GLOWS:
+            model = Model(getattr(self, '__' + method + '__'), prefix=pref)
+            for name, hint in self.__tsl_bounds__(num, params, limits).items():
+                model.set_param_hint(name, **hint)
+            return model
+        elif not hasattr(lmfit.models, method + 'Model') and method in mp.SHAPES:
+            model = mp.peak_model(method, prefix=pref)
+            self.__set_peak_hints__(model, num, params, limits)
             return model
         else:
             bar = getattr(lmfit.models, method + 'Model')
             model = bar(prefix=pref)
-            if 'amplitude' not in limits:
-                limits['amplitude'][num] = [0, 1000]
-            if 'width' not in limits:
-                limits['amplitude'][num] = [0.4, 4]
-            if 'center' not in limits:
-                limits['amplitude'][num] = [5, 5]
-            model.set_param_hint(pref + 'amplitude', value=params['amplitude'][num],
-                                 min=limits['amplitude'][num][0] * params['amplitude'][num],
-                                 max=limits['amplitude'][num][1] * params['amplitude'][num])
-            model.set_param_hint(pref + 'center', value=params['center'][num],
-                                 min=params['center'][num] - limits['center'][num][0],
-                                 max=params['center'][num] + limits['center'][num][1])
-            model.set_param_hint(pref + 'sigma', value=params['width'][num],
-                                 min=params['width'][num] * limits['width'][num][0],
-                                 max=params['width'][num] * limits['width'][num][1])
+            self.__set_peak_hints__(model, num, params, limits)
             return model
 
-    def map_intensity(self, item):
+    @staticmethod
+    def __tsl_bounds__(num, params, limits):
+        """
+            Private method returns {param_name: {'value':, 'min':, 'max':}} the initial values and limits of amplitude,
+            energy and factor (and order of TSLGO and TDGO) of the TSL_ or TD_ curve num
+        """
+        pref = 'f' + repr(num) + '_'
+        if 'energy' not in limits:
+            limits['energy'][num] = [0, 2]
+        if 'factor' not in limits:
+            limits['factor'][num] = [1e7, 1e14]
+        if 'amplitude' not in limits:
+            limits['amplitude'][num] = [0, 1000]
+        bounds = {pref + 'amplitude': dict(value=params['amplitude'][num],
+                                           min=limits['amplitude'][num][0] * params['amplitude'][num],
+                                           max=limits['amplitude'][num][1] * params['amplitude'][num]),
+                  pref + 'energy': dict(value=params['energy'][num], min=limits['energy'][num][0],
+                                        max=limits['energy'][num][1]),
+                  pref + 'factor': dict(value=params['factor'][num], min=limits['factor'][num][0],
+                                        max=limits['factor'][num][1])}
+        if gc.GLOWS[params['method'][num]][0] is None:
+            order = limits['order'][num] if 'order' in limits else [1.0, 2.0]
+            bounds[pref + 'order'] = dict(value=params['order'][num] if 'order' in params else 1.5, min=order[0],
+                                          max=order[1])
+        return bounds
+
+    @staticmethod
+    def __peak_bounds__(num, params, limits):
+        """
+            Private method returns {param_name: {'value':, 'min':, 'max':}} the initial values and limits of amplitude,
+            center and sigma of the peak num
+        """
+        pref = 'f' + repr(num) + '_'
+        if 'amplitude' not in limits:
+            limits['amplitude'][num] = [0, 1000]
+        if 'width' not in limits:
+            limits['amplitude'][num] = [0.4, 4]
+        if 'center' not in limits:
+            limits['amplitude'][num] = [5, 5]
+        return {pref + 'amplitude': dict(value=params['amplitude'][num],
+                                         min=limits['amplitude'][num][0] * params['amplitude'][num],
+                                         max=limits['amplitude'][num][1] * params['amplitude'][num]),
+                pref + 'center': dict(value=params['center'][num],
+                                      min=params['center'][num] - limits['center'][num][0],
+                                      max=params['center'][num] + limits['center'][num][1]),
+                pref + 'sigma': dict(value=params['width'][num],
+                                     min=params['width'][num] * limits['width'][num][0],
+                                     max=params['width'][num] * limits['width'][num][1])}
+
+    @staticmethod
+    def __set_peak_hints__(model, num, params, limits):
+        """
+            Private method that sets the initial values and limits of amplitude, center and sigma of the peak num
+        """
+        for name, hint in FittingMap.__peak_bounds__(num, params, limits).items():
+            model.set_param_hint(name, **hint)
+
+    def __make_peaks_model__(self, number_of_peaks, params, limits):
+        """
+            Private method that generate the model of all peaks for least square fitting.
+            If params['peak_model'] is 'multipeak' (default) the Gaussian, Lorentzian, Voigt and PseudoVoigt peaks are
+            evaluated by one multipeak.MultiPeakModel, the TSL_ and TD_ curves by one glowcurve.GlowModel and the peaks
+            of the other methods are added as separate models of __make_model__. If params['peak_model'] is 'composite'
+            the model is the sum of __make_model__ models. If params['irf'] is given, the model of the peaks is
+            convolved with the instrument response (response.ConvolvedModel).
+            The names of the parameters and components are the same in both cases.
+            Args:
+                number_of_peaks(int): number of fitting curves
+                params{}(dict), limits(dict): see __make_model__
+        """
+        mod = None
+        nums = range(number_of_peaks)
+        if params.get('peak_model', 'multipeak') == 'multipeak':
+            methods = {num: params['method'][num] for num in nums if params['method'][num] in mp.SHAPES}
+            if methods:
+                mod = mp.MultiPeakModel(methods)
+                for num in methods:
+                    self.__set_peak_hints__(mod, num, params, limits)
+                nums = [num for num in nums if num not in methods]
+            glows = {num: params['method'][num] for num in nums if params['method'][num] in gc.GLOWS}
+            if glows:
+                glow = gc.GlowModel(glows)
+                for num in glows:
+                    for name, hint in self.__tsl_bounds__(num, params, limits).items():
+                        glow.set_param_hint(name, **hint)
+                mod = glow if mod is None else mod + glow
+                nums = [num for num in nums if num not in glows]
+        for i in nums:
+            this_mod = self.__make_model__(i, params, limits)
+            if mod is None:
+                mod = this_mod
+            else:
+                mod = mod + this_mod
+        if params.get('irf') is not None:
+            mod = rs.ConvolvedModel(mod, rs.make_response(params['irf']))
+        return mod
+
+    def __make_baseline_model__(self, params, limits):
+        """
+            Private method that generate the bg_ model of baseline for least square fitting. The baseline method is
+            params['baseline_method'] ('als' by default). The arpls and airpls methods do not use p, so the bg_p
+            parameter is fixed for them.
+            Args:
+                params{}(dict): Dictionary contains parameters of fitting. The 'baseline_auto', 'baseline_method', 'als_tol' and 'backend' values are used.
+                limits(dict): Dictionary contains limits of parameter fitting. The 'baseline_auto' limits are used.
+        """
+        method = params.get('baseline_method', 'als')
+        if method == 'als':
+            niter, tol = self.__als_options__(params, 'baseline_auto')
+            model = Model(self.__baseline_als__, prefix='bg_', independent_vars=['t'], param_names=['lam', 'p'],
+                          backend=params.get('backend'), niter=niter, tol=tol)
+        elif method in bsl.METHODS:
+            opts = {'niter': int(params['baseline_auto'][2])} if len(params['baseline_auto']) > 2 else {}
+            model = Model(self.__baseline_pls__, prefix='bg_', independent_vars=['t'], param_names=['lam', 'p'],
+                          method=method, **opts)
+        else:
+            raise ValueError(f'Unknown baseline method {method}. Available methods: {", ".join(bsl.METHODS)}')
+        for name, hint in self.__baseline_bounds__(params, limits).items():
+            model.set_param_hint(name, **hint)
+        model.set_param_hint('p', vary=method == 'als')
+        return model
+
+    @staticmethod
+    def __baseline_bounds__(params, limits):
+        """
+            Private method returns {param_name: {'value':, 'min':, 'max':}} the initial values and limits of lam and p
+            of the bg_ baseline
+        """
+        return {'bg_lam': dict(value=params['baseline_auto'][0], min=limits['baseline_auto'][0][0],
+                               max=limits['baseline_auto'][0][1]),
+                'bg_p': dict(value=params['baseline_auto'][1], min=limits['baseline_auto'][1][0],
+                             max=limits['baseline_auto'][1][1])}
+
+    def __model_key__(self, number_of_peaks, params, baseline):
+        """
+            Private method returns the signature of the fit model: the methods of the peaks, the peak model, the
+            instrument response and the baseline mode. The fits with the same signature use the same model of modelcache.model_cache
+            Args:
+                number_of_peaks(int): number of fitting curves (0 for the fit of the baseline only)
+                params{}(dict): see __make_model__
+                baseline(bool): the bg_ baseline is the part of the model
+        """
+        peaks = (tuple(params['method'][:number_of_peaks]), params.get('peak_model', 'multipeak'),
+                 rs.make_response(params['irf']).key if number_of_peaks and params.get('irf') is not None else None)
+        if not baseline:
+            return peaks, None
+        method = params.get('baseline_method', 'als')
+        if method == 'als':
+            niter, tol = self.__als_options__(params, 'baseline_auto')
+        else:
+            niter = int(params['baseline_auto'][2]) if len(params['baseline_auto']) > 2 else None
+            tol = None
+        return peaks, (method, params.get('backend'), niter, tol)
+
+    def __fit__(self, y, number_of_peaks, params, limits, baseline, **kws):
+        """
+            Private method runs the least square fitting of the model of __fit_model__ and returns lmfit ModelResult.
+            If params['levels'] is given, the coarse-to-fine schedule is used: the spectrum binned by the factor of
+            the level is fitted with the tolerance of the level, and the next level starts from its solution. The last
+            fit is the fit of the spectrum at full resolution with params['kws'] tolerances. The ALS penalty of the
+            binned spectrum is lam/factor**4, so the fitted bg_lam is scaled back and clipped inside its limits (see
+            __interior__). The bg_p of the binned spectrum is not carried over to the next level.
+            Args:
+                y(floats): y-values of the spectrum
+                number_of_peaks(int), params{}(dict), limits(dict), baseline(bool): see __fit_model__
+                kws: independent variables of the model (x, t) and max_nfev of lmfit Model.fit
+        """
+        if params.get('irf') is not None:
+            params = dict(params, irf=rs.make_response(params['irf'], kws.get('x')))
+        mod, pars, fit_kws = self.__fit_model__(number_of_peaks, params, limits, baseline)
+        monitor = self.__monitor__(params)
+        for factor, tolerance in params.get('levels', []):
+            factor = int(factor)
+            if factor <= 1:
+                continue
+            level_pars = copy.deepcopy(pars)
+            if 'bg_lam' in level_pars:
+                lam = level_pars['bg_lam']
+                lam.set(min=lam.min / factor ** 4, max=lam.max / factor ** 4, value=lam.value / factor ** 4)
+            level_kws = {key: self.__bin__(value, factor) if key in ('x', 't') else value for key, value in kws.items()}
+            level_fit_kws = dict(fit_kws, ftol=tolerance, xtol=tolerance, gtol=tolerance)
+            out = self.__solve__(mod, level_pars, level_fit_kws, self.__bin__(y, factor), dict(params, calc_covar=False),
+                                 monitor, **level_kws)
+            for name, par in pars.items():
+                if not par.vary or par.expr is not None or name == 'bg_p':
+                    continue
+                if name == 'bg_lam':
+                    par.value = self.__interior__(par, out.params[name].value * factor ** 4)
+                else:
+                    par.value = out.params[name].value
+            if monitor is not None and monitor.stopped():
+                break
+        out = self.__solve__(mod, pars, fit_kws, y, params, monitor, **kws)
+        out.stopped = None if monitor is None else monitor.reason
+        return out
+
+    @staticmethod
+    def __interior__(par, value, margin=0.05):
+        """
+            Private method returns the positive value clipped into the limits of the Parameter par shrunk by the margin
+            (the fraction of the range of the limits in the logarithmic scale). The bg_lam of the binned spectrum is
+            often pinned to its limit, and the fit at full resolution started at the limit stays there
+        """
+        low, high = par.min, par.max
+        if not (np.isfinite(low) and np.isfinite(high)) or low <= 0 or value <= 0:
+            return value
+        span = margin * np.log(high / low)
+        return float(np.exp(np.clip(np.log(value), np.log(low) + span, np.log(high) - span)))
+
+    @staticmethod
+    def __monitor__(params):
+        """
+            Private method returns monitor.FitMonitor of params['budget'], params['deadline'], params['cancel'] and
+            params['progress'] or None if they are not given
+        """
+        keys = ('budget', 'deadline', 'cancel', 'progress')
+        if all(params.get(key) is None for key in keys):
+            return None
+        return mn.FitMonitor(**{key: params.get(key) for key in keys})
+
+    @staticmethod
+    def __bin__(y, factor):
+        """
+            Private method returns the means of the bins of factor points of the array y (the last bin may be shorter)
+        """
+        y = np.asarray(y, dtype=np.float64)
+        starts = np.arange(0, len(y), factor)
+        return np.add.reduceat(y, starts) / np.diff(np.append(starts, len(y)))
+
+    def __solve__(self, mod, pars, fit_kws, y, params, monitor=None, **kws):
+        """
+            Private method runs the least square fitting of the model mod from the Parameters pars.
+            If params['fit_mode'] is 'varpro' and the peaks are evaluated by multipeak.MultiPeakModel, the amplitudes
+            of the peaks are eliminated by the variable projection (varpro.VarPro): only centers, widths and baseline
+            parameters are iterated and the amplitudes are found by bounded linear least squares. The joint fitting
+            of all parameters starts from the VarPro solution then, so the result is the same ModelResult (with the
+            varpro_nfev and varpro_njev counters of VarPro).
+            The monitor (monitor.FitMonitor) is iter_cb of the fit. If it stops the fit, the result is evaluated at the
+            best point of the fit.
+        """
+        if monitor is not None:
+            monitor.reset()
+        if params.get('fit_mode', 'joint') == 'varpro' and vp.is_supported(mod):
+            jac = fit_kws.get('jac')
+            if not isinstance(jac, jc.ModelJacobian):
+                jac = self.__fit_kws__(dict(params, kws={}, jac='analytic'), mod)['jac']
+            tolerances = {key: value for key, value in fit_kws.items() if key in ('ftol', 'xtol', 'gtol')}
+            independent = {key: value for key, value in kws.items() if key != 'max_nfev'}
+            solver = vp.VarPro(mod, jac)
+            pars = solver.fit(y, pars, max_nfev=kws.get('max_nfev'), iter_cb=monitor, **tolerances, **independent)
+            if monitor is not None:
+                monitor.reset()
+            out = mod.fit(y, params=pars, method='least_squares', fit_kws=fit_kws,
+                          calc_covar=params.get('calc_covar', False), iter_cb=monitor, **kws)
+            out = self.__best__(out, mod, fit_kws, y, monitor, **kws)
+            out.varpro_nfev, out.varpro_njev = solver.nfev, solver.njev
+            return out
+        out = mod.fit(y, params=pars, method='least_squares', fit_kws=fit_kws,
+                      calc_covar=params.get('calc_covar', False), iter_cb=monitor, **kws)
+        return self.__best__(out, mod, fit_kws, y, monitor, **kws)
+
+    @staticmethod
+    def __best__(out, mod, fit_kws, y, monitor, **kws):
+        """
+            Private method returns the result of the fit stopped by the monitor at the best evaluated point. lmfit keeps
+            the last evaluated point of the aborted fit, so the model is evaluated at the best point by the fit aborted
+            at the first evaluation. The other results are returned as is.
+        """
+        if monitor is None or not out.aborted or monitor.reason is None or monitor.best is None:
+            return out
+        pars = copy.deepcopy(out.init_params)
+        for name, value in monitor.best.items():
+            pars[name].value = value
+        best = mod.fit(y, params=pars, method='least_squares', fit_kws=fit_kws, calc_covar=False,
+                       iter_cb=lambda *args, **kwargs: True, **kws)
+        best.nfev = out.nfev
+        return best
+
+    def __fit_model__(self, number_of_peaks, params, limits, baseline):
+        """
+            Private method returns the model, its Parameters and fit_kws of the least square fitting.
+            The model is taken from modelcache.model_cache by the signature __model_key__ and is constructed by
+            __make_peaks_model__ and __make_baseline_model__ only once. The initial values and bounds of the fit are
+            set to the new Parameters of the model.
+            Args:
+                number_of_peaks(int): number of fitting curves (0 for the fit of the baseline only)
+                params{}(dict), limits(dict): see __make_model__
+                baseline(bool): add the bg_ baseline model
+            Returns:
+                mod(object): lmfit model
+                pars(object): lmfit Parameters
+                fit_kws(dict): see __fit_kws__
+        """
+        def build():
+            mod = None
+            if number_of_peaks:
+                mod = self.__make_peaks_model__(number_of_peaks, params, limits)
+            if baseline:
+                bl = self.__make_baseline_model__(params, limits)
+                mod = bl if mod is None else mod + bl
+            return mod
+
+        template = mc.model_cache.get(self.__model_key__(number_of_peaks, params, baseline), build)
+        values = {}
+        for num in range(number_of_peaks):
+            if params['method'][num] in gc.GLOWS:
+                values.update(self.__tsl_bounds__(num, params, limits))
+            else:
+                values.update(self.__peak_bounds__(num, params, limits))
+        if baseline:
+            values.update(self.__baseline_bounds__(params, limits))
+        pars = template.make_params(values)
+        self.__warm_start__(pars, number_of_peaks, params)
+        return template.model, pars, self.__fit_kws__(params, template.model, template.jacobians)
+
+    @staticmethod
+    def __warm_start__(pars, number_of_peaks, params):
+        """
+            Private method sets the initial values of params['start'] (e.g. the 'values' of the previous fit result) to
+            the Parameters pars and fixes the parameters of the peaks of params['fixed']. The bounds of the parameters
+            are not changed, so the start values are clipped by them. The start values of the absent parameters and NaN
+            values are ignored.
+            Args:
+                pars(object): lmfit Parameters of __fit_model__
+                number_of_peaks(int): number of fitting curves
+                params{}(dict): see __make_model__
+        """
+        for name, value in params.get('start', {}).items():
+            if name in pars and pars[name].expr is None and np.isfinite(value):
+                pars[name].set(value=float(np.clip(value, pars[name].min, pars[name].max)))
+        fixed = params.get('fixed')
+        if fixed is None:
+            return
+        for num in range(number_of_peaks):
+            if fixed[num]:
+                pref = 'f' + repr(num) + '_'
+                for name, par in pars.items():
+                    if name.startswith(pref) and par.expr is None:
+                        par.set(vary=False)
+
+    def map_intensity(self, item, start=None):
         """
         The method makes peak fitting in each point of hyperspectral map.
         Args:
@@ -397,24 +858,24 @@ class FittingMap(object):
                 item[5](float): minimum value on abscissa axis of the spectra.
                 item[6](float): maximum value on abscissa axis of the spectra.
                 item[7](float): step between neighbouring abscissa values (step of the spectra)
+                item[8](floats): optional precomputed als baseline of the cropped spectrum (see __map_baselines__)
+            start(dict): {param_name: value} the initial values of the point replacing params['start'] (e.g. the mean
+                fitted values of the neighbouring points, see __neighbour_start__)
         Returns:
-            There two cases.
-            If the peak fit takes place the method returns dictionary. The one contains arrays with fitting parameters. The length of the each array is equal to number of peaks in fitting procedure. The dictionary structure is:
-                {'amplitude': A, 'FWHM': FWHM, 'center': C, 'height': H, 'sigma': S, 'r-square': Rsq}
-                'amplitude'(floats): array-like values of amplitudes of deconvoluted peaks
-                'FWHM'(floats): array-like values of peaks FWHM
-                'center'(floats): array-like values of x-coordinates of the peaks
-                'height'(floats): array-like values of y-coordinates of the peaks
-                'sigma'(floats): array-like values of peak sigmas
-                'r-square'(float): the R-square value of fitting
-            If the als fit is selected. The method returns:
-                {'amplitude': 0, 'FWHM': 0, 'center': 0, 'height': 0, 'r-square': Rsq, 'sigma': 0}
+            The compact record of the point (the float arrays only, so the record is cheap to send from the worker
+            process), which is assembled by find_intensity:
+            values(floats): the values of RECORD_VALUES (R-square, lam and p of the baseline, number of the evaluations,
+                status code of mapresult.STATUS) followed by the values of RECORD_PEAKS of each peak: [amplitudes..., FWHMs..., centers..., heights...,
+                sigmas...]. The peak values are absent if the als fit is selected
+            curves(floats): 2d array, the rows are the best fit, the baseline and the components f0_, f1_, ... of the
+                peaks
         """
         params = self.param
         limits = self.limit
-        z_={}
         if 'range' not in params:
             params['range'] = [item[5], item[6]]
+        if start is not None:
+            params = dict(params, start=start)
 
         xmin = params['range'][0]
         xmax = params['range'][1]
@@ -422,6 +883,7 @@ class FittingMap(object):
         y = item[0][self.__get_numarray(item, xmin):self.__get_numarray(item, xmax)]
         x = np.linspace(xmin, xmax, len(y))
 
+        baseline_flag = True
         if 'baseline' not in params:
             baseline_flag = False
         if baseline_flag:
@@ -447,71 +909,57 @@ class FittingMap(object):
         if 'baseline_auto' not in params:
 
             if baseline_flag:
-                b_line = self.__baseline_als__(y, self.lam, self.p)
+                if len(item) > 8:
+                    b_line = item[8]
+                else:
+                    b_line = self.__baseline_als__(y, self.lam, self.p, params.get('backend'), *self.__als_options__(params))
                 y = np.subtract(y, b_line)
 
         if 'kws' not in params:
             params['kws'] = {'ftol': 1e-8, 'xtol': 1e-8, 'gtol': 1e-8}
-        fit_kws = params['kws']
-        mod = None
         global counter
-        name = str(item[1]) + '_' + str(item[2])
-        if params['method'][0] != 'als':
-
-            for i in range(number_of_peaks):
-                this_mod = self.__make_model__(i, params, limits)
-                if mod is None:
-                    mod = this_mod
-                else:
-                    mod = mod + this_mod
+        if params['method'][0] == 'als':
+            number_of_peaks = 0
         if 'baseline_auto' in params:
             if 'baseline_auto' not in limits:
                 limits['baseline_auto'] = [[1e4, 1e12], [0.0001, 0.1]]
-            bl = Model(self.__baseline_als__, prefix='bg_')
-            bl.set_param_hint('lam', value=params['baseline_auto'][0], min=limits['baseline_auto'][0][0],
-                              max=limits['baseline_auto'][0][1])
-            bl.set_param_hint('p', value=params['baseline_auto'][1], min=limits['baseline_auto'][1][0],
-                              max=limits['baseline_auto'][1][1])
-            if params['method'][0] != 'als':
-                mod = mod + bl
-            else:
-                mod = bl
-
-            out = mod.fit(y, x=x, t=y, method='least_squares', fit_kws=fit_kws)
+            out = self.__fit__(y, number_of_peaks, params, limits, True, x=x, t=y)
             comps = out.eval_components(x=x)
-            self.map_baseline[name] = [out.best_fit, item[1], item[2], len(y), len(y), xmin, xmax, item[7], comps]
-            self.map_bline[name] = [x, comps['bg_'], out.params['bg_lam'], out.params['bg_p']]
-
+            b_line = comps['bg_']
+            lam, p = out.params['bg_lam'].value, out.params['bg_p'].value
         else:
-            out = mod.fit(y, x=x, method='least_squares', fit_kws=fit_kws)
-            # with counter.get_lock():
-            self.components = out.eval_components(x=x)
-            self.map_baseline[name] = [out.best_fit, item[1], item[2], len(y), len(y), xmin, xmax, item[7], self.components]
+            out = self.__fit__(y, number_of_peaks, params, limits, False, x=x)
+            comps = out.eval_components(x=x)
             if baseline_flag:
-                self.map_bline[name] = [x, b_line, self.lam, self.p]
+                lam, p = self.lam, self.p
             else:
-                self.map_bline[name] = [x, np.zeros(len(x)), 0, 0]
+                b_line = np.zeros(len(x))
+                lam, p = 0, 0
         Rsq = 1 - out.redchi / np.var(y, ddof=0)
-
+        values = [np.array([Rsq, lam, p, out.nfev, mr.STATUS[out.stopped]], dtype=np.float64)]
         if params['method'][0] != 'als':
-            A = np.array([out.params['f' + repr(num) + '_amplitude'] for num in range(number_of_peaks)])
-            FWHM = np.array([out.params['f' + repr(num) + '_fwhm'] for num in range(number_of_peaks)])
-            C = np.array([out.params['f' + repr(num) + '_center'] for num in range(number_of_peaks)])
-            H = np.array([out.params['f' + repr(num) + '_height'] for num in range(number_of_peaks)])
-            S = np.array([out.params['f' + repr(num) + '_sigma'] for num in range(number_of_peaks)])
+            values += [np.array([out.params['f' + repr(num) + '_' + key.lower()].value for num in range(number_of_peaks)],
+                                dtype=np.float64) for key in RECORD_PEAKS]
+        curves = np.zeros((number_of_peaks + 2, len(y)))
+        curves[0] = out.best_fit
+        curves[1] = b_line
+        for num in range(number_of_peaks):
+            if 'f' + repr(num) + '_' in comps:
+                curves[num + 2] = comps['f' + repr(num) + '_']
 
         with counter.get_lock():
             counter.value += 1
             # time_elapsed=' '+str(int(tm.time()-time0))+' sec'
             self.__pBar__.printProgressBar(counter.value, self.leng, prefix='Progress:', suffix='', length=50)
-        if params['method'][0] != 'als':
-
-            return {'key': str(item[1])+'_'+str(item[2]), 'amplitude': A, 'FWHM': FWHM, 'center': C, 'height': H, 'sigma': S, 'r-square': Rsq}
-            # return {'amplitude': A, 'FWHM': FWHM, 'center': C, 'height': H, 'sigma': S, 'r-square': Rsq}
-        else:
-            return {'key': str(item[1])+'_'+str(item[2]), 'amplitude': 0, 'FWHM': 0, 'center': 0, 'height': 0, 'r-square': Rsq, 'sigma': 0}
-            # return {'amplitude': 0, 'FWHM': 0, 'center': 0, 'height': 0, 'r-square': Rsq, 'sigma': 0}
+        return np.concatenate(values), curves
 
+    @staticmethod
+    def __values__(out):
+        """
+            Private method returns {param_name: value} the fitted values of the parameters of the model of the lmfit
+            ModelResult out (the parameters added by post_fit are skipped)
+        """
+        return {name: float(out.params[name].value) for name, par in out.init_params.items() if par.expr is None}
 
     def fit_array(self, x, y, params=None, limits=None, name=''):
         """
@@ -521,7 +969,7 @@ class FittingMap(object):
              y (floats): array-like y-axis of the fitted spectrum. The length of x should be equal the length of y arrays.
              params{}(dict): Dictionary contains parameters of fitting
                     'range': range of fitting on absciss axis. This is array contains xmin and xmax values [xmin,xmax]. By default the input spectrum is fitted in all range.
-                    'method': the array of names of the fitting method. The length of array is the number of fitting curve that will be used. There are Gaussian/Voigt/Lorenzian,PseudoVoigt for peak detection. For thermally stimullated processes the TSL glow curve of 1 order TSL_1, second order TSL_2 and thermally stimulated decay curve  TD_1 and TD_2 is available.
+                    'method': the array of names of the fitting method. The length of array is the number of fitting curve that will be used. There are Gaussian/Voigt/Lorenzian,PseudoVoigt for peak detection (VoigtHumlicek and VoigtTCH are the fast approximations of Voigt, see lineshapes). For thermally stimullated processes the TSL glow curve of 1 order TSL_1, second order TSL_2 and thermally stimulated decay curve  TD_1 and TD_2 is available. TSLGO and TDGO are the curves of general-order kinetics with the fitted order (see glowcurve).
                     'amplitude': the array of values of initial amplitudes of peaks in peak fitting procedure. The length of array is the number of fitting curve that will be used.
                     'center': the array of values of initial centers (x-coordinate) of peaks in peak fitting procedure. The length of array is the number of fitting curve that will be used.
                     'width': the array of values of initial widths of peaks in peak fitting procedure. The length of array is the number of fitting curve that will be used.
@@ -537,6 +985,23 @@ class FittingMap(object):
                     'max_nfev' (int): number of least square fit iterations.
                     'energy'[]: Activation energy for each peak in TSL_ and TD_ fits
                     'factor'[]: Frequency factor in TSL_ and TD_ fits
+                    'order'[]: Initial kinetic order of TSLGO and TDGO peaks (1.5 by default)
+                    'backend'(str): ALS engine of the baseline: 'native' (convolution.so/convolution.dll) or 'numpy' (banded solver of scipy)
+                    'als_tol'(double): tolerance of the als weight vector change for the early stopping of the numpy engine. By default baseline.default_tol
+                    'baseline_method'(str): method of the bg_ baseline in baseline_auto fits: 'als' (default), 'arpls' or 'airpls'. The arpls and airpls methods fit lam only
+                    'peak_model'(str): 'multipeak' (default, Gaussian/Lorentzian/Voigt/PseudoVoigt peaks are evaluated at once by multipeak.MultiPeakModel) or 'composite' (sum of lmfit models)
+                    'calc_covar'(bool): estimate the uncertainties of the fitted parameters (stderr). False by default
+                    'jac'(str): Jacobian of least square fitting: 'analytic' (default, closed-form derivatives of the peaks and implicit differentiation of ALS baseline), 'numeric' (finite differences of the single components) or '2-point'/'3-point' of scipy
+                    'jac_window'(double): half width of the peak support in units of the peak width (sigma). If it is given, the Jacobian columns of the peak parameters are calculated within center +/- jac_window*sigma only ('analytic'/'numeric') or the finite differences of the peaks with disjoint windows are calculated together ('2-point'/'3-point'). The Gaussian peaks are exact for jac_window >= 10, the Lorentzian tails need wider windows. None by default (dense Jacobian)
+                    'fit_mode'(str): 'joint' (default, all parameters are fitted by least_squares) or 'varpro' (variable projection: the amplitudes of Gaussian/Lorentzian/Voigt/PseudoVoigt peaks of 'multipeak' peak model are found by bounded linear least squares for each trial set of the other parameters, see varpro.VarPro)
+                    'levels'[[factor, tolerance], ...]: coarse-to-fine schedule. The spectrum binned by each factor is fitted with the tolerance (ftol, xtol and gtol) of the level in the given order, the next level starts from the solution of the previous one (bg_p starts from its initial value, bg_lam is kept inside its limits) and the last fit is the fit at full resolution with 'kws' tolerances. E.g. [[8, 1e-6], [2, 1e-8]]. No coarse levels by default
+                    'start'(dict): {param_name: value} the initial values of the lmfit parameters (e.g. 'values' of the previous fit result) replacing the initial values of the other params. The values are clipped by the limits, the absent names and NaN values are ignored
+                    'fixed'[]: the array of flags of the peaks. The parameters of the flagged peaks are not varied (they are fixed at the initial or 'start' values). No fixed peaks by default
+                    'budget'(double): wall-clock budget of the fit of the spectrum in seconds. The fit is stopped when the budget is spent and the best evaluated point is returned. No budget by default
+                    'deadline'(double): time.time() value when the fit is stopped (the same as 'budget', but shared by the fits of many spectra or processes)
+                    'cancel'(object): cancellation token with is_set() method (e.g. threading.Event). The fit is stopped when the token is set
+                    'progress'(function): progress(nfev, chisqr, elapsed) is called after every evaluation of the model (iter_cb of lmfit) with the number of the evaluations, the chi-square and the time from the start of the fit
+                    'irf': instrument response (slit function) of the spectrometer: [offsets, values] array (the response at the offsets from the line position in x units) or 1d array of the samples of the response on the step of x with the line at the middle sample (see response.make_response). The peaks are convolved with the response by FFT (response.ConvolvedModel), so the fitted widths are the widths of the lines without the instrumental broadening. The baseline is not convolved. The 'varpro' fit mode is not used with the response
 
              limits(dict): Dictionary contains limits of parameter fitting {'amplitude':[],'center':[],'width':[],'baseline_auto':[]}
                     'amplitude'[][]: the array contains pairs minimum and maximum values of amplitude.
@@ -556,6 +1021,7 @@ class FittingMap(object):
                         The limits of Weighting of positive residuals (p) are p_min<p<p_max
                     'energy'[E_min, E_max][]: Limits of activation energy E_min<E<E_max in TSL_ and TD_ fits
                     'factor'[f_min, f_max][]: Limits of frequency factor in TSL_ and TD_ fits
+                    'order'[b_min, b_max][]: Limits of kinetic order of TSLGO and TDGO peaks ([1, 2] by default)
              name(str): the unique user-selected id of constructed fitting model.
 
          Returns:
@@ -568,12 +1034,19 @@ class FittingMap(object):
                  'height'(floats): array-like values of y-coordinates of the peaks
                  'sigma'(floats): array-like values of peak sigmas
                  'r-square'(float): the R-square value of fitting
+                 'p', 'lam': the fitted parameters of bg_ baseline
+                 'nvarys'(int): number of the varied parameters of fitting
+                 'values'(dict): {param_name: value} the fitted values of the parameters of the model (see 'start' param)
+                 'stopped'(str): None if the fit is completed, 'budget' or 'cancel' if it is stopped (see 'budget' param)
              In case of thermally stimulated process curve (TSL or TD) the dictionary with the following structure returns:
                  {'amplitude': A, 'factor': F, 'energy': E, 'r-square': Rsq}
                  'amplitude'(floats): array-like values of amplitudes of deconvoluted peaks
                  'factor'(doubles): array-like values of frequency factors
                  'energy'(floats): array-like values of activation energy
+                 'order'(floats): array-like values of kinetic orders (if there are TSLGO or TDGO curves)
                  'r-square'(float): the R-square value of fitting
+                 'values'(dict): {param_name: value} the fitted values of the parameters of the model (see 'start' param)
+                 'stopped'(str): None if the fit is completed, 'budget' or 'cancel' if it is stopped (see 'budget' param)
 
          """
         baseline_flag = True
@@ -595,8 +1068,7 @@ class FittingMap(object):
             self.lam = params['baseline'][0]
             self.p = params['baseline'][1]
 
-        if (params['method'][0] == 'TSL1') or (params['method'][0] == 'TSL2') or (params['method'][0] == 'TD1') or (
-                params['method'][0] == 'TD2'):
+        if params['method'][0] in gc.GLOWS:
             number_of_peaks = len(params['method'])
         elif (params['method'][0] == 'Als'):
             if 'baseline_auto' not in params:
@@ -610,7 +1082,7 @@ class FittingMap(object):
             number_of_peaks = len(center)
             if 'baseline_auto' not in params:
                 if baseline_flag:
-                            b_line = self.__baseline_als__(y, self.lam, self.p)
+                            b_line = self.__baseline_als__(y, self.lam, self.p, params.get('backend'), *self.__als_options__(params))
                             y = np.subtract(y, b_line)
             if 'amplitude' not in params:
                 for n in range(number_of_peaks):
@@ -623,47 +1095,27 @@ class FittingMap(object):
                     params['method'][n] = 'Gaussian'
         if 'kws' not in params:
             params['kws'] = {'ftol': 1e-8, 'xtol': 1e-8, 'gtol': 1e-8}
-        fit_kws = params['kws']
         if 'max_nfev' not in params.keys():
             params['max_nfev'] = 1000
             
-        mod = None
         if (params['method'][0] == 'Als'):
             if 'baseline_auto' not in limits:
                     limits['baseline_auto'] = [[2, 1e2], [0.1, 1]]
             
-            mod = Model(self.__baseline_als__, prefix='bg_')
-            mod.set_param_hint('lam', value=params['baseline_auto'][0], min=limits['baseline_auto'][0][0],
-                              max=limits['baseline_auto'][0][1])
-            mod.set_param_hint('p', value=params['baseline_auto'][1], min=limits['baseline_auto'][1][0],
-                              max=limits['baseline_auto'][1][1])
-            out = mod.fit(y, x=x, t=y, method='least_squares', fit_kws=fit_kws, max_nfev=params['max_nfev'])
+            out = self.__fit__(y, 0, params, limits, True, x=x, t=y, max_nfev=params['max_nfev'])
             comps = out.eval_components(x=x)    
             self.map_baseline[name] = [x, out.best_fit]        
         else:           
-            for i in range(number_of_peaks):
-                this_mod = self.__make_model__(i, params, limits)
-                if mod is None:
-                    mod = this_mod
-                else:
-                    mod = mod + this_mod
             if 'baseline_auto' in params:
                 if 'baseline_auto' not in limits:
                     limits['baseline_auto'] = [[1e4, 1e12], [0.0001, 0.1]]
-                bl = Model(self.__baseline_als__, prefix='bg_')
-                bl.set_param_hint('lam', value=params['baseline_auto'][0], min=limits['baseline_auto'][0][0],
-                              max=limits['baseline_auto'][0][1])
-                bl.set_param_hint('p', value=params['baseline_auto'][1], min=limits['baseline_auto'][1][0],
-                              max=limits['baseline_auto'][1][1])
-                mod = mod + bl
-
-                out = mod.fit(y, x=x, t=y, method='least_squares', fit_kws=fit_kws, max_nfev=params['max_nfev'])
+                out = self.__fit__(y, number_of_peaks, params, limits, True, x=x, t=y, max_nfev=params['max_nfev'])
                 comps = out.eval_components(x=x)
                 self.map_baseline[name] = [x, out.best_fit]
                 self.map_bline[name] = [x, comps['bg_'], out.params['bg_lam'], out.params['bg_p']]
 
             else:
-                out = mod.fit(y, x=x, method='least_squares', fit_kws=fit_kws)
+                out = self.__fit__(y, number_of_peaks, params, limits, False, x=x)
                 self.map_baseline[name] = [x, out.best_fit]
                 comps = out.eval_components(x=x)
                 if baseline_flag:
@@ -672,18 +1124,21 @@ class FittingMap(object):
                     self.map_bline[name] = [x, np.zeros(len(x)), 0, 0]
         self.components = comps   
 
-        if (params['method'][0] == 'TSL1') or (params['method'][0] == 'TSL2') or (params['method'][0] == 'TD1') or (
-                params['method'][0] == 'TD2'):
+        if params['method'][0] in gc.GLOWS:
             A = np.array([out.params['f' + repr(num) + '_amplitude'] for num in range(number_of_peaks)])
             F = np.array([out.params['f' + repr(num) + '_factor'] for num in range(number_of_peaks)])
             E = np.array([out.params['f' + repr(num) + '_energy'] for num in range(number_of_peaks)])
             Rsq = 1 - out.redchi / np.var(y, ddof=0)
-            return {'amplitude': A, 'factor': F, 'energy': E, 'r-square': Rsq}
+            result = {'amplitude': A, 'factor': F, 'energy': E, 'r-square': Rsq, 'values': self.__values__(out), 'stopped': out.stopped}
+            if any(gc.GLOWS[method][0] is None for method in params['method']):
+                result['order'] = np.array([out.params['f' + repr(num) + '_order'].value if 'f' + repr(num) + '_order' in out.params
+                                            else gc.GLOWS[params['method'][num]][0] for num in range(number_of_peaks)])
+            return result
         if (params['method'][0] == 'Als'):
             A=out.params['bg_lam']
             F=out.params['bg_p']
             Rsq = 1 - out.redchi / np.var(y, ddof=0)
-            return {'lam': A, 'p': F, 'r-square': Rsq}
+            return {'lam': A, 'p': F, 'r-square': Rsq, 'values': self.__values__(out), 'stopped': out.stopped}
         else:
             A = np.array([out.params['f' + repr(num) + '_amplitude'] for num in range(number_of_peaks)])
             FWHM = np.array([out.params['f' + repr(num) + '_fwhm'] for num in range(number_of_peaks)])
@@ -691,17 +1146,143 @@ class FittingMap(object):
             H = np.array([out.params['f' + repr(num) + '_height'] for num in range(number_of_peaks)])
             Rsq = 1 - out.redchi / np.var(y, ddof=0)
             S = np.array([out.params['f' + repr(num) + '_sigma'] for num in range(number_of_peaks)])
-            return {'amplitude': A, 'FWHM': FWHM, 'center': C, 'height': H, 'r-square': Rsq, 'sigma': S, 'p': out.params['bg_p'], 'lam': out.params['bg_lam']}
+            return {'amplitude': A, 'FWHM': FWHM, 'center': C, 'height': H, 'r-square': Rsq, 'sigma': S, 'p': out.params['bg_p'], 'lam': out.params['bg_lam'], 'nvarys': out.nvarys, 'values': self.__values__(out), 'stopped': out.stopped}
 
     @staticmethod
-    def __init_C__(args):
+    def __init_C__(args, fitter=None, items=None):
         """
-        The private method of progress bar initialization
+        The private method of progress bar initialization. The fitter (FittingMap with the params and limits of the map)
+        and the items of the map (sharedcube.MapCube attached to the shared memory by its name or the list of the items
+        in the calling process) are sent to the worker process once, so the tasks of the map contain the numbers of the
+        points only
         """
-        global counter
+        global counter, map_worker, map_items
         counter = args
+        map_worker = fitter
+        map_items = items
+
+    @staticmethod
+    def __map_task__(task):
+        """
+        The private method fits the point of the map in the worker process (see find_intensity)
+        Args:
+            task(int): number of the point
+        Returns:
+            number of the point, record of map_intensity, fit time in seconds, pid of the worker
+        """
+        start = tm.perf_counter()
+        record = map_worker.map_intensity(map_items[task])
+        return task, record, tm.perf_counter() - start, os.getpid()
+
+    @staticmethod
+    def __map_tile__(task):
+        """
+        The private method fits the points of the tile in the wavefront order in the worker process (see
+        find_intensity). The first point of the tile (the seed) starts from params, every next point starts from the
+        mean fitted values of its already fitted neighbours
+        Args:
+            task(list): [(number of the point, numbers of the fitted neighbours), ...]
+        Returns:
+            [(number of the point, record of map_intensity, fit time in seconds, pid of the worker), ...]
+        """
+        out = []
+        fitted = {}
+        for num, neighbours in task:
+            start = tm.perf_counter()
+            record = map_worker.map_intensity(map_items[num],
+                                              map_worker.__neighbour_start__([fitted[n] for n in neighbours]))
+            fitted[num] = record[0]
+            out.append((num, record, tm.perf_counter() - start, os.getpid()))
+        return out
+
+    def __neighbour_start__(self, records):
+        """
+        The private method returns {param_name: value} the mean fitted values of the peaks (amplitude, center, sigma)
+        and of the bg_ baseline (lam, p) of the records of map_intensity or None if there are no records. The mean of
+        lam is geometric (lam changes by orders of magnitude). The records of the stopped fits are not used
+        """
+        records = [values for values in records if values[RECORD_VALUES.index('status')] == mr.STATUS[None]]
+        if not records:
+            return None
+        mean = np.mean(records, axis=0)
+        lam = np.array([values[RECORD_VALUES.index('lam')] for values in records])
+        lam = float(np.exp(np.mean(np.log(lam)))) if np.all(lam > 0) else mean[RECORD_VALUES.index('lam')]
+        start = {'bg_lam': lam, 'bg_p': mean[RECORD_VALUES.index('p')]}
+        if self.param['method'][0] == 'als':
+            return start
+        table = mean[len(RECORD_VALUES):].reshape(len(RECORD_PEAKS), -1)
+        for key in ('amplitude', 'center', 'sigma'):
+            for num, value in enumerate(table[RECORD_PEAKS.index(key)]):
+                start['f' + repr(num) + '_' + key] = value
+        return start
 
-    def find_intensity(self, map_spectra, params, limits):
+    @staticmethod
+    def __wavefronts__(mx, my, tile):
+        """
+        The private method splits the points of the map into the square tiles and orders the points of each tile by
+        the wavefronts: the seed point nearest to the centre of the tile is the first, then the rings of its
+        neighbours (8-connected) follow outward. The points not connected to the seed start the next seed.
+        Args:
+            mx, my(ints): the coordinates of the points
+            tile(int): the size of the tile in points
+        Returns:
+            [[(number of the point, numbers of the neighbours fitted before it), ...], ...] the tiles
+        """
+        points = {(int(a), int(b)): num for num, (a, b) in enumerate(zip(mx, my))}
+        tiles = {}
+        for (a, b), num in points.items():
+            tiles.setdefault((a // tile, b // tile), []).append(num)
+        out = []
+        for nums in tiles.values():
+            cx, cy = np.mean([mx[num] for num in nums]), np.mean([my[num] for num in nums])
+            members = set(nums)
+            visited = set()
+            order = []
+            position = {}
+            for seed in sorted(nums, key=lambda num: ((mx[num] - cx) ** 2 + (my[num] - cy) ** 2, num)):
+                if seed in visited:
+                    continue
+                visited.add(seed)
+                queue = collections.deque([seed])
+                while queue:
+                    num = queue.popleft()
+                    near = [points.get((int(mx[num]) + dx, int(my[num]) + dy)) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                            if dx or dy]
+                    near = [n for n in near if n in members]
+                    position[num] = len(order)
+                    order.append((num, [n for n in near if n in position]))
+                    for n in near:
+                        if n not in visited:
+                            visited.add(n)
+                            queue.append(n)
+            out.append(order)
+        return out
+
+    def __map_baselines__(self, items, params):
+        """
+        The private method calculates the manual als baselines ('baseline' parameters) of all points of the hyperspectral
+        map at once by baseline_als_batch. The spectra are cropped as in map_intensity and grouped by length.
+        Returns:
+            baselines(list): the baselines of the cropped spectra of the items (item[8] of map_intensity)
+        """
+        baselines = [None] * len(items)
+        groups = {}
+        for num, item in enumerate(items):
+            xmin, xmax = params['range'] if 'range' in params else [item[5], item[6]]
+            y = item[0][self.__get_numarray(item, xmin):self.__get_numarray(item, xmax)]
+            groups.setdefault(len(y), []).append((num, y))
+        niter, tol = self.__als_options__(params)
+        for group in groups.values():
+            b_lines, n_iter = bsl.baseline_als_batch(np.array([y for num, y in group]), params['baseline'][0],
+                                                     params['baseline'][1], niter, backend=params.get('backend'),
+                                                     tol=tol, full_output=True)
+            for used in n_iter:
+                bsl.als_stats.record(used, niter)
+            for (num, y), b_line in zip(group, b_lines):
+                baselines[num] = b_line
+        return baselines
+
+    def find_intensity(self, map_spectra, params, limits, workers=None, chunksize=None, schedule='independent', tile=16):
         """
         The method constructs a map with fitting parameters from the hyperspectral map.
         Args:
@@ -717,7 +1298,7 @@ class FittingMap(object):
                     step: distance between adjacent x values (step of wavenumber measurement)
             params{}(dict): Dictionary contains parameters of fitting
                     'range': range of fitting on absciss axis. This is array contains xmin and xmax values [xmin,xmax]. By default the input spectrum is fitted in all range.
-                    'method': the array of names of the fitting method. The length of array is the number of fitting curve that will be used. There are Gaussian/Voigt/Lorentzian,PseudoVoigt for peak detection. For thermally stimullated processes the TSL glow curve of 1 order TSL_1, second order TSL_2 and thermally stimulated decay curve  TD_1 and TD_2 is available.
+                    'method': the array of names of the fitting method. The length of array is the number of fitting curve that will be used. There are Gaussian/Voigt/Lorentzian,PseudoVoigt for peak detection. For thermally stimullated processes the TSL glow curve of 1 order TSL_1, second order TSL_2 and thermally stimulated decay curve  TD_1 and TD_2 is available. TSLGO and TDGO are the curves of general-order kinetics with the fitted order (see glowcurve).
                     'amplitude': the array of values of initial amplitudes of peaks in peak fitting procedure. The length of array is the number of fitting curve that will be used.
                     'center': the array of values of initial centers (x-coordinate) of peaks in peak fitting procedure. The length of array is the number of fitting curve that will be used.
                     'width': the array of values of initial widths of peaks in peak fitting procedure. The length of array is the number of fitting curve that will be used.
@@ -733,6 +1314,23 @@ class FittingMap(object):
                     'max_nfev' (int): number of least square fit iterations.
                     'energy'[]: Activation energy for each peak in TSL_ and TD_ fits
                     'factor'[]: Frequency factor in TSL_ and TD_ fits
+                    'order'[]: Initial kinetic order of TSLGO and TDGO peaks (1.5 by default)
+                    'backend'(str): ALS engine of the baseline: 'native' (convolution.so/convolution.dll) or 'numpy' (banded solver of scipy)
+                    'als_tol'(double): tolerance of the als weight vector change for the early stopping of the numpy engine. By default baseline.default_tol
+                    'baseline_method'(str): method of the bg_ baseline in baseline_auto fits: 'als' (default), 'arpls' or 'airpls'. The arpls and airpls methods fit lam only
+                    'peak_model'(str): 'multipeak' (default, Gaussian/Lorentzian/Voigt/PseudoVoigt peaks are evaluated at once by multipeak.MultiPeakModel) or 'composite' (sum of lmfit models)
+                    'calc_covar'(bool): estimate the uncertainties of the fitted parameters (stderr). False by default
+                    'jac'(str): Jacobian of least square fitting: 'analytic' (default, closed-form derivatives of the peaks and implicit differentiation of ALS baseline), 'numeric' (finite differences of the single components) or '2-point'/'3-point' of scipy
+                    'jac_window'(double): half width of the peak support in units of the peak width (sigma). If it is given, the Jacobian columns of the peak parameters are calculated within center +/- jac_window*sigma only ('analytic'/'numeric') or the finite differences of the peaks with disjoint windows are calculated together ('2-point'/'3-point'). The Gaussian peaks are exact for jac_window >= 10, the Lorentzian tails need wider windows. None by default (dense Jacobian)
+                    'fit_mode'(str): 'joint' (default, all parameters are fitted by least_squares) or 'varpro' (variable projection: the amplitudes of Gaussian/Lorentzian/Voigt/PseudoVoigt peaks of 'multipeak' peak model are found by bounded linear least squares for each trial set of the other parameters, see varpro.VarPro)
+                    'levels'[[factor, tolerance], ...]: coarse-to-fine schedule. The spectrum binned by each factor is fitted with the tolerance (ftol, xtol and gtol) of the level in the given order, the next level starts from the solution of the previous one (bg_p starts from its initial value, bg_lam is kept inside its limits) and the last fit is the fit at full resolution with 'kws' tolerances. E.g. [[8, 1e-6], [2, 1e-8]]. No coarse levels by default
+                    'start'(dict): {param_name: value} the initial values of the lmfit parameters (e.g. 'values' of the previous fit result) replacing the initial values of the other params. The values are clipped by the limits, the absent names and NaN values are ignored
+                    'fixed'[]: the array of flags of the peaks. The parameters of the flagged peaks are not varied (they are fixed at the initial or 'start' values). No fixed peaks by default
+                    'budget'(double): wall-clock budget of the fit of the spectrum in seconds. The fit is stopped when the budget is spent and the best evaluated point is returned. No budget by default
+                    'deadline'(double): time.time() value when the fit is stopped (the same as 'budget', but shared by the fits of many spectra or processes)
+                    'cancel'(object): cancellation token with is_set() method (e.g. threading.Event). The fit is stopped when the token is set
+                    'progress'(function): progress(nfev, chisqr, elapsed) is called after every evaluation of the model (iter_cb of lmfit) with the number of the evaluations, the chi-square and the time from the start of the fit
+                    'irf': instrument response (slit function) of the spectrometer: [offsets, values] array (the response at the offsets from the line position in x units) or 1d array of the samples of the response on the step of x with the line at the middle sample (see response.make_response). The peaks are convolved with the response by FFT (response.ConvolvedModel), so the fitted widths are the widths of the lines without the instrumental broadening. The baseline is not convolved. The 'varpro' fit mode is not used with the response
 
             limits(dict): Dictionary contains limits of parameter fitting {'amplitude':[],'center':[],'width':[],'baseline_auto':[]}
                     'amplitude'[][]: the array contains pairs minimum and maximum values of amplitude.
@@ -752,46 +1350,138 @@ class FittingMap(object):
                         The limits of Weighting of positive residuals (p) are p_min<p<p_max
                     'energy'[E_min, E_max][]: Limits of activation energy E_min<E<E_max in TSL_ and TD_ fits
                     'factor'[f_min, f_max][]: Limits of frequency factor in TSL_ and TD_ fits
+                    'order'[b_min, b_max][]: Limits of kinetic order of TSLGO and TDGO peaks ([1, 2] by default)
+            workers(int): number of the worker processes. num_proc (the number of the available CPUs) by default. The
+                points are fitted in the calling process if workers is 1
+            chunksize(int): number of the points sent to the worker at once. The chunks are scheduled dynamically
+                (imap_unordered), by default they are small enough to give every worker about 8 chunks (at most 16
+                points). The chunks of the 'wavefront' schedule are the tiles
+            schedule(str): 'independent' (default, every point starts from params) or 'wavefront' (the map is split into
+                the tiles fitted in parallel; in each tile the seed point nearest to its centre is fitted first and the
+                fit propagates outward in the wavefronts, every point starts from the mean fitted values of the
+                already fitted neighbouring points, see __wavefronts__). The neighbouring points of Raman maps have
+                close parameters, so the warm start reduces the number of the evaluations (nfev plane)
+            tile(int): the size of the tiles of the 'wavefront' schedule in points (16 by default)
         Returns:
               x(ints): array-like mx coordinates of each point on hyperspectral map
               y(ints): array-like my coordinates of each point on hyperspectral map
-              z1(dict): array of dictionaries with the following structure:
-                 {'amplitude': A, 'FWHM': FWHM, 'center': C, 'height': H, 'sigma': S, 'r-square': Rsq}
-                 'amplitude'(floats): array-like values of amplitudes of deconvoluted peaks
-                 'FWHM'(floats): array-like values of peaks FWHM
-                 'center'(floats): array-like values of x-coordinates of the peaks
-                 'height'(floats): array-like values of y-coordinates of the peaks
-                 'sigma'(floats): array-like values of peak sigmas
-                 'r-square'(float): the R-square value of fitting
+              z1(object): mapresult.MapResult with the (ny, nx, n_peaks, n_params) array of the fitted values of the
+                 peaks (amplitude, FWHM, center, height, sigma) and the (ny, nx) planes of R-square, lam, p, nfev and
+                 status. z1[name] returns the values of the points in the order of map_spectra:
+                 'amplitude'(floats): (n_points, n_peaks) array of amplitudes of deconvoluted peaks
+                 'FWHM'(floats): (n_points, n_peaks) array of peaks FWHM
+                 'center'(floats): (n_points, n_peaks) array of x-coordinates of the peaks
+                 'height'(floats): (n_points, n_peaks) array of y-coordinates of the peaks
+                 'sigma'(floats): (n_points, n_peaks) array of peak sigmas
+                 'r-square'(floats): the R-square values of fitting
+                 'lam', 'p'(floats): the parameters of the baseline
+                 'nfev'(ints): the numbers of the evaluations of the model
+                 'status'(ints): the codes of mapresult.STATUS
+                 'time'(floats): the fit times of the points in seconds (the load balance of the workers)
+                 'worker'(ints): the pids of the worker processes which fitted the points
+              The map_baseline and map_bline dictionaries are filled with the views of the arrays of the best fits,
+              baselines and components (see map_intensity). The workers return the compact float records only, so there
+              is no manager process and the records are assembled in the preallocated arrays. The spectra are sent to
+              the worker processes in the shared memory (sharedcube.MapCube), the tasks contain the numbers of the
+              points only.
 
         """
-        manager = Manager()
-        self.map_baseline = manager.dict()
-        self.map_bline = manager.dict()
         global counter
         counter = Value('i', 0)
-        pool = Pool(processes=num_proc, initializer=self.__init_C__, initargs=(counter,))
+        workers = num_proc if workers is None else max(1, int(workers))
         self.param = params
         self.limit = limits
+        # the results of the previous map are not sent to the workers
+        self.map_baseline = {}
+        self.map_bline = {}
+        self.map_curves = None
         print(colored('Peak fitting:', 'cyan'))
         self.leng = len(map_spectra)
         self.__pBar__.printProgressBar(0, self.leng, prefix='Progress:', suffix='', length=50)
         x = np.array([item[1] for item in map_spectra.values()])
         y = np.array([item[2] for item in map_spectra.values()])
-        dd = map_spectra
-        cs = int(len(dd) / num_proc)
-        z = pool.map_async(self.map_intensity, dd.values(), chunksize=cs)
-
-        z.wait()
-        z1 = z.get()
-        pool.close()
-        return x, y, z1
-    
-    def __find_nearest_(self, array, value):
-        array = np.asarray(array)
-        idx = (np.abs(array - value)).argmin()
-        return idx
-    
+        items = list(map_spectra.values())
+        baselines = None
+        if 'baseline' in params and 'baseline_auto' not in params:
+            baselines = self.__map_baselines__(items, params)
+        if schedule == 'wavefront':
+            tasks = [[(num, neighbours) for num, neighbours in order]
+                     for order in self.__wavefronts__(x, y, max(1, int(tile)))]
+            # the largest tiles first: the small ones fill the idle workers at the end
+            tasks.sort(key=len, reverse=True)
+            function = self.__map_tile__
+            chunksize = 1 if chunksize is None else chunksize
+        elif schedule == 'independent':
+            tasks = range(len(items))
+            function = self.__map_task__
+        else:
+            raise ValueError(f'Unknown schedule {schedule}. Available schedules: independent, wavefront')
+        if chunksize is None:
+            # small chunks are scheduled dynamically: the slow points do not leave the other workers idle at the end
+            chunksize = max(1, min(16, len(items) // (8 * workers)))
+        records = [None] * len(items)
+        timing = np.zeros(len(items))
+        pids = np.zeros(len(items), dtype=np.int64)
+        pool = None
+        cube = None
+        if workers == 1:
+            self.__init_C__(counter, self, items if baselines is None else
+                            [list(item[:8]) + [b_line] for item, b_line in zip(items, baselines)])
+            results = map(function, tasks)
+        else:
+            # the spectra are copied once into the shared memory, the workers attach to it by name
+            cube = sc.MapCube(items, baselines)
+            pool = Pool(processes=workers, initializer=self.__init_C__, initargs=(counter, self, cube))
+            results = pool.imap_unordered(function, tasks, chunksize)
+        if schedule == 'wavefront':
+            results = itertools.chain.from_iterable(results)
+        try:
+            for num, record, elapsed, pid in results:
+                records[num] = record
+                timing[num] = elapsed
+                pids[num] = pid
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if cube is not None:
+                cube.close()
+            self.__init_C__(counter)
+        return x, y, self.__collect__(items, records, params, {'time': timing, 'worker': pids})
+
+    def __collect__(self, items, records, params, planes=None):
+        """
+        The private method assembles the records of map_intensity into mapresult.MapResult. The best fits, the
+        baselines and the components are stored in one (n_points, n_curves, length) array padded by NaN (the spectra of
+        the map may have different lengths), map_baseline and map_bline refer to its rows. The planes {name: values of
+        the points} (e.g. the fit times) are added to the planes of the result.
+        Returns:
+            z1(object): see find_intensity
+        """
+        number_of_peaks = 0 if params['method'][0] == 'als' else len(params['center'])
+        n = len(records)
+        z1 = mr.MapResult([item[1] for item in items], [item[2] for item in items], number_of_peaks, RECORD_PEAKS)
+        length = max((len(curves[0]) for values, curves in records), default=0)
+        self.map_curves = np.full((n, number_of_peaks + 2, length), np.nan)
+        self.map_baseline = {}
+        self.map_bline = {}
+        for row, (item, (values, curves)) in enumerate(zip(items, records)):
+            head = dict(zip(RECORD_VALUES, values))
+            head.update({name: plane[row] for name, plane in (planes or {}).items()})
+            table = values[len(RECORD_VALUES):].reshape(len(RECORD_PEAKS), number_of_peaks)
+            z1.set_point(row, table, head)
+            size = curves.shape[1]
+            self.map_curves[row, :, :size] = curves
+            view = self.map_curves[row, :, :size]
+            xmin, xmax = params['range'] if 'range' in params else [item[5], item[6]]
+            comps = {'f' + repr(num) + '_': view[num + 2] for num in range(number_of_peaks)}
+            if 'baseline_auto' in params:
+                comps['bg_'] = view[1]
+            name = str(item[1]) + '_' + str(item[2])
+            self.map_baseline[name] = [view[0], item[1], item[2], size, size, xmin, xmax, item[7], comps]
+            self.map_bline[name] = [np.linspace(xmin, xmax, size), view[1], head['lam'], head['p']]
+        return z1
+
     @staticmethod
     def peakdet(y_axis, lookahead=3, delta=0.02):
         """
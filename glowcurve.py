@@ -0,0 +1,222 @@
+"""
+The module glowcurve for web-app ArDi (ArDI (Advanced spectRa Deconvolution Instrument)) contains the vectorized numpy
+kernels of the thermoluminescence (TSL) glow curves and the thermally stimulated decay (TD) curves and the lmfit model
+of the sum of glow peaks evaluated at once over (n_peaks, n_points) grid. The kernels are the same as TSLCalc, TDCalc and
+TSLCalcR of the native library (nativelib): the temperature grid T_i = Tmin + i*(Tmax - Tmin)/n, the integral of the
+Arrhenius factor exp(-E/kT) by the quadrature of TSLCalc/TDCalc or by the rectangles of TSLCalcR, and the kinetics of
+any order b (May-Partridge general-order kinetics):
+    TD(T) = (1 + (b - 1)*s*I(T))^(-b/(b - 1)), TD(T) = exp(-s*I(T)) for b = 1
+    TSL(T) = exp(-E/kT)*TD(T)
+where s is the frequency factor and I(T) is the integral of exp(-E/kT') from Tmin to T. The curves of the orders 1 and 2
+coincide with the native ones up to the rounding errors.
+
+"""
+__author__ = "Roman Shendrik"
+__copyright__ = "Copyright © 2023R"
+__license__ = "GNU GPL 3.0"
+__version__ = "0.4.0"
+
+import inspect
+import numpy as np
+from lmfit.model import Model
+
+# The Boltzmann constants (eV/K) of the native routines (TSLCalc, TDCalc and TSLCalcR)
+BOLTZMANN = {'tsl': 8.617333262e-5, 'td': 8.617333e-5, 'rectangle': 8.61733e-5}
+tiny = 1.0e-15
+# relative step of forward difference (the same as in multipeak)
+EPS = np.finfo(np.float64).eps ** 0.5
+
+# The glow peaks of the model: {method: (kinetic order or None for the fitted f_order parameter, decay curve)}
+GLOWS = {
+    'TSL1': (1, False),
+    'TSL2': (2, False),
+    'TSLGO': (None, False),
+    'TD1': (1, True),
+    'TD2': (2, True),
+    'TDGO': (None, True),
+}
+
+
+def temperatures(n, t_min, t_max):
+    """
+    Return the temperature grid of the native library: n points from t_min with the step (t_max - t_min)/n (t_max is
+    not included)
+    """
+    return t_min + np.arange(n) * ((t_max - t_min) / n)
+
+
+def __weights__(n, quadrature):
+    """
+    Return the weights of the cumulative integral over the grid with the unit step
+    """
+    if quadrature == 'rectangle':
+        return np.ones(n)
+    if quadrature != 'native':
+        raise ValueError(f'Unknown quadrature {quadrature}. Available quadratures: native, rectangle')
+    # the weights of TSLCalc and TDCalc
+    weights = np.where(np.arange(n) % 2 == 1, 26.0, 31.0)
+    weights[0] = 11.0
+    return weights * (4.0 / 105.0)
+
+
+def __column__(value):
+    return np.asarray(value, dtype=np.float64).reshape(-1, 1)
+
+
+def kinetics(integral, factor, order):
+    """
+    Return the general-order population (1 + (b - 1)*s*I)^(-b/(b - 1)) with the limit exp(-s*I) at b = 1.
+    The expression exp(-b*log1p((b - 1)*s*I)/(b - 1)) is continuous in b around 1
+    Args:
+        integral(floats): (n_peaks, n_points) array of the integrals I
+        factor, order(floats): (n_peaks, 1) arrays of the frequency factors s and the kinetic orders b
+    """
+    rate = factor * integral
+    excess = order - 1.0
+    first = np.abs(excess) < 1e-12
+    safe = np.where(first, 1.0, excess)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # the population is zero when 1 + (b - 1)*s*I reaches zero (b < 1)
+        scaled = np.log1p(np.maximum(safe * rate, -1.0)) / safe
+    return np.exp(-order * np.where(first, rate, scaled))
+
+
+def glow(n, t_min, t_max, factor, energy, order, decay=False, quadrature='native'):
+    """
+    Return (n_peaks, n) array of the not normalized TSL or TD curves of all peaks
+    Args:
+        n(int): number of points
+        t_min, t_max(double): temperature range (see temperatures)
+        factor, energy, order(floats): 1d arrays (or scalars) of the frequency factors, activation energies (eV) and
+            kinetic orders of the peaks
+        decay(bool): TD curves instead of TSL
+        quadrature(str): 'native' (the integral of TSLCalc and TDCalc) or 'rectangle' (TSLCalcR)
+    """
+    energy = __column__(energy)
+    factor, order = np.broadcast_arrays(__column__(factor), __column__(order), energy)[:2]
+    boltzmann = BOLTZMANN['rectangle' if quadrature == 'rectangle' else 'td' if decay else 'tsl']
+    arrhenius = np.exp(-energy / (boltzmann * temperatures(n, t_min, t_max)))
+    integral = np.cumsum(arrhenius * __weights__(n, quadrature), axis=1) * ((t_max - t_min) / n)
+    out = kinetics(integral, factor, order)
+    return out if decay else arrhenius * out
+
+
+def glow_peaks(x, amplitude, factor, energy, order, decay=False, quadrature='native'):
+    """
+    Return (n_peaks, len(x)) array of the glow peaks normalized to the amplitudes (the maximum of the peak is equal to
+    the amplitude). The grid of the curves is the native grid of len(x) points from x.min() to x.max() (see
+    temperatures). The arguments are the same as in glow
+    """
+    x = np.asarray(x, dtype=np.float64)
+    out = glow(len(x), x.min(), x.max(), factor, energy, order, decay, quadrature)
+    return out * (__column__(amplitude) / np.maximum(tiny, out.max(axis=1, keepdims=True)))
+
+
+class GlowModel(Model):
+    """
+    Sum of the glow peaks of GLOWS methods evaluated at once. The parameters of the peak num are f{num}_amplitude,
+    f{num}_factor, f{num}_energy (and f{num}_order of the general-order peaks), the components are f0_, f1_, ... as in
+    the sum of the single peak models of fittingmap.FittingMap.
+    Attributes:
+        methods(dict): {num: method} the number of peak (prefix 'f' + repr(num) + '_') and the name of glow peak
+        quadrature(str): see glow
+    """
+
+    def __init__(self, methods, quadrature='native', **kws):
+        self.methods = dict(methods)
+        self.quadrature = quadrature
+        self.__nums__ = sorted(self.methods)
+        names = []
+        for num in self.__nums__:
+            if self.methods[num] not in GLOWS:
+                raise ValueError(f'The method {self.methods[num]} is not supported by GlowModel')
+            pref = 'f' + repr(num) + '_'
+            names += [pref + 'amplitude', pref + 'factor', pref + 'energy']
+            if GLOWS[self.methods[num]][0] is None:
+                names.append(pref + 'order')
+        super().__init__(self.__function__(names), independent_vars=['x'], param_names=names, **kws)
+
+    def __function__(self, names):
+        """
+        Return the model function with the explicit signature (x, f0_amplitude, f0_factor, ...)
+        """
+        def glowpeaks(x, **params):
+            return self.__curves__(x, params).sum(axis=0)
+        kind = inspect.Parameter.POSITIONAL_OR_KEYWORD
+        glowpeaks.__signature__ = inspect.Signature([inspect.Parameter(name, kind) for name in ['x'] + names])
+        return glowpeaks
+
+    def __arrays__(self, params):
+        """
+        Return the arrays (amplitude, factor, energy, order) of the peaks in the order of self.__nums__
+        """
+        out = [np.array([params['f' + repr(num) + '_' + key] for num in self.__nums__])
+               for key in ('amplitude', 'factor', 'energy')]
+        order = [GLOWS[self.methods[num]][0] for num in self.__nums__]
+        out.append(np.array([params['f' + repr(num) + '_order'] if value is None else value
+                             for num, value in zip(self.__nums__, order)], dtype=np.float64))
+        return out
+
+    def __curves__(self, x, params, unit=False):
+        """
+        Return (n_peaks, n_points) array of the peaks. The TSL and TD peaks are evaluated by two calls of glow_peaks
+        """
+        amplitude, factor, energy, order = self.__arrays__(params)
+        if unit:
+            amplitude = np.ones(len(amplitude))
+        decay = np.array([GLOWS[self.methods[num]][1] for num in self.__nums__], dtype=bool)
+        out = np.empty((len(self.__nums__), len(x)))
+        for flag in (False, True):
+            mask = decay == flag
+            if mask.any():
+                out[mask] = glow_peaks(x, amplitude[mask], factor[mask], energy[mask], order[mask], flag,
+                                       self.quadrature)
+        return out
+
+    def peaks(self, x, **params):
+        """
+        Return {num: y} the dictionary of the single peaks
+        """
+        return dict(zip(self.__nums__, self.__curves__(np.asarray(x, dtype=np.float64), params)))
+
+    def unit_peaks(self, x, **params):
+        """
+        Return {num: y} the dictionary of the single peaks with unit amplitude
+        """
+        return dict(zip(self.__nums__, self.__curves__(np.asarray(x, dtype=np.float64), params, unit=True)))
+
+    def eval_components(self, params=None, **kwargs):
+        """
+        Evaluate each peak of the model. The keys are the prefixes of the peaks f0_, f1_, ...
+        """
+        peaks = self.peaks(**self.make_funcargs(params, kwargs))
+        return {'f' + repr(num) + '_': peaks[num] for num in self.__nums__}
+
+    def derivatives(self, x, **params):
+        """
+        Return {name: column} the derivatives of the model by the amplitudes (the unit peaks) and by the frequency
+        factors, energies and orders (forward differences of all peaks at once). The function is used by
+        jacobian.ModelJacobian
+        """
+        x = np.asarray(x, dtype=np.float64)
+        base = self.__curves__(x, params, unit=True)
+        amplitude = self.__arrays__(params)[0].reshape(-1, 1)
+        out = {'f' + repr(num) + '_amplitude': column for num, column in zip(self.__nums__, base)}
+        base = base * amplitude
+        for key in ('factor', 'energy', 'order'):
+            names = ['f' + repr(num) + '_' + key for num in self.__nums__]
+            nums = [num for num, name in zip(self.__nums__, names) if name in params]
+            if not nums:
+                continue
+            shifted = dict(params)
+            steps = {}
+            for num in nums:
+                name = 'f' + repr(num) + '_' + key
+                steps[name] = EPS * max(1.0, abs(params[name]))
+                shifted[name] = params[name] + steps[name]
+            curves = self.__curves__(x, shifted)
+            for index, num in enumerate(self.__nums__):
+                name = 'f' + repr(num) + '_' + key
+                if name in steps:
+                    out[name] = (curves[index] - base[index]) / steps[name]
+        return out
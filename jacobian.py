@@ -0,0 +1,253 @@
+"""
+The module jacobian for web-app ArDi (ArDI (Advanced spectRa Deconvolution Instrument)) assembles the Jacobian of the
+composite lmfit model for the least_squares fits of FittingMap.
+The columns of the components having own derivatives (e.g. bg_ ALS baseline) are calculated by these derivatives. The
+columns of the other parameters are calculated by finite differences of the single component depending on the
+parameter, not of the whole sum of the model. The sparsity structure of the peak parameters is given by peak_sparsity for
+the finite-difference schemes.
+
+"""
+__author__ = "Roman Shendrik"
+__copyright__ = "Copyright © 2023R"
+__license__ = "GNU GPL 3.0"
+__version__ = "0.4.0"
+
+import operator
+import re
+import numpy as np
+from scipy import sparse
+
+# relative step of forward difference (the same as '2-point' scheme of scipy.optimize.least_squares)
+EPS = np.finfo(np.float64).eps ** 0.5
+
+
+def is_additive(model):
+    """
+    Return True if the model is a single lmfit Model or a sum of models (the Jacobian of the sum is the sum of the
+    component Jacobians)
+    """
+    if not hasattr(model, 'left'):
+        return True
+    return model.op is operator.add and is_additive(model.left) and is_additive(model.right)
+
+
+def peak_sparsity(params, x, window):
+    """
+    Return the sparsity structure of the Jacobian for the finite-difference schemes (see SparseDifference).
+    The parameters of the peak with the prefix pref (pref + 'center' and pref + 'sigma' parameters are present) change
+    the model within center +/- window*sigma only, where center and sigma are the current values of the parameters. The
+    columns of the other parameters (e.g. bg_ baseline) are dense.
+    Args:
+        params(object): lmfit Parameters of the fit
+        x(floats): x-values of the spectrum
+        window(double): half width of the peak support in units of sigma
+    Returns:
+        structure(object): scipy.sparse.csc_matrix (n_points, n_varys) of ones, the columns are in the order of the
+            varied parameters of lmfit (the same as jac_sparsity of least_squares)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    var_names = [name for name, par in params.items() if par.vary and par.expr is None]
+    rows, cols = [], []
+    for num, name in enumerate(var_names):
+        pref = name[:name.rfind('_') + 1]
+        if pref + 'center' in params and pref + 'sigma' in params:
+            half = window * abs(params[pref + 'sigma'].value)
+            row = np.flatnonzero(np.abs(x - params[pref + 'center'].value) <= half)
+        else:
+            row = np.arange(len(x))
+        rows.append(row)
+        cols.append(np.full(len(row), num))
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=int)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=int)
+    return sparse.csc_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(x), len(var_names)))
+
+
+class ModelJacobian(object):
+    """
+    Jacobian of the residual (data - model)*weights of the additive composite lmfit model.
+    The instance is passed to lmfit as fit_kws['jac'] and called as jac(params, data, weights, **independent_vars).
+    Attributes:
+        model(object): lmfit Model or CompositeModel
+        derivatives(dict): {prefix: function} the functions of the components with own derivatives. The function is
+            called with the arguments of the component function and returns dictionary {param_name: column} of the
+            derivatives by the parameters of the component (the names without prefix). The parameters absent in the
+            dictionary are differentiated numerically. The key may be the component itself instead of the prefix (the
+            components without prefix, e.g. multipeak.MultiPeakModel and glowcurve.GlowModel in the same model)
+    """
+
+    def __init__(self, model, derivatives=None):
+        if not is_additive(model):
+            raise ValueError('The Jacobian is assembled for the sum of models only')
+        self.model = model
+        self.derivatives = derivatives if derivatives is not None else {}
+        self.__deps__ = {}
+
+    def __dependencies__(self, params, var_names):
+        """
+        Return the dictionary {var_name: (components, constrained)} of the components depending on the varied parameter
+        directly or through the constraint expressions. The constrained is True if the parameter changes the arguments
+        of the component functions through the constraint expressions, so the update of constraints is required after
+        the parameter change
+        """
+        key = tuple(var_names)
+        if key in self.__deps__:
+            return self.__deps__[key]
+        # the parameters whose values are changed by the change of the parameter
+        depends = {name: {name} for name in params}
+        for name, par in params.items():
+            if par.expr is not None:
+                for word in re.findall(r'[A-Za-z_]\w*', par.expr):
+                    if word in depends:
+                        depends[word].add(name)
+        for word in depends:
+            # transitive closure of the constraint expressions
+            stack = list(depends[word])
+            while stack:
+                for name in depends.get(stack.pop(), ()):
+                    if name not in depends[word]:
+                        depends[word].add(name)
+                        stack.append(name)
+        # the parameters passed to the component functions (e.g. f0_gamma of Voigt model is the argument of the function,
+        # but f0_fwhm and f0_height are not)
+        arguments = {comp: {comp.prefix + arg for arg in comp._func_allargs} for comp in self.model.components}
+        deps = {}
+        for name in var_names:
+            comps = [comp for comp in self.model.components if depends[name] & arguments[comp]]
+            constrained = any((depends[name] - {name}) & args for args in arguments.values())
+            deps[name] = (comps, constrained)
+        self.__deps__[key] = deps
+        return deps
+
+    def __call__(self, params, data=None, weights=None, **kwargs):
+        var_names = [name for name, par in params.items() if par.vary and par.expr is None]
+        deps = self.__dependencies__(params, var_names)
+        jac = np.zeros((len(data), len(var_names)))
+        analytic = {}
+        base = {}
+        for num, name in enumerate(var_names):
+            comps, constrained = deps[name]
+            fd_comps = []
+            for comp in comps:
+                key = comp if comp in self.derivatives else comp.prefix
+                if key in self.derivatives and name.startswith(comp.prefix) and not constrained:
+                    if comp not in analytic:
+                        analytic[comp] = self.derivatives[key](**comp.make_funcargs(params, kwargs))
+                    column = analytic[comp].get(name[len(comp.prefix):])
+                    if column is not None:
+                        jac[:, num] += column
+                        continue
+                if comp not in base:
+                    base[comp] = comp.eval(params=params, **kwargs)
+                fd_comps.append(comp)
+            if not fd_comps:
+                continue
+            par = params[name]
+            value = par.value
+            step = EPS * max(1.0, abs(value))
+            if value + step > par.max:
+                step = -step
+            par.value = value + step
+            if constrained:
+                params.update_constraints()
+            step = par.value - value
+            if step != 0:
+                for comp in fd_comps:
+                    jac[:, num] += (comp.eval(params=params, **kwargs) - base[comp]) / step
+            par.value = value
+            if constrained:
+                params.update_constraints()
+        # residual is (data - model)*weights
+        jac = -jac
+        if weights is not None:
+            jac *= np.asarray(weights).reshape(-1, 1)
+        return jac
+
+
+def group_columns(structure):
+    """
+    Return the list of the groups of the columns of the sparsity structure. The columns of the group have no common
+    rows, so they are differentiated by one evaluation of the model (greedy grouping in the order of the columns)
+    Args:
+        structure(object): scipy.sparse matrix (n_points, n_varys)
+    Returns:
+        groups(list): the lists of the column numbers
+    """
+    structure = sparse.csc_matrix(structure)
+    groups = []
+    occupied = []
+    for col in range(structure.shape[1]):
+        rows = structure.indices[structure.indptr[col]:structure.indptr[col + 1]]
+        for group, mask in zip(groups, occupied):
+            if not mask[rows].any():
+                group.append(col)
+                mask[rows] = True
+                break
+        else:
+            mask = np.zeros(structure.shape[0], dtype=bool)
+            mask[rows] = True
+            groups.append([col])
+            occupied.append(mask)
+    return groups
+
+
+class SparseDifference(object):
+    """
+    Finite-difference Jacobian of the residual (data - model)*weights with the sparsity structure of the peaks (see
+    peak_sparsity). The varied parameters of the peaks with disjoint supports are shifted together, so the Jacobian
+    costs one evaluation of the model per group of columns ('2-point') or two evaluations ('3-point') instead of one
+    (two) per parameter. This is jac_sparsity of least_squares: lmfit can not estimate the covariance from the sparse
+    Jacobian returned by least_squares, so the grouped differences are calculated here and passed to lmfit as the
+    dense Jacobian.
+    Attributes:
+        model(object): lmfit Model or CompositeModel
+        window(double): half width of the peak support in units of sigma
+        scheme(str): '2-point' (forward differences) or '3-point' (central differences)
+    """
+
+    def __init__(self, model, window, scheme='2-point'):
+        if scheme not in ('2-point', '3-point'):
+            raise ValueError(f'Unknown finite-difference scheme {scheme}')
+        self.model = model
+        self.window = window
+        self.scheme = scheme
+
+    @staticmethod
+    def __set__(params, names, values):
+        """
+        Set the values of the parameters and return the values after the clipping by the bounds
+        """
+        for name, value in zip(names, values):
+            params[name].value = value
+        params.update_constraints()
+        return np.array([params[name].value for name in names])
+
+    def __call__(self, params, data=None, weights=None, **kwargs):
+        var_names = [name for name, par in params.items() if par.vary and par.expr is None]
+        structure = peak_sparsity(params, kwargs['x'], self.window)
+        values = np.array([params[name].value for name in var_names])
+        power = 1 / 2 if self.scheme == '2-point' else 1 / 3
+        steps = np.finfo(np.float64).eps ** power * np.maximum(1.0, np.abs(values))
+        upper = np.array([params[name].max for name in var_names])
+        steps = np.where(values + steps > upper, -steps, steps)
+        base = self.model.eval(params=params, **kwargs)
+        jac = np.zeros((len(data), len(var_names)))
+        for group in group_columns(structure):
+            names = [var_names[col] for col in group]
+            high = self.__set__(params, names, values[group] + steps[group])
+            diff = self.model.eval(params=params, **kwargs)
+            if self.scheme == '3-point':
+                low = self.__set__(params, names, values[group] - steps[group])
+                diff = diff - self.model.eval(params=params, **kwargs)
+            else:
+                low = values[group]
+                diff = diff - base
+            self.__set__(params, names, values[group])
+            for col, step in zip(group, high - low):
+                if step != 0:
+                    rows = structure.indices[structure.indptr[col]:structure.indptr[col + 1]]
+                    jac[rows, col] = diff[rows] / step
+        # residual is (data - model)*weights
+        jac = -jac
+        if weights is not None:
+            jac *= np.asarray(weights).reshape(-1, 1)
+        return jac
@@ -0,0 +1,199 @@
+"""
+The module lineshapes for web-app ArDi (ArDI (Advanced spectRa Deconvolution Instrument)) contains the peak functions
+evaluated for many peaks at once. The parameters are 1d arrays of length n_peaks, the result is (n_peaks, n_points)
+array. The functions are the same as Gaussian, Lorentzian, Voigt and pvoigt functions of lmfit.lineshapes.
+The Voigt profile is also given by two approximations without the Faddeeva function of scipy (wofz):
+    voigt_humlicek: the rational approximation W4 of the Faddeeva function (J. Humlicek, JQSRT 27, 437 (1982)). The
+        relative error of the profile is below 1e-4, the error is below 4e-6 of the peak height (gamma=sigma).
+    voigt_tch: the pseudo-Voigt of Thompson, Cox and Hastings (J. Appl. Cryst. 20, 79 (1987)) with the width and the
+        Lorentzian fraction of the Voigt profile. The error is below 1.3e-2 of the peak height (gamma=sigma).
+
+"""
+__author__ = "Roman Shendrik"
+__copyright__ = "Copyright © 2023R"
+__license__ = "GNU GPL 3.0"
+__version__ = "0.4.0"
+
+import numpy as np
+from scipy.special import wofz
+
+tiny = 1.0e-15
+s2pi = np.sqrt(2 * np.pi)
+s2 = np.sqrt(2.0)
+log2 = np.log(2)
+
+
+def __column__(*args):
+    """
+    Return the parameter arrays as (n_peaks, 1) columns for the broadcasting with x
+    """
+    return [np.asarray(arg, dtype=np.float64).reshape(-1, 1) for arg in args]
+
+
+def gaussian(x, amplitude, center, sigma):
+    """Gaussian peaks: amplitude/(s2pi*sigma) * exp(-(x-center)**2 / (2*sigma**2))
+    """
+    amplitude, center, sigma = __column__(amplitude, center, sigma)
+    return amplitude / np.maximum(tiny, s2pi * sigma) * np.exp(-(x - center) ** 2 / np.maximum(tiny, 2 * sigma ** 2))
+
+
+def lorentzian(x, amplitude, center, sigma):
+    """Lorentzian peaks: amplitude/(1 + ((x-center)/sigma)**2) / (pi*sigma)
+    """
+    amplitude, center, sigma = __column__(amplitude, center, sigma)
+    return amplitude / (1 + ((x - center) / np.maximum(tiny, sigma)) ** 2) / np.maximum(tiny, np.pi * sigma)
+
+
+def voigt(x, amplitude, center, sigma, gamma=None):
+    """Voigt peaks: amplitude*real(wofz(z)) / (sigma*s2pi), z = (x-center + 1j*gamma) / (sigma*s2). By default gamma=sigma
+    """
+    if gamma is None:
+        gamma = sigma
+    amplitude, center, sigma, gamma = __column__(amplitude, center, sigma, gamma)
+    z = (x - center + 1j * gamma) / np.maximum(tiny, sigma * s2)
+    return amplitude * wofz(z).real / np.maximum(tiny, sigma * s2pi)
+
+
+def humlicek(z):
+    """Faddeeva function w(z) for Im(z) >= 0 by the W4 approximation of Humlicek (relative error below 1e-4).
+    The points with |Re(z)| + Im(z) >= 15 (the far wings of the peaks) are calculated by the first region formula, the
+    other regions are calculated for the remaining points only
+    """
+    shape = np.shape(z)
+    z = np.asarray(z, dtype=np.complex128).reshape(-1)
+    t = z.imag - 1j * z.real
+    w = t * 0.5641896 / (0.5 + t * t)
+    s = np.abs(z.real) + z.imag
+    near = np.flatnonzero(s < 15)
+    if near.size:
+        t, x, y, s = t[near], np.abs(z.real[near]), z.imag[near], s[near]
+        out = np.empty(near.size, dtype=np.complex128)
+        region = s >= 5.5
+        tt = t[region]
+        u = tt * tt
+        out[region] = tt * (1.410474 + u * 0.5641896) / (0.75 + u * (3 + u))
+        inner = ~region & (y >= 0.195 * x - 0.176)
+        tt = t[inner]
+        out[inner] = ((16.4955 + tt * (20.20933 + tt * (11.96482 + tt * (3.778987 + tt * 0.5642236)))) /
+                      (16.4955 + tt * (38.82363 + tt * (39.27121 + tt * (21.69274 + tt * (6.699398 + tt))))))
+        region = ~(region | inner)
+        tt = t[region]
+        u = tt * tt
+        out[region] = np.exp(u) - tt * (36183.31 - u * (3321.9905 - u * (1540.787 - u * (219.0313 - u * (
+            35.76683 - u * (1.320522 - u * 0.56419)))))) / (32066.6 - u * (24322.84 - u * (9022.228 - u * (
+                2186.181 - u * (364.2191 - u * (61.57037 - u * (1.841439 - u)))))))
+        w[near] = out
+    return w.reshape(shape)
+
+
+def voigt_humlicek(x, amplitude, center, sigma, gamma=None):
+    """Voigt peaks with the Faddeeva function of humlicek. By default gamma=sigma
+    """
+    if gamma is None:
+        gamma = sigma
+    amplitude, center, sigma, gamma = __column__(amplitude, center, sigma, gamma)
+    z = (x - center + 1j * gamma) / np.maximum(tiny, sigma * s2)
+    return amplitude * humlicek(z).real / np.maximum(tiny, sigma * s2pi)
+
+
+def tch(sigma, gamma):
+    """Return the FWHM and the Lorentzian fraction of the pseudo-Voigt of Thompson, Cox and Hastings approximating
+    the Voigt profile with the Gaussian sigma and the Lorentzian half width gamma
+    """
+    f_g = 2 * np.sqrt(2 * log2) * np.abs(sigma)
+    f_l = 2 * np.abs(gamma)
+    fwhm = (f_g ** 5 + 2.69269 * f_g ** 4 * f_l + 2.42843 * f_g ** 3 * f_l ** 2 + 4.47163 * f_g ** 2 * f_l ** 3 +
+            0.07842 * f_g * f_l ** 4 + f_l ** 5) ** 0.2
+    ratio = f_l / np.maximum(tiny, fwhm)
+    return fwhm, 1.36603 * ratio - 0.47719 * ratio ** 2 + 0.11116 * ratio ** 3
+
+
+# FWHM/sigma and Lorentzian fraction of the TCH pseudo-Voigt of the Voigt profile with gamma=sigma
+tch_width, tch_fraction = tch(1.0, 1.0)
+
+
+def voigt_tch(x, amplitude, center, sigma, gamma=None):
+    """Voigt peaks by the pseudo-Voigt of Thompson, Cox and Hastings: pvoigt with the half width fwhm/2 and the fraction
+    of tch. By default gamma=sigma
+    """
+    if gamma is None:
+        gamma = sigma
+    amplitude, center, sigma, gamma = __column__(amplitude, center, sigma, gamma)
+    fwhm, fraction = tch(sigma, gamma)
+    return pvoigt(x, amplitude, center, fwhm / 2, fraction)
+
+
+def pvoigt(x, amplitude, center, sigma, fraction):
+    """Pseudo-Voigt peaks: (1-fraction)*gaussian(sigma_g) + fraction*lorentzian(sigma), sigma_g = sigma/sqrt(2*log2)
+    """
+    amplitude, center, sigma, fraction = __column__(amplitude, center, sigma, fraction)
+    return ((1 - fraction) * gaussian(x, amplitude, center, sigma / np.sqrt(2 * log2)) +
+            fraction * lorentzian(x, amplitude, center, sigma))
+
+
+def gaussian_jac(x, amplitude, center, sigma):
+    """Derivatives of gaussian by amplitude, center and sigma. Returns the list of (n_peaks, n_points) arrays
+    """
+    amplitude, center, sigma = __column__(amplitude, center, sigma)
+    sigma = np.maximum(tiny, sigma)
+    u = (x - center) / sigma
+    unit = np.exp(-u ** 2 / 2) / (s2pi * sigma)
+    g = amplitude * unit
+    return [unit, g * u / sigma, g * (u ** 2 - 1) / sigma]
+
+
+def lorentzian_jac(x, amplitude, center, sigma):
+    """Derivatives of lorentzian by amplitude, center and sigma. Returns the list of (n_peaks, n_points) arrays
+    """
+    amplitude, center, sigma = __column__(amplitude, center, sigma)
+    sigma = np.maximum(tiny, sigma)
+    u = (x - center) / sigma
+    q = 1 / (1 + u ** 2)
+    unit = q / (np.pi * sigma)
+    lor = amplitude * unit
+    return [unit, lor * 2 * u * q / sigma, lor * (u ** 2 - 1) * q / sigma]
+
+
+def voigt_jac(x, amplitude, center, sigma, faddeeva=wofz):
+    """Derivatives of voigt with gamma=sigma by amplitude, center and sigma. The derivative of Faddeeva function is
+    w'(z) = -2*z*w(z) + 2i/sqrt(pi). Returns the list of (n_peaks, n_points) arrays
+    """
+    amplitude, center, sigma = __column__(amplitude, center, sigma)
+    sigma = np.maximum(tiny, sigma)
+    z = (x - center + 1j * sigma) / (sigma * s2)
+    w = faddeeva(z)
+    dw = -2 * z * w + 2j / np.sqrt(np.pi)
+    norm = 1 / (sigma * s2pi)
+    unit = w.real * norm
+    d_center = -amplitude * norm * dw.real / (sigma * s2)
+    d_sigma = -amplitude * unit / sigma - amplitude * norm * (dw * (x - center)).real / (sigma ** 2 * s2)
+    return [unit, d_center, d_sigma]
+
+
+def pvoigt_jac(x, amplitude, center, sigma, fraction):
+    """Derivatives of pvoigt by amplitude, center, sigma and fraction. Returns the list of (n_peaks, n_points) arrays
+    """
+    amplitude, center, sigma, fraction = __column__(amplitude, center, sigma, fraction)
+    scale = 1 / np.sqrt(2 * log2)
+    g_a, g_c, g_s = gaussian_jac(x, amplitude, center, sigma * scale)
+    l_a, l_c, l_s = lorentzian_jac(x, amplitude, center, sigma)
+    return [(1 - fraction) * g_a + fraction * l_a,
+            (1 - fraction) * g_c + fraction * l_c,
+            (1 - fraction) * g_s * scale + fraction * l_s,
+            amplitude * (l_a - g_a)]
+
+
+def voigt_humlicek_jac(x, amplitude, center, sigma):
+    """Derivatives of voigt_humlicek with gamma=sigma by amplitude, center and sigma. Returns the list of
+    (n_peaks, n_points) arrays
+    """
+    return voigt_jac(x, amplitude, center, sigma, humlicek)
+
+
+def voigt_tch_jac(x, amplitude, center, sigma):
+    """Derivatives of voigt_tch with gamma=sigma by amplitude, center and sigma. The width of the pseudo-Voigt is
+    tch_width*sigma and the fraction is constant. Returns the list of (n_peaks, n_points) arrays
+    """
+    amplitude, center, sigma = __column__(amplitude, center, sigma)
+    d_amplitude, d_center, d_sigma, _ = pvoigt_jac(x, amplitude, center, sigma * tch_width / 2, tch_fraction)
+    return [d_amplitude, d_center, d_sigma * tch_width / 2]
@@ -0,0 +1,152 @@
+"""
+The module mapresult for web-app ArDi (ArDI (Advanced spectRa Deconvolution Instrument)) contains the container of the
+results of the peak fitting of the hyperspectral map (FittingMap.find_intensity). The fitted values of the peaks are kept
+in one contiguous array (ny, nx, n_peaks, n_params) and the values of the points (R-square, number of the evaluations,
+status of the fit, baseline parameters) in (ny, nx) planes, so the images of the peak parameters are the views of the
+array and the post-processing of the map is vectorized. The results are saved to and loaded from .npz or HDF5 files.
+
+"""
+__author__ = "Roman Shendrik"
+__copyright__ = "Copyright © 2023R"
+__license__ = "GNU GPL 3.0"
+__version__ = "0.4.0"
+
+import h5py
+import numpy as np
+
+# The fitted values of each peak
+PARAMS = ('amplitude', 'FWHM', 'center', 'height', 'sigma')
+# The planes of the values of the points and their types: the fit time in seconds and the pid of the worker process
+# show the load balance of the map fitting
+PLANES = {'r-square': np.float64, 'lam': np.float64, 'p': np.float64, 'nfev': np.int32, 'status': np.int8,
+          'time': np.float64, 'worker': np.int64}
+# The codes of the status plane: the point is not fitted, the fit is completed, the fit is stopped by the budget or by
+# the cancellation (see 'stopped' of FittingMap.fit_array)
+STATUS = {None: 1, 'budget': 2, 'cancel': 3}
+NOT_FITTED = 0
+
+
+class MapResult(object):
+    """
+    The results of the peak fitting of the hyperspectral map. The points of the map are placed on the (ny, nx) grid by
+    their coordinates mx, my (the image row is my - my.min(), the column is mx - mx.min()), the grid cells without
+    points are NaN (status NOT_FITTED).
+    Attributes:
+        mx, my(ints): the coordinates of the points in the order of the map spectra
+        names(tuple): the names of the fitted values of the peaks (PARAMS by default)
+        values(floats): (ny, nx, n_peaks, n_params) array of the fitted values of the peaks
+        planes(dict): {name: (ny, nx) array} the values of the points (see PLANES). The planes absent in the loaded file
+            are NaN (zeros for the integer planes)
+    """
+
+    def __init__(self, mx, my, n_peaks, names=PARAMS):
+        self.mx = np.asarray(mx, dtype=np.int64)
+        self.my = np.asarray(my, dtype=np.int64)
+        self.names = tuple(names)
+        self.__ix__ = self.mx - self.mx.min(initial=0)
+        self.__iy__ = self.my - self.my.min(initial=0)
+        shape = (int(self.__iy__.max(initial=-1)) + 1, int(self.__ix__.max(initial=-1)) + 1)
+        self.values = np.full(shape + (n_peaks, len(self.names)), np.nan)
+        self.planes = {name: np.full(shape, np.nan) if np.dtype(dtype).kind == 'f' else np.zeros(shape, dtype=dtype)
+                       for name, dtype in PLANES.items()}
+
+    @property
+    def shape(self):
+        """
+        Return (ny, nx, n_peaks, n_params) shape of the values
+        """
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        """
+        Return the memory of the arrays in bytes
+        """
+        return self.values.nbytes + sum(plane.nbytes for plane in self.planes.values())
+
+    def set_point(self, point, values, planes):
+        """
+        Set the results of the point
+        Args:
+            point(int): the number of the point in the order of mx, my
+            values(floats): (n_params, n_peaks) array of the fitted values in the order of names
+            planes(dict): {name: value} the values of the point
+        """
+        iy, ix = self.__iy__[point], self.__ix__[point]
+        self.values[iy, ix] = np.asarray(values).T
+        for name, value in planes.items():
+            self.planes[name][iy, ix] = value
+
+    def image(self, name, peak=None):
+        """
+        Return (ny, nx) image (the view of the array) of the fitted value of the peak or of the plane
+        Args:
+            name(str): the name of the fitted value (names) or of the plane (PLANES)
+            peak(int): the number of the peak (required for the fitted values)
+        """
+        if name in self.planes:
+            return self.planes[name]
+        if peak is None:
+            raise ValueError(f'The number of the peak is required for the image of {name}')
+        return self.values[:, :, peak, self.names.index(name)]
+
+    def peak(self, num):
+        """
+        Return (ny, nx, n_params) array (the view) of the fitted values of the peak num
+        """
+        return self.values[:, :, num]
+
+    def keys(self):
+        return self.names + tuple(self.planes)
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    def __getitem__(self, name):
+        """
+        Return the values of the points in the order of mx, my: (n_points, n_peaks) array of the fitted value or
+        (n_points,) array of the plane
+        """
+        if name in self.planes:
+            return self.planes[name][self.__iy__, self.__ix__]
+        if name not in self.names:
+            raise KeyError(name)
+        return self.values[self.__iy__, self.__ix__, :, self.names.index(name)]
+
+    def save(self, fname):
+        """
+        Save the results to the HDF5 file (.h5 or .hdf5 extension) or to the .npz file (the other extensions)
+        """
+        if str(fname).lower().endswith(('.h5', '.hdf5')):
+            with h5py.File(fname, 'w') as f:
+                f.attrs['names'] = list(self.names)
+                f.create_dataset('values', data=self.values, compression='gzip')
+                f.create_dataset('mx', data=self.mx)
+                f.create_dataset('my', data=self.my)
+                group = f.create_group('planes')
+                for name, plane in self.planes.items():
+                    group.create_dataset(name, data=plane, compression='gzip')
+        else:
+            np.savez(fname, values=self.values, mx=self.mx, my=self.my, names=np.array(self.names),
+                     **{'plane_' + name: plane for name, plane in self.planes.items()})
+
+
+def load(fname):
+    """
+    Return MapResult loaded from the file of MapResult.save
+    """
+    if str(fname).lower().endswith(('.h5', '.hdf5')):
+        with h5py.File(fname, 'r') as f:
+            result = MapResult(f['mx'][()], f['my'][()], f['values'].shape[2], [str(name) for name in f.attrs['names']])
+            result.values[...] = f['values'][()]
+            for name in result.planes:
+                if name in f['planes']:
+                    result.planes[name][...] = f['planes'][name][()]
+        return result
+    with np.load(fname, allow_pickle=False) as f:
+        result = MapResult(f['mx'], f['my'], f['values'].shape[2], [str(name) for name in f['names']])
+        result.values[...] = f['values']
+        for name in result.planes:
+            if 'plane_' + name in f:
+                result.planes[name][...] = f['plane_' + name]
+    return result
@@ -0,0 +1,104 @@
+"""
+The module modelcache for web-app ArDi (ArDI (Advanced spectRa Deconvolution Instrument)) keeps the constructed lmfit
+models of FittingMap. The model of the fit depends on the methods of the peaks and the baseline mode only, while the
+initial values and the bounds change from spectrum to spectrum. So the models are built once per signature and every
+fit gets the fresh Parameters of the stored model.
+
+"""
+__author__ = "Roman Shendrik"
+__copyright__ = "Copyright © 2023R"
+__license__ = "GNU GPL 3.0"
+__version__ = "0.4.0"
+
+import threading
+from collections import OrderedDict
+from baseline import CacheInfo
+
+
+class ModelTemplate(object):
+    """
+    The constructed model of the fit
+    Attributes:
+        model(object): lmfit Model or CompositeModel. The model is shared by the fits, so its param hints should not be
+            changed after the construction
+        jacobians(dict): {jac: object} the Jacobians of the model assembled for the jac modes of the fit (see
+            FittingMap.__fit_kws__). The Jacobian keeps the dependencies of the parameters, so they are found once
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.jacobians = {}
+
+    def make_params(self, values):
+        """
+        Return the new Parameters of the model with the initial values and bounds of the fit
+        Args:
+            values(dict): {param_name: {'value':, 'min':, 'max':}} the arguments of lmfit Parameter.set
+        Returns:
+            params(object): lmfit Parameters
+        """
+        params = self.model.make_params()
+        for name, hint in values.items():
+            params[name].set(**hint)
+        return params
+
+
+class ModelCache(object):
+    """
+    Bounded LRU cache of the model templates. The key is the signature of the model: the methods of the peaks, the
+    peak model and the baseline mode (see FittingMap.__model_key__).
+    Attributes:
+        maxsize(int): maximal number of the stored templates
+        hits(int): number of the fits which used the stored template
+        misses(int): number of the fits which required the model construction
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__data__ = OrderedDict()
+        self.__lock__ = threading.Lock()
+
+    def get(self, key, build):
+        """
+        Return the template of the key. The template is constructed by build() and stored if the key is absent
+        Args:
+            key(tuple): hashable signature of the model
+            build(function): function without arguments returning the lmfit model
+        Returns:
+            template(ModelTemplate)
+        """
+        with self.__lock__:
+            template = self.__data__.get(key)
+            if template is not None:
+                self.__data__.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+        template = ModelTemplate(build())
+        with self.__lock__:
+            template = self.__data__.setdefault(key, template)
+            self.__data__.move_to_end(key)
+            while len(self.__data__) > self.maxsize:
+                self.__data__.popitem(last=False)
+        return template
+
+    def info(self):
+        """
+        Return the statistics of the cache as baseline.CacheInfo(hits, misses, maxsize, currsize)
+        """
+        with self.__lock__:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self.__data__))
+
+    def clear(self):
+        """
+        Remove all templates and reset the statistics
+        """
+        with self.__lock__:
+            self.__data__.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+model_cache = ModelCache()
@@ -0,0 +1,77 @@
+"""
+The module monitor for web-app ArDi (ArDI (Advanced spectRa Deconvolution Instrument)) controls the running fits of
+FittingMap: the wall-clock budget, the cancellation by the token set from the other thread or process and the progress
+reports. The monitor is called by lmfit after every evaluation of the residual (iter_cb of lmfit Model.fit) and aborts
+the fit when the budget is spent or the token is set. The parameters of the best evaluated point are kept, so the
+aborted fit returns the best solution found before the stop.
+
+"""
+__author__ = "Roman Shendrik"
+__copyright__ = "Copyright © 2023R"
+__license__ = "GNU GPL 3.0"
+__version__ = "0.4.0"
+
+import time
+import numpy as np
+
+
+class FitMonitor(object):
+    """
+    The iter_cb of lmfit for the fits of one spectrum (all levels of the coarse-to-fine schedule and the VarPro
+    iterations)
+    Attributes:
+        deadline(double): time.time() value when the fits are stopped or None
+        cancel(object): cancellation token with is_set() method (threading.Event or multiprocessing.Event) or None
+        progress(function): function progress(nfev, chisqr, elapsed) called after every evaluation or None
+        start(double): time.time() value of the start of the fits
+        nfev(int): number of the evaluations of all fits
+        reason(str): None, 'budget' or 'cancel' - the reason of the stop
+        best(dict): {param_name: value} the varied parameters of the evaluation with the least chi-square of the current
+            fit (see reset)
+    """
+
+    def __init__(self, budget=None, deadline=None, cancel=None, progress=None):
+        self.start = time.time()
+        if budget is not None:
+            deadline = self.start + budget if deadline is None else min(deadline, self.start + budget)
+        self.deadline = deadline
+        self.cancel = cancel
+        self.progress = progress
+        self.nfev = 0
+        self.reason = None
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the best point before the next fit (the chi-square of the binned spectrum of the coarse level is not
+        comparable with the chi-square of the next level)
+        """
+        self.best = None
+        self.__chisqr__ = np.inf
+
+    def elapsed(self):
+        """
+        Return the time from the start of the fits in seconds
+        """
+        return time.time() - self.start
+
+    def stopped(self):
+        """
+        Return True if the fits should be stopped and set the reason
+        """
+        if self.reason is None:
+            if self.cancel is not None and self.cancel.is_set():
+                self.reason = 'cancel'
+            elif self.deadline is not None and time.time() > self.deadline:
+                self.reason = 'budget'
+        return self.reason is not None
+
+    def __call__(self, params, iteration, resid, *args, **kws):
+        self.nfev += 1
+        chisqr = float(np.sum(np.square(resid)))
+        if chisqr < self.__chisqr__:
+            self.__chisqr__ = chisqr
+            self.best = {name: par.value for name, par in params.items() if par.vary and par.expr is None}
+        if self.progress is not None:
+            self.progress(self.nfev, chisqr, self.elapsed())
+        return self.stopped()
@@ -0,0 +1,288 @@
+"""
+The module multipeak for web-app ArDi (ArDI (Advanced spectRa Deconvolution Instrument)) contains the lmfit model of
+the sum of many peaks evaluated by one broadcast numpy expression over (n_peaks, n_points) grid instead of the
+CompositeModel tree of the single peak models. The names of the parameters (f0_amplitude, f0_center, f0_sigma,
+f0_fwhm, f0_height, ...) and the components (f0_, f1_, ...) are the same as in the sum of lmfit peak models.
+
+"""
+__author__ = "Roman Shendrik"
+__copyright__ = "Copyright © 2023R"
+__license__ = "GNU GPL 3.0"
+__version__ = "0.4.0"
+
+import inspect
+import numpy as np
+import lmfit
+from lmfit.model import Model
+from scipy.special import wofz
+import lineshapes as ls
+
+# The peak functions of the model and their arguments
+SHAPES = {
+    'Gaussian': (ls.gaussian, ('amplitude', 'center', 'sigma')),
+    'Lorentzian': (ls.lorentzian, ('amplitude', 'center', 'sigma')),
+    'Voigt': (ls.voigt, ('amplitude', 'center', 'sigma')),
+    'PseudoVoigt': (ls.pvoigt, ('amplitude', 'center', 'sigma', 'fraction')),
+    'VoigtHumlicek': (ls.voigt_humlicek, ('amplitude', 'center', 'sigma')),
+    'VoigtTCH': (ls.voigt_tch, ('amplitude', 'center', 'sigma')),
+}
+# The lmfit models of the parameter hints of the peaks (the same name by default)
+HINTS = {'VoigtHumlicek': 'Voigt', 'VoigtTCH': 'Voigt'}
+# The closed-form derivatives of the peak functions by their arguments
+JACOBIANS = {
+    'Gaussian': ls.gaussian_jac,
+    'Lorentzian': ls.lorentzian_jac,
+    'Voigt': ls.voigt_jac,
+    'PseudoVoigt': ls.pvoigt_jac,
+    'VoigtHumlicek': ls.voigt_humlicek_jac,
+    'VoigtTCH': ls.voigt_tch_jac,
+}
+
+
+def __voigt_derived__(amplitude, center, sigma):
+    gamma = sigma
+    return {'gamma': gamma,
+            'fwhm': 1.0692 * gamma + np.sqrt(0.8664 * gamma ** 2 + 5.545083 * sigma ** 2),
+            'height': amplitude / np.maximum(ls.tiny, sigma * ls.s2pi) *
+                      wofz(1j * gamma / np.maximum(ls.tiny, sigma * ls.s2)).real}
+
+
+def __voigt_humlicek_derived__(amplitude, center, sigma):
+    return {'gamma': sigma,
+            'fwhm': 1.0692 * sigma + np.sqrt(0.8664 * sigma ** 2 + 5.545083 * sigma ** 2),
+            'height': amplitude / np.maximum(ls.tiny, sigma * ls.s2pi) * ls.humlicek(1j / ls.s2).real}
+
+
+def __voigt_tch_derived__(amplitude, center, sigma):
+    half = ls.tch_width * sigma / 2
+    return {'gamma': sigma, 'fwhm': 2 * half,
+            'height': (1 - ls.tch_fraction) * amplitude / np.maximum(ls.tiny, half * np.sqrt(np.pi / ls.log2)) +
+                      ls.tch_fraction * amplitude / np.maximum(ls.tiny, np.pi * half)}
+
+
+# The parameters calculated after the fit. The expressions are the same as fwhm/height (and gamma) constraints of the
+# lmfit peak models
+DERIVED = {
+    'Gaussian': lambda amplitude, center, sigma: {
+        'fwhm': 2.3548200 * sigma, 'height': 0.3989423 * amplitude / np.maximum(ls.tiny, sigma)},
+    'Lorentzian': lambda amplitude, center, sigma: {
+        'fwhm': 2.0 * sigma, 'height': 0.3183099 * amplitude / np.maximum(ls.tiny, sigma)},
+    'Voigt': __voigt_derived__,
+    'VoigtHumlicek': __voigt_humlicek_derived__,
+    'VoigtTCH': __voigt_tch_derived__,
+    'PseudoVoigt': lambda amplitude, center, sigma, fraction: {
+        'fwhm': 2.0 * sigma,
+        'height': (1 - fraction) * amplitude / np.maximum(ls.tiny, sigma * np.sqrt(np.pi / ls.log2)) +
+                  fraction * amplitude / np.maximum(ls.tiny, np.pi * sigma)},
+}
+
+# relative step of forward difference (the same as '2-point' scheme of scipy.optimize.least_squares)
+EPS = np.finfo(np.float64).eps ** 0.5
+
+
+def support(x, center, sigma, window):
+    """
+    Return (n_peaks, n_window) array of the indices of x around the peaks. The window of every peak contains all points
+    within center +/- window*sigma, all windows have the same length (of the widest one), so the peak functions are
+    evaluated on the (n_peaks, n_window) grid x[index] instead of the (n_peaks, n_points) grid.
+    Args:
+        x(floats): x-values of the spectrum in any order
+        center, sigma(floats): 1d arrays of the centers and widths of the peaks
+        window(double): half width of the window in units of sigma
+    Returns:
+        index(ints): the indices of x
+    """
+    order = np.argsort(x, kind='stable')
+    xs = x[order]
+    half = window * np.abs(sigma)
+    low = np.searchsorted(xs, center - half, side='left')
+    high = np.searchsorted(xs, center + half, side='right')
+    length = min(max(int((high - low).max(initial=0)), 1), len(x))
+    start = np.clip(low, 0, len(x) - length)
+    return order[start.reshape(-1, 1) + np.arange(length)]
+
+
+def __scatter__(n, index, values):
+    """
+    Return (n_peaks, n) array with the values of (n_peaks, n_window) array at the index positions and zeros elsewhere
+    """
+    out = np.zeros((len(index), n))
+    np.put_along_axis(out, index, values, axis=1)
+    return out
+
+
+def peak_model(method, prefix=''):
+    """
+    Return lmfit Model of the single peak of SHAPES method, which is absent in lmfit.models (the peaks of the composite
+    model). The bounds are the same as in the lmfit model of HINTS, the fwhm, height and gamma are the constraint
+    expressions with the values of DERIVED
+    """
+    func = SHAPES[method][0]
+
+    def peak(x, amplitude=1.0, center=0.0, sigma=1.0):
+        return func(np.asarray(x, dtype=np.float64), amplitude, center, sigma)[0]
+    peak.__name__ = method.lower()
+    model = Model(peak, prefix=prefix)
+    for name, hint in getattr(lmfit.models, HINTS.get(method, method) + 'Model')().param_hints.items():
+        if 'expr' not in hint:
+            model.set_param_hint(name, **hint)
+    # the derived values are proportional to sigma (fwhm, gamma) or amplitude/sigma (height)
+    for key, value in DERIVED[method](1.0, 0.0, 1.0).items():
+        factor = float(value)
+        if key == 'height':
+            model.set_param_hint(key, expr=f'{factor!r}*{prefix}amplitude/max(1e-15, {prefix}sigma)')
+        else:
+            model.set_param_hint(key, expr=f'{factor!r}*{prefix}sigma')
+    return model
+
+
+class MultiPeakModel(Model):
+    """
+    Sum of the peaks of SHAPES methods. The peaks of the same method are evaluated at once.
+    The fwhm, height (and gamma of Voigt) parameters are added to the fit result by post_fit.
+    Attributes:
+        methods(dict): {num: method} the number of peak (prefix 'f' + repr(num) + '_') and the name of peak function
+    """
+
+    def __init__(self, methods, **kws):
+        self.methods = dict(methods)
+        self.__groups__ = {}
+        names = []
+        hints = {}
+        for num, method in self.methods.items():
+            if method not in SHAPES:
+                raise ValueError(f'The method {method} is not supported by MultiPeakModel')
+            pref = 'f' + repr(num) + '_'
+            args = SHAPES[method][1]
+            nums, group = self.__groups__.setdefault(method, ([], [[] for _ in args]))
+            nums.append(num)
+            for arg, arg_names in zip(args, group):
+                arg_names.append(pref + arg)
+            names += [pref + arg for arg in args]
+            # the same bounds as in the lmfit peak models. The fwhm/height constraints are replaced by the values
+            # calculated in post_fit: the propagation of the uncertainties through the constraint expressions of many
+            # peaks takes more time than the fit itself
+            for name, hint in getattr(lmfit.models, HINTS.get(method, method) + 'Model')(prefix=pref).param_hints.items():
+                if 'expr' not in hint:
+                    hints[pref + name] = hint
+        super().__init__(self.__function__(names), independent_vars=['x'], param_names=names, **kws)
+        for name, hint in hints.items():
+            self.set_param_hint(name, **hint)
+
+    def __function__(self, names):
+        """
+        Return the model function with the explicit signature (x, f0_amplitude, f0_center, ...), so lmfit passes only
+        the peak parameters to it
+        """
+        def multipeak(x, **params):
+            return self.__peaks__(x, **params)
+        kind = inspect.Parameter.POSITIONAL_OR_KEYWORD
+        multipeak.__signature__ = inspect.Signature([inspect.Parameter(name, kind) for name in ['x'] + names])
+        return multipeak
+
+    def __arrays__(self, params):
+        """
+        Return {method: [arrays of the arguments]} of the peak functions from the dictionary of parameter values
+        """
+        return {method: [np.array([params[name] for name in arg_names]) for arg_names in group]
+                for method, (nums, group) in self.__groups__.items()}
+
+    def __peaks__(self, x, **params):
+        """
+        The model function. Returns the sum of all peaks
+        """
+        x = np.asarray(x, dtype=np.float64)
+        out = np.zeros(x.shape)
+        for method, args in self.__arrays__(params).items():
+            out += SHAPES[method][0](x, *args).sum(axis=0)
+        return out
+
+    def peaks(self, x, **params):
+        """
+        Return {num: y} the dictionary of the single peaks
+        """
+        x = np.asarray(x, dtype=np.float64)
+        out = {}
+        for method, args in self.__arrays__(params).items():
+            for num, y in zip(self.__groups__[method][0], SHAPES[method][0](x, *args)):
+                out[num] = y
+        return out
+
+    def unit_peaks(self, x, **params):
+        """
+        Return {num: y} the dictionary of the single peaks with unit amplitude. The amplitudes enter the model linearly:
+        the model is the sum of amplitude*unit peak (see varpro.VarPro)
+        """
+        x = np.asarray(x, dtype=np.float64)
+        out = {}
+        for method, args in self.__arrays__(params).items():
+            args = [np.ones(len(args[0]))] + args[1:]
+            for num, y in zip(self.__groups__[method][0], SHAPES[method][0](x, *args)):
+                out[num] = y
+        return out
+
+    def eval_components(self, params=None, **kwargs):
+        """
+        Evaluate each peak of the model. The keys are the prefixes of the peaks f0_, f1_, ...
+        """
+        peaks = self.peaks(**self.make_funcargs(params, kwargs))
+        return {'f' + repr(num) + '_': peaks[num] for num in sorted(peaks)}
+
+    def derivatives(self, x, window=None, **params):
+        """
+        Return {name: column} the closed-form derivatives of the model by the peak parameters (see JACOBIANS).
+        The function is used by jacobian.ModelJacobian. If window is given, the derivatives of the peak are calculated
+        within center +/- window*sigma only (see support) and are zero outside.
+        """
+        return self.__derivatives__(x, params, window, True)
+
+    def numeric_derivatives(self, x, window=None, **params):
+        """
+        Return {name: column} the derivatives of the model by the peak parameters calculated by forward differences.
+        The peaks do not depend on each other, so all peaks are differentiated at once: one evaluation of all peaks per
+        argument of the peak function. The window is the same as in derivatives.
+        """
+        return self.__derivatives__(x, params, window, False)
+
+    def __derivatives__(self, x, params, window, analytic):
+        x = np.asarray(x, dtype=np.float64)
+        out = {}
+        for method, args in self.__arrays__(params).items():
+            index = None if window is None else support(x, args[1], args[2], window)
+            if index is not None and index.shape[1] == len(x):
+                index = None
+            grid = x if index is None else x[index]
+            if analytic and method in JACOBIANS:
+                columns = JACOBIANS[method](grid, *args)
+            else:
+                columns = self.__numeric__(grid, method, args)
+            if index is not None:
+                columns = [__scatter__(len(x), index, column) for column in columns]
+            for arg_names, column in zip(self.__groups__[method][1], columns):
+                out.update(zip(arg_names, column))
+        return out
+
+    def __numeric__(self, x, method, args):
+        """
+        Forward differences of the peaks of the method. Returns the list of (n_peaks, n_points) arrays
+        """
+        func = SHAPES[method][0]
+        base = func(x, *args)
+        out = []
+        for num in range(len(args)):
+            step = EPS * np.maximum(1.0, np.abs(args[num]))
+            shifted = list(args)
+            shifted[num] = args[num] + step
+            out.append((func(x, *shifted) - base) / step.reshape(-1, 1))
+        return out
+
+    def post_fit(self, fitresult):
+        """
+        Add the fwhm and height parameters (gamma for Voigt peaks) of the peaks to the fit result
+        """
+        params = fitresult.params
+        for method, args in self.__arrays__({name: par.value for name, par in params.items()}).items():
+            for key, values in DERIVED[method](*args).items():
+                for num, value in zip(self.__groups__[method][0], values):
+                    name = 'f' + repr(num) + '_' + key
+                    params.add(name, value=float(value), vary=False)
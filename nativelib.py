@@ -0,0 +1,157 @@
+"""
+The module nativelib for web-app ArDi (ArDI (Advanced spectRa Deconvolution Instrument)) is the bridge to the
+prebuilt convolution.so/convolution.dll library with ALS and TSL curve fitting algorithms.
+The symbols are bound once at import. The numpy float64 contiguous arrays are passed to the library directly
+(numpy.ctypeslib.ndpointer) and the results are written into the caller-provided output arrays, so there is no
+element-by-element copy between numpy and ctypes buffers.
+
+"""
+__author__ = "Roman Shendrik"
+__copyright__ = "Copyright © 2023R"
+__license__ = "GNU GPL 3.0"
+__version__ = "0.4.0"
+
+from ctypes import *
+import os
+import platform
+import pathlib
+import numpy as np
+from numpy.ctypeslib import ndpointer
+
+pth_ = pathlib.Path(__file__).parent.resolve()
+# selection of OS platform
+if platform.uname()[0] == "Windows":
+    name_dll = "convolution.dll"
+    os.add_dll_directory(pth_)
+else:
+    name_dll = "convolution.so"
+
+try:
+    lib = cdll.LoadLibrary(os.path.join(pth_, name_dll))
+except OSError:
+    try:
+        lib = cdll.LoadLibrary(name_dll)
+    except OSError as error:
+        # e.g. convolution.so built against newer glibc. The callers fall back to the numpy implementations
+        print(error)
+        lib = None
+
+available = lib is not None
+
+f64_array = ndpointer(dtype=np.float64, flags='C_CONTIGUOUS')
+
+if available:
+    # void ALS(double *y, double *z, int iSize, double lam, double p, int niter)
+    lib.ALS.argtypes = [f64_array, f64_array, c_int, c_double, c_double, c_int]
+    lib.ALS.restype = None
+    # int TSLCalc(int iSize, double Tmin, double Tmax, double *vCalc, double iFactor, double iEnergy, int kOrder)
+    lib.TSLCalc.argtypes = [c_int, c_double, c_double, f64_array, c_double, c_double, c_int]
+    lib.TSLCalc.restype = c_int
+    # int TDCalc(int iSize, double Tmin, double Tmax, double *vCalc, double iFactor, double iEnergy, int kOrder)
+    lib.TDCalc.argtypes = [c_int, c_double, c_double, f64_array, c_double, c_double, c_int]
+    lib.TDCalc.restype = c_int
+    # int TSLCalcR(int iSize, double Tmin, double Tmax, double *vT, double *vCalc, double iFactor, double iEnergy,
+    # int kOrder)
+    lib.TSLCalcR.argtypes = [c_int, c_double, c_double, f64_array, f64_array, c_double, c_double, c_int]
+    lib.TSLCalcR.restype = c_int
+    # int ConvoluteA(int iSize, double *a, double *b, double *vCalc)
+    lib.ConvoluteA.argtypes = [c_int, f64_array, f64_array, f64_array]
+    lib.ConvoluteA.restype = c_int
+
+
+def __check__():
+    if not available:
+        raise OSError(f'The library {name_dll} is not loaded')
+
+
+def __output__(out, n):
+    """
+    Return the output array of length n. The out array should be float64 C-contiguous array
+    """
+    if out is None:
+        return np.empty(n, dtype=np.float64)
+    if len(out) != n:
+        raise ValueError(f'The output array should have {n} elements')
+    return out
+
+
+def als(y, lam, p, niter=10, out=None):
+    """Baseline reconstruct using ALS algorithm of the library
+        Args:
+            y: input y array for baseline construction
+            lam: 2nd derivative constraint
+            p: Weighting of positive residuals
+            niter: Number of iterations
+            out: optional output array with length of y
+        Returns:
+            out: array with constructed baseline with length of input y array
+    """
+    __check__()
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    out = __output__(out, len(y))
+    lib.ALS(y, out, len(y), lam, p, int(niter))
+    return out
+
+
+def tsl(n, t_min, t_max, factor, energy, order, out=None):
+    """Glow curve of thermoluminescence of 1 or 2 order (TSLCalc)
+        Args:
+            n: number of points
+            t_min, t_max: temperature range
+            factor: frequency factor
+            energy: activation energy
+            order: kinetic order 1 or 2
+            out: optional output array with length n
+        Returns:
+            out: not normalized glow curve
+    """
+    __check__()
+    out = __output__(out, n)
+    lib.TSLCalc(n, t_min, t_max, out, factor, energy, order)
+    return out
+
+
+def td(n, t_min, t_max, factor, energy, order, out=None):
+    """Thermally stimulated decay curve of 1 or 2 order (TDCalc). Arguments are the same as in tsl function
+    """
+    __check__()
+    out = __output__(out, n)
+    lib.TDCalc(n, t_min, t_max, out, factor, energy, order)
+    return out
+
+
+def tsl_r(n, t_min, t_max, factor, energy, order, out=None, t_out=None):
+    """Glow curve of thermoluminescence of 1 or 2 order with rectangle integration (TSLCalcR)
+        Args:
+            the same as in tsl function
+            t_out: optional output array for temperature grid
+        Returns:
+            out: not normalized glow curve
+            t_out: temperature grid of the curve
+    """
+    __check__()
+    out = __output__(out, n)
+    t_out = __output__(t_out, n)
+    lib.TSLCalcR(n, t_min, t_max, t_out, out, factor, energy, order)
+    return out, t_out
+
+
+def convolute(a, b, out=None):
+    """Discrete convolution of the library (ConvoluteA):
+        out[i] = sum(a[j]*b[i+1-j], j=0..i-1) for i=1..n-2, out[0]=0. The last element of out is not changed.
+        Args:
+            a, b: arrays of the same length n
+            out: optional output array with length n
+        Returns:
+            out: convolution
+    """
+    __check__()
+    a = np.ascontiguousarray(a, dtype=np.float64)
+    b = np.ascontiguousarray(b, dtype=np.float64)
+    if len(a) != len(b):
+        raise ValueError('The arrays should have the same length')
+    if out is None:
+        out = np.zeros(len(a), dtype=np.float64)
+    out = __output__(out, len(a))
+    lib.ConvoluteA(len(a), a, b, out)
+    return out
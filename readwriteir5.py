@@ -10,25 +10,19 @@ __version__ = "0.4.0"
 
 import struct
 import copy
-from ctypes import *
 import h5py
 import os
 import numpy as np
-import platform
 from termcolor import colored
 import time as tm
 import progressbar as pb
+import baseline as bsl
+# Library contains ALS algorithm
+import nativelib as nl
 from scipy.stats.stats import pearsonr
 
 os.system('color')
 
-# check platform
-if platform.uname()[0] == "Windows":
-    name_dll = "convolution.dll"
-else:
-    name_dll = "convolution.so"
-myclib = cdll.LoadLibrary(name_dll)
-
 
 
 class ReadWrite5(object):
@@ -36,6 +30,9 @@ class ReadWrite5(object):
     def __init__(self):
         self.lam_als = 1e7
         self.p_als = 0.01
+        self.backend_als = None
+        self.niter_als = 10
+        self.tol_als = bsl.default_tol
         self.x1=[]
         self.x2=[]
         self.y1=[]
@@ -154,9 +151,11 @@ class ReadWrite5(object):
         """Baseline reconstruct using ALS algorithm using external dll library convolution.dll
             https://zanran_storage.s3.amazonaws.com/www.science.uva.nl/ContentPages/443199618.pdf
             Asymmetric Least Squares Smoothing
-            niter - Maximum number of iterations
+            niter_als - Maximum number of iterations
+            tol_als - tolerance of the weight vector change for the early stopping (numpy engine only)
             lam - 2nd derivative constraint
             p - Weighting of positive residuals
+            backend_als - ALS engine 'native' or 'numpy'. The numpy backend is used if the library is not loaded
         
         """
         # print('fff')
@@ -164,18 +163,27 @@ class ReadWrite5(object):
         # print(y_arr)
         lam = self.lam_als
         p = self.p_als
-        niter = 10
-        py_ALS = myclib.ALS
-        py_ALS.argtypes = [POINTER(c_double), POINTER(c_double), c_int, c_double, c_double, c_int]
-        py_ALS.restype = None
-        inputarray = (c_double * len(y_arr))(*y_arr)
-        outputarray = (c_double * len(y_arr))()
-        N = c_int(len(y_arr))
-        lam_dll = c_double(lam)
-        p_dll = c_double(p)
-        py_ALS(inputarray, outputarray, N, lam_dll, p_dll, niter)
-
-        return np.array(outputarray)
+        niter = self.niter_als
+        if bsl.check_backend(self.backend_als) == 'numpy':
+            return bsl.als_numpy(y_arr, lam, p, niter, self.tol_als)
+        return nl.als(y_arr, lam, p, niter)
+
+    def __baseline_als_batch__(self, ys):
+        """Baselines of the list of spectra. The spectra of the same length are processed at once by
+            baseline.baseline_als_batch with the lam_als, p_als, niter_als, tol_als and backend_als parameters
+            Returns:
+                b_lines(list): baselines in the order of ys
+        """
+        groups = {}
+        for num, y in enumerate(ys):
+            groups.setdefault(len(y), []).append(num)
+        b_lines = [None] * len(ys)
+        for nums in groups.values():
+            Z = bsl.baseline_als_batch(np.array([ys[num] for num in nums]), self.lam_als, self.p_als, self.niter_als,
+                                       backend=self.backend_als, tol=self.tol_als)
+            for num, z in zip(nums, Z):
+                b_lines[num] = z
+        return b_lines
 
     # convert ir5 to h5
     def h5convert(self, fname, db, substraction=False):
@@ -184,12 +192,14 @@ class ReadWrite5(object):
             group_data = f.create_group('uncorrected')
             # group_data2=f.create_group('corrected')
             nrecords = db["nrecords"]
+            if substraction:
+                b_lines = self.__baseline_als_batch__([db[cnt]["ydata"] for cnt in range(nrecords)])
 
             for cnt in range(nrecords):
                 # x = np.linspace(db[cnt]["xmin"], db[cnt]["xmax"], db[cnt]["npoints"])
                 y = np.array(db[cnt]["ydata"])
                 if substraction:
-                    y = y - self.__baseline_als_dll__(y)
+                    y = y - b_lines[cnt]
                     print('Substracted')
                 name = str(db[cnt]["com1"].decode("UTF-8")).rstrip("\x00")
                 arr = np.array(y)
@@ -0,0 +1,186 @@
+"""
+The module response for web-app ArDi (ArDI (Advanced spectRa Deconvolution Instrument)) contains the instrument response
+(slit function) of the spectrometer and the lmfit model of the peaks convolved with it. The peaks of the model have the
+physical widths, while the fitted curve is the convolution of the peaks with the response. The convolution is the FFT
+convolution with the transfer function of the response (the FFT of the response sampled on the grid of the spectrum),
+which is calculated once per grid (the number of points and the step) and cached. The baseline is not convolved: it is
+estimated from the measured spectrum.
+
+"""
+__author__ = "Roman Shendrik"
+__copyright__ = "Copyright © 2023R"
+__license__ = "GNU GPL 3.0"
+__version__ = "0.4.0"
+
+import hashlib
+import inspect
+import threading
+import numpy as np
+from scipy import fft
+from lmfit.model import Model
+
+
+class InstrumentResponse(object):
+    """
+    The instrument response r(t) given by its samples. The measured spectrum is the convolution
+    y_measured(x) = sum(y(x - t)*r(t)) over the grid of the spectrum, the response is normalized to the unit sum on the
+    grid, so the areas (amplitudes) of the peaks are not changed.
+    Attributes:
+        offsets(floats): increasing offsets t from the line position in x units
+        values(floats): the response at the offsets (zero outside)
+        key(bytes): digest of the offsets and values (the signature of the fit model, see FittingMap.__model_key__)
+    """
+
+    def __init__(self, offsets, values):
+        offsets = np.asarray(offsets, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if offsets.ndim != 1 or offsets.shape != values.shape or len(offsets) < 2:
+            raise ValueError('The instrument response requires the 1d arrays of offsets and values of the same length')
+        order = np.argsort(offsets, kind='stable')
+        self.offsets = offsets[order]
+        self.values = values[order]
+        self.key = hashlib.blake2b(self.offsets.tobytes() + self.values.tobytes(), digest_size=16).digest()
+        self.__transfer__ = {}
+        self.__lock__ = threading.Lock()
+
+    def __getstate__(self):
+        # the transfer functions are calculated again in the worker processes
+        return {'offsets': self.offsets, 'values': self.values, 'key': self.key}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__transfer__ = {}
+        self.__lock__ = threading.Lock()
+
+    def kernel(self, step):
+        """
+        Return the samples of the response at the offsets j*step (j = -m..m) normalized to the unit sum. The step is
+        negative for the decreasing x
+        """
+        size = int(np.ceil(max(-self.offsets[0], self.offsets[-1]) / abs(step)))
+        grid = np.arange(-size, size + 1) * step
+        out = np.interp(grid, self.offsets, self.values, left=0.0, right=0.0)
+        total = out.sum()
+        if total <= 0:
+            # the response is narrower than the step
+            out = (grid == 0).astype(np.float64)
+            total = 1.0
+        return out / total
+
+    def transfer(self, n, step):
+        """
+        Return (length of FFT, m, transfer function) of the grid of n points with the step. The transfer functions are
+        cached by the grid
+        """
+        key = (n, float(step))
+        with self.__lock__:
+            out = self.__transfer__.get(key)
+        if out is None:
+            kernel = self.kernel(step)
+            size = fft.next_fast_len(n + len(kernel) - 1, real=True)
+            out = (size, len(kernel) // 2, fft.rfft(kernel, size))
+            with self.__lock__:
+                self.__transfer__[key] = out
+        return out
+
+    def convolve(self, x, y):
+        """
+        Return the convolution of y with the response over the uniform grid x. The values of y outside the grid are
+        zeros
+        Args:
+            x(floats): x-values of the spectrum (increasing or decreasing with the constant step)
+            y(floats): 1d array of len(x) values or 2d array (n_curves, len(x)), every row is convolved
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        n = len(x)
+        if n < 2:
+            return y.copy()
+        size, half, transfer = self.transfer(n, (x[-1] - x[0]) / (n - 1))
+        out = fft.irfft(fft.rfft(y, size, axis=-1) * transfer, size, axis=-1)
+        return out[..., half:half + n]
+
+
+def make_response(irf, x=None):
+    """
+    Return InstrumentResponse of params['irf'] of FittingMap
+    Args:
+        irf: InstrumentResponse, [offsets, values] (2 x m array-like) or 1d array of the samples of the response on the
+            step of the spectrum x with the line position at the middle sample
+        x(floats): x-values of the spectrum (required for the 1d samples)
+    """
+    if isinstance(irf, InstrumentResponse):
+        return irf
+    irf = np.asarray(irf, dtype=np.float64)
+    if irf.ndim == 2:
+        return InstrumentResponse(irf[0], irf[1])
+    if x is None or len(x) < 2:
+        raise ValueError('The samples of the instrument response require the x-values of the spectrum')
+    step = abs(x[-1] - x[0]) / (len(x) - 1)
+    return InstrumentResponse((np.arange(len(irf)) - (len(irf) - 1) / 2) * step, irf)
+
+
+class ConvolvedModel(Model):
+    """
+    The additive model of the peaks (MultiPeakModel, GlowModel, lmfit peak models and their sums) convolved with the
+    instrument response. The parameters, the param hints and the components (f0_, f1_, ...) are the same as in the
+    model of the peaks, the components are convolved.
+    Attributes:
+        model(object): lmfit model of the peaks
+        response(object): InstrumentResponse
+    """
+
+    def __init__(self, model, response, **kws):
+        self.model = model
+        self.response = response
+        names = list(model.param_names)
+        super().__init__(self.__function__(names), independent_vars=['x'], param_names=names, **kws)
+        for basename, hint in model.param_hints.items():
+            self.param_hints[model.prefix + basename] = hint
+
+    def __function__(self, names):
+        """
+        Return the model function with the explicit signature (x, f0_amplitude, f0_center, ...)
+        """
+        def convolved(x, **params):
+            return self.response.convolve(x, self.model.eval(x=x, **params))
+        kind = inspect.Parameter.POSITIONAL_OR_KEYWORD
+        convolved.__signature__ = inspect.Signature([inspect.Parameter(name, kind) for name in ['x'] + names])
+        return convolved
+
+    def eval_components(self, params=None, **kwargs):
+        """
+        Evaluate each convolved peak of the model. The keys are the components of the model of the peaks
+        """
+        args = self.make_funcargs(params, kwargs)
+        x = args.pop('x')
+        comps = self.model.eval_components(x=x, **args)
+        names = list(comps)
+        if not names:
+            return {}
+        return dict(zip(names, self.response.convolve(x, np.array([comps[name] for name in names]))))
+
+    def derivatives(self, x, functions=None, **params):
+        """
+        Return {name: column} the convolved derivatives of the peaks by their parameters. The function is used by
+        jacobian.ModelJacobian
+        Args:
+            x(floats): x-values of the spectrum
+            functions(dict): {component: function} the derivatives of the components of the model of the peaks (see
+                jacobian.ModelJacobian). The parameters of the other components are differentiated numerically
+            params: the values of the parameters
+        """
+        out = {}
+        for comp in self.model.components:
+            if comp in (functions or {}):
+                columns = functions[comp](**comp.make_funcargs(None, dict(params, x=x)))
+                for name, column in columns.items():
+                    name = comp.prefix + name
+                    out[name] = out[name] + column if name in out else column
+        names = list(out)
+        if not names:
+            return {}
+        return dict(zip(names, self.response.convolve(x, np.array([out[name] for name in names]))))
+
+    def post_fit(self, fitresult):
+        self.model.post_fit(fitresult)
@@ -0,0 +1,166 @@
+"""
+The module sharedcube for web-app ArDi (ArDI (Advanced spectRa Deconvolution Instrument)) contains the spectral cube of
+the hyperspectral map in the shared memory (multiprocessing.shared_memory). The spectra of the map are copied once into
+(n_points, n_values) float array, the worker processes of FittingMap.find_intensity attach to the array by its name and
+read the spectra by the numbers of the points, so the tasks of the pool contain the numbers of the points only and the
+spectra are not serialized.
+
+"""
+__author__ = "Roman Shendrik"
+__copyright__ = "Copyright © 2023R"
+__license__ = "GNU GPL 3.0"
+__version__ = "0.4.0"
+
+import sys
+import numpy as np
+from multiprocessing import shared_memory
+
+# The values of the map item (see FittingMap.map_intensity) stored in the meta array of the cube
+FIELDS = ('mx', 'my', 'nv', 'nr', 'x1', 'x2', 'step')
+# The integer fields of the map item
+INTEGERS = ('mx', 'my', 'nv', 'nr')
+
+
+class SharedArray(object):
+    """
+    The numpy array in the shared memory block. The pickled array is the name of the block, so the unpickled array in
+    the other process is attached to the same memory.
+    Attributes:
+        name(str): the name of the shared memory block
+        shape(tuple): the shape of the array
+        dtype(object): numpy dtype of the array
+        array(object): numpy array of the block (None after close)
+    """
+
+    def __init__(self, shape, dtype=np.float64, name=None):
+        self.shape = tuple(int(size) for size in shape)
+        self.dtype = np.dtype(dtype)
+        self.__owner__ = name is None
+        size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+        self.__attach__(name, size)
+
+    def __attach__(self, name, size=0):
+        if name is None:
+            self.__shm__ = shared_memory.SharedMemory(create=True, size=size)
+        elif sys.version_info >= (3, 13):
+            # the attached block is unlinked by the owner only
+            self.__shm__ = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            # the worker processes share the resource tracker of the owner, so the block is registered once
+            self.__shm__ = shared_memory.SharedMemory(name=name)
+        self.name = self.__shm__.name
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.__shm__.buf)
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype.str}
+
+    def __setstate__(self, state):
+        self.shape = state['shape']
+        self.dtype = np.dtype(state['dtype'])
+        self.__owner__ = False
+        self.__attach__(state['name'])
+
+    def close(self):
+        """
+        Close the access to the block. The block of the owner is unlinked (released)
+        """
+        if self.array is None:
+            return
+        self.array = None
+        self.__shm__.close()
+        if self.__owner__:
+            self.__shm__.unlink()
+
+
+class MapCube(object):
+    """
+    The spectra of the hyperspectral map in the (n_points, n_values) array padded by NaN (the spectra of the map may
+    have different lengths) and the meta array of the items (FIELDS). The optional baselines of the cropped spectra (see
+    FittingMap.__map_baselines__) are kept in the same way.
+    Attributes:
+        spectra(floats): (n_points, n_values) array of the spectra
+        lengths(ints): the lengths of the spectra
+        meta(floats): (n_points, len(FIELDS)) array of the values of the items
+        baselines(floats): (n_points, n_values) array of the baselines or None
+        baseline_lengths(ints): the lengths of the baselines or None
+    """
+
+    def __init__(self, items, baselines=None):
+        """
+        Args:
+            items(iterable): the items of the hyperspectral map [np.array(spectrum), mx, my, nv, nr, x1, x2, step]
+            baselines(list): the baselines of the cropped spectra of the items or None
+        """
+        items = list(items)
+        self.__blocks__ = {}
+        self.__blocks__['meta'] = SharedArray((len(items), len(FIELDS)))
+        for num, item in enumerate(items):
+            self.__blocks__['meta'].array[num] = [float(item[index + 1]) for index in range(len(FIELDS))]
+        self.__pad__('spectra', 'lengths', [item[0] for item in items])
+        if baselines is not None:
+            self.__pad__('baselines', 'baseline_lengths', baselines)
+        self.__views__()
+
+    def __pad__(self, key, lengths_key, rows):
+        """
+        Copy the rows into the shared (len(rows), max length) block padded by NaN. The rows are written to the shared
+        memory directly, so the cube is not built in the memory of the process first
+        """
+        lengths = SharedArray((len(rows),), np.int64)
+        lengths.array[...] = [len(row) for row in rows]
+        block = SharedArray((len(rows), int(lengths.array.max(initial=0))))
+        block.array[...] = np.nan
+        for num, row in enumerate(rows):
+            block.array[num, :len(row)] = row
+        self.__blocks__[key] = block
+        self.__blocks__[lengths_key] = lengths
+
+    def __views__(self):
+        arrays = {key: block.array for key, block in self.__blocks__.items()}
+        self.spectra = arrays['spectra']
+        self.lengths = arrays['lengths']
+        self.meta = arrays['meta']
+        self.baselines = arrays.get('baselines')
+        self.baseline_lengths = arrays.get('baseline_lengths')
+
+    def __getstate__(self):
+        return {'blocks': self.__blocks__}
+
+    def __setstate__(self, state):
+        self.__blocks__ = state['blocks']
+        self.__views__()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def item(self, num):
+        """
+        Return the item of the point num (see FittingMap.map_intensity). The spectrum and the baseline are the views of
+        the arrays of the cube
+        """
+        meta = self.meta[num]
+        item = [self.spectra[num, :self.lengths[num]]]
+        item += [int(value) if name in INTEGERS else float(value) for name, value in zip(FIELDS, meta)]
+        if self.baselines is not None:
+            item.append(self.baselines[num, :self.baseline_lengths[num]])
+        return item
+
+    def __getitem__(self, num):
+        return self.item(num)
+
+    @property
+    def nbytes(self):
+        """
+        Return the memory of the arrays in bytes
+        """
+        return sum(array.nbytes for array in (self.spectra, self.lengths, self.meta, self.baselines,
+                                              self.baseline_lengths) if array is not None)
+
+    def close(self):
+        """
+        Close the shared memory blocks of the cube (the blocks are released by the process created the cube)
+        """
+        self.spectra = self.lengths = self.meta = self.baselines = self.baseline_lengths = None
+        for block in self.__blocks__.values():
+            block.close()
+        self.__blocks__ = {}
@@ -0,0 +1,157 @@
+"""
+The module varpro for web-app ArDi (ArDI (Advanced spectRa Deconvolution Instrument)) contains the variable projection
+(VarPro) fitting of the peaks of multipeak.MultiPeakModel. The amplitudes of the peaks enter the model linearly, so for
+every trial set of the nonlinear parameters (centers, widths, baseline) the amplitudes are found by bounded linear least
+squares and only the nonlinear parameters are iterated by least_squares. The Jacobian of the projected residual is the
+Kaufman approximation assembled from the Jacobian of the whole model (jacobian.ModelJacobian).
+
+"""
+__author__ = "Roman Shendrik"
+__copyright__ = "Copyright © 2023R"
+__license__ = "GNU GPL 3.0"
+__version__ = "0.4.0"
+
+from copy import deepcopy
+import numpy as np
+from scipy.optimize import least_squares, lsq_linear
+import jacobian as jc
+import multipeak as mp
+
+
+class __Stop__(Exception):
+    """
+    The fit is stopped by iter_cb
+    """
+
+
+def is_supported(model):
+    """
+    Return True if the amplitudes of the model can be eliminated: the model is the sum of models with one
+    multipeak.MultiPeakModel component
+    """
+    return jc.is_additive(model) and sum(isinstance(comp, mp.MultiPeakModel) for comp in model.components) == 1
+
+
+class VarPro(object):
+    """
+    Variable projection fitting of the additive model with multipeak.MultiPeakModel peaks.
+    Attributes:
+        model(object): lmfit Model or CompositeModel (see is_supported)
+        jacobian(object): jacobian.ModelJacobian of the model
+        peaks(object): multipeak.MultiPeakModel component of the model
+        nfev(int): number of the residual evaluations of the last fit
+        njev(int): number of the Jacobian evaluations of the last fit
+    """
+
+    def __init__(self, model, jacobian):
+        if not is_supported(model):
+            raise ValueError('The variable projection requires the sum of models with one MultiPeakModel')
+        self.model = model
+        self.jacobian = jacobian
+        self.peaks = [comp for comp in model.components if isinstance(comp, mp.MultiPeakModel)][0]
+        self.nfev = 0
+        self.njev = 0
+        self.__state__ = None
+
+    @staticmethod
+    def __free__(par):
+        return par.vary and par.expr is None and par.min < par.max
+
+    def __project__(self, theta, params, data, kwargs):
+        """
+        Set the nonlinear parameters theta, solve the amplitudes and return the state (theta, residual, basis of the
+        amplitudes, mask of the amplitudes inside the bounds)
+        """
+        if self.__state__ is not None and np.array_equal(self.__state__[0], theta):
+            return self.__state__
+        for name, value in zip(self.__nonlinear__, theta):
+            params[name].value = value
+        params.update_constraints()
+        units = self.peaks.unit_peaks(**self.peaks.make_funcargs(params, kwargs))
+        basis = np.array([units[num] for num in self.__nums__]).T
+        # the rest of the model (baseline, other components and the peaks with fixed amplitudes) does not depend on the
+        # free amplitudes
+        rest = np.zeros(len(data))
+        for comp in self.model.components:
+            if comp is not self.peaks:
+                rest += comp.eval(params=params, **kwargs)
+        for num in self.peaks.methods:
+            if num not in self.__nums__:
+                rest += params['f' + repr(num) + '_amplitude'].value * units[num]
+        target = data - rest
+        lower = [params[name].min for name in self.__linear__]
+        upper = [params[name].max for name in self.__linear__]
+        solution = lsq_linear(basis, target, bounds=(lower, upper), method='bvls')
+        for name, value in zip(self.__linear__, solution.x):
+            params[name].value = value
+        self.__state__ = (theta.copy(), target - basis @ solution.x, basis, solution.active_mask == 0)
+        return self.__state__
+
+    def fit(self, data, params, ftol=1e-8, xtol=1e-8, gtol=1e-8, max_nfev=None, iter_cb=None, **kwargs):
+        """
+        Fit the model by variable projection
+        Args:
+            data(floats): y-values of the spectrum
+            params(object): lmfit Parameters with the initial values and bounds. The parameters are not changed
+            ftol, xtol, gtol(double): tolerances of least_squares
+            max_nfev(int): maximal number of the residual evaluations
+            iter_cb(function): the function iter_cb(params, nfev, residual) called after every evaluation of the
+                residual as iter_cb of lmfit. If it returns True, the fit is stopped at the best evaluated point
+            kwargs: independent variables of the model (x, t)
+        Returns:
+            params(object): lmfit Parameters of the solution
+        """
+        params = deepcopy(params)
+        data = np.asarray(data, dtype=np.float64)
+        self.__linear__ = []
+        self.__nums__ = []
+        for num in sorted(self.peaks.methods):
+            name = 'f' + repr(num) + '_amplitude'
+            if self.__free__(params[name]):
+                self.__linear__.append(name)
+                self.__nums__.append(num)
+        self.__nonlinear__ = [name for name, par in params.items()
+                              if self.__free__(par) and name not in self.__linear__]
+        self.__state__ = None
+        self.nfev = 0
+        self.njev = 0
+        best = [np.inf, None]
+
+        def residual(theta):
+            self.nfev += 1
+            resid = self.__project__(theta, params, data, kwargs)[1]
+            if iter_cb is not None:
+                chisqr = np.sum(resid ** 2)
+                if chisqr < best[0]:
+                    best[:] = [chisqr, theta.copy()]
+                if iter_cb(params, self.nfev, resid):
+                    raise __Stop__()
+            return resid
+
+        def jacobian(theta):
+            self.njev += 1
+            state = self.__project__(theta, params, data, kwargs)
+            var_names = [name for name, par in params.items() if par.vary and par.expr is None]
+            full = self.jacobian(params, data, None, **kwargs)
+            jac = full[:, [var_names.index(name) for name in self.__nonlinear__]]
+            # Kaufman approximation: the derivatives are projected on the complement of the span of the free
+            # amplitude columns
+            basis = state[2][:, state[3]]
+            if basis.shape[1]:
+                q = np.linalg.qr(basis)[0]
+                jac = jac - q @ (q.T @ jac)
+            return jac
+
+        theta = np.array([params[name].value for name in self.__nonlinear__], dtype=np.float64)
+        if len(theta):
+            # bg_lam is about 1e8 and the centers are about 1e3, so the steps are scaled by the Jacobian columns
+            bounds = ([params[name].min for name in self.__nonlinear__],
+                      [params[name].max for name in self.__nonlinear__])
+            try:
+                result = least_squares(residual, theta, jac=jacobian, bounds=bounds, method='trf', x_scale='jac',
+                                       ftol=ftol, xtol=xtol, gtol=gtol, max_nfev=max_nfev)
+                theta = result.x
+            except __Stop__:
+                theta = best[1]
+        self.__project__(theta, params, data, kwargs)
+        return params
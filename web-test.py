@@ -558,16 +558,20 @@ app.layout = html.Div([
                                     {'id': 'l_amplitude_max', 'name': 'A_max scaler', "hideable": True},
                                     {'id': 'l_width_min', 'name': 'S_min scaler', "hideable": True},
                                     {'id': 'l_width_max', 'name': 'S_max scaler', "hideable": True},
+                                    {'id': 'lock', 'name': 'Lock', 'presentation': 'dropdown', "hideable": True},
                                    ],
                         editable = True, export_format='csv',
                         dropdown = {
                                     'p_method': {
-                                    'options': [{'label': i, 'value': i} for i in ['PseudoVoigt', 'Gaussian', 'Voigt', 
+                                    'options': [{'label': i, 'value': i} for i in ['PseudoVoigt', 'Gaussian', 'Voigt', 'VoigtHumlicek', 'VoigtTCH',
                                                                                     'Lorentzian','Pearson4','Pearson7',
                                                                                     'DampedHarmonicOscillator','StudentsT', 
                                                                                     'Moffat','SplitLorentzian'
                                                                                   ]
                                                ]
+                                                },
+                                    'lock': {
+                                    'options': [{'label': i, 'value': i} for i in ['no', 'yes']]
                                                 }
                                   }
                                             ), html.Button('Add Row', id='editing-rows-button', n_clicks=0)], style={'margin-left': '5%', 'margin-right': '5%', 'width' : '90%'}, className="table-responsive"),
@@ -730,55 +734,19 @@ def parse_contents(contents,filename):
                 Output('table-dropdown-als', 'data'),
                 Input('submit-remove', 'n_clicks'),
                 [State('b', 'data')],
+                State('table-dropdown-als', 'data'),
                 prevent_initial_call = True,
               )
               
-def remove_bgrnd(n_clicks, res_):
-    centers_=res_
-    ahead=0.5
-    while not centers_['peaks']:
-        ahead=ahead-0.1
-        centers_=fnd.peakdetect(res_['spectrum'][0],res_['spectrum'][1],1,ahead)
-        if ahead<0.1: return res_, [{'l_p_min': 0.0001, 'p_p': 0.01, 'l_p_max': 0.07, 'l_lam_min': 1e6, 'p_lam': 1e7, 'l_lam_max': 1e9}]
-    
+def remove_bgrnd(n_clicks, res_, table_als):
+    # The baseline is constructed by arPLS method. The weights of arPLS are tuned by the residuals, so the baseline is
+    # found without the multi-peak fit of lam and p. The ALS settings table is not changed
+    if not table_als:
+        table_als=[{'l_p_min': 0.0001, 'p_p': 0.01, 'l_p_max': 0.07, 'l_lam_min': 1e6, 'p_lam': 1e7, 'l_lam_max': 1e9}]
     c_={}
     c_=res_
-    table_par=[]
-    for i in centers_['peaks']:
-        table_par.append({'p_center': i, 'p_amplitude': 1, 
-                        'p_width': 4,'p_method': 'PseudoVoigt', 'l_center_min': 5, 
-                        'l_center_max': 5, 'l_amplitude_min': 0, 'l_amplitude_max': 100, 
-                        'l_width_min': 0.2, 'l_width_max':5
-                        
-                        })
-    table_als=[{'l_p_min': 0.0001, 'p_p': 0.01, 'l_p_max': 0.07, 'l_lam_min': 1e6, 'p_lam': 1e7, 'l_lam_max': 1e9}]
-    tolerance=1e12
-    max_nfev=500
-    data_ = fnd.fitcurve(
-                            res_['spectrum'][0],
-                            res_['spectrum'][1],
-                            str(centers_['peaks']), 
-                            parameters = table_par, 
-                            parameter_als = table_als, 
-                            tolerance = tolerance,
-                            max_nfev=max_nfev
-                        )
-
-    for model_name, model_value in data_['components'].items():
-        if model_name == 'bg_': c_['spectrum'][1]=c_['spectrum'][1] - model_value 
-  
-    # fig = go.Figure()
-    # fig = fig.add_trace(go.Scatter(
-                                    # x = c_['spectrum'][0], 
-                                    # y = c_['spectrum'][1],
-                                    # mode = 'lines',
-                                    # name = 'Substracted baseline spectrum'
-                                    # ),
-                       # )
-    p_=data_['params']['p'].value
-    l_=data_['params']['lam'].value
-    als_settings = [{'l_p_min': p_/100.0, 'p_p': p_, 'l_p_max': p_*10, 'l_lam_min': l_/100.0, 'p_lam': l_, 'l_lam_max': l_*100}]
-    return c_, als_settings  
+    c_['spectrum'][1], b_line = fnd.remove_baseline(res_['spectrum'][1], lam=float(table_als[0]['p_lam']), method='arpls')
+    return c_, table_als  
 # Plot the uploaded spectrum callback
        
 @app.callback(
@@ -808,7 +776,7 @@ def update_line_chart(contents):
                 The dictionary is uploaded from the b container.                
             Output:
                 params (list): list containing the generated fitting parameters for table-dropdown object. The number of elements in the list is the number of peaks. Every element of the list is dictionary with the following structure:
-                {'p_center': value, 'p_amplitude': data_['ampl'][num], 'p_width': 4,'p_method': 'PseudoVoigt', 'l_center_min': 5, 'l_center_max': 5, 'l_amplitude_min': 0, 'l_amplitude_max': 1000, 'l_width_min': 0.2, 'l_width_max':20}
+                {'p_center': value, 'p_amplitude': data_['ampl'][num], 'p_width': 4,'p_method': 'PseudoVoigt', 'l_center_min': 5, 'l_center_max': 5, 'l_amplitude_min': 0, 'l_amplitude_max': 1000, 'l_width_min': 0.2, 'l_width_max':20, 'lock': 'no'}
                 fig (dict) - dictionary for plot figure
                 data_['look'] (int): the value of lookahead parameter of peakfit
                 data_['delta'] (float): the value of lambda parameter of peakfit
@@ -834,7 +802,7 @@ def update_line_chart(contents):
                         {'p_center': value, 'p_amplitude': data_['ampl'][num], 
                         'p_width': 4,'p_method': 'PseudoVoigt', 'l_center_min': 5, 
                         'l_center_max': 5, 'l_amplitude_min': 0, 'l_amplitude_max': 1000, 
-                        'l_width_min': 0.2, 'l_width_max':20
+                        'l_width_min': 0.2, 'l_width_max':20, 'lock': 'no'
                         }
                       )
     datum = {'x': data_['spectrum'][0], 'y': data_['spectrum'][1]}
@@ -1042,6 +1010,7 @@ def add_row(n_clicks, rows, columns):
                 Output('download-link-peaks', 'href'),
                 Output('download-link-params', 'href'),
                 Output('download-link-fit-nobline', 'href'),
+                Output('c', 'data'),
                 #Output('table-dropdown','data', allow_duplicate = True),
                 #Output('table-dropdown-als', 'data', allow_duplicate = True),
                 Input('submit-fit', 'n_clicks'),
@@ -1052,12 +1021,15 @@ def add_row(n_clicks, rows, columns):
                 State('max_nfev', 'value'),
                 State('table-dropdown','data'),
                 State('table-dropdown-als', 'data'),
+                State('c', 'data'),
                 prevent_initial_call = True,
             )
  
     
-def update_fitline_chart(n_clicks, peaks, data0_, filename, tolerance,max_nfev, table_par, table_als):
-
+def update_fitline_chart(n_clicks, peaks, data0_, filename, tolerance,max_nfev, table_par, table_als, state):
+    # The fit starts from the solution of the previous fit of the spectrum for the rows of the tables which are not
+    # changed (see fnd.warm_start), the rows with the lock flag are not varied
+    start = fnd.warm_start(data0_['spectrum'][1], table_par, table_als, state)
     data_ = fnd.fitcurve(
                             data0_['spectrum'][0],
                             data0_['spectrum'][1],
@@ -1065,8 +1037,10 @@ def update_fitline_chart(n_clicks, peaks, data0_, filename, tolerance,max_nfev,
                             parameters = table_par, 
                             parameter_als = table_als, 
                             tolerance = tolerance,
-                            max_nfev=max_nfev
+                            max_nfev=max_nfev,
+                            start = start
                         )
+    state = fnd.fit_state(data0_['spectrum'][1], table_par, table_als, data_)
                         
     fig = go.Figure()
     df_peaks = {}
@@ -1140,7 +1114,7 @@ def update_fitline_chart(n_clicks, peaks, data0_, filename, tolerance,max_nfev,
     fig.update_layout(title = filename[:16]+". R-Square: {0:.4f}".format(data_["params"]["R-Square"]),
     xaxis_title = "Wavenumber, cm-1",
     yaxis_title = "Intensity")   
-    return fig, csv_string_s, csv_string_f, csv_string_p, csv_string_pa, csv_string_f_nb 
+    return fig, csv_string_s, csv_string_f, csv_string_p, csv_string_pa, csv_string_f_nb, state
 
 
     